@@ -112,6 +112,7 @@ be used in any part irrespective of the plugin, these are
 """
 
 import contextlib
+import json
 import os
 import shutil
 
@@ -121,6 +122,10 @@ from snapcraft import sources
 
 class BasePlugin:
 
+    # Plugins whose build only redoes what changed since the previous one,
+    # as make does, set this to keep build_basedir between builds.
+    incremental_build = False
+
     @classmethod
     def schema(cls):
         """Return a json-schema for the plugin's properties as a dictionary.
@@ -153,13 +158,26 @@ class BasePlugin:
                 'source-subdir': {
                     'type': 'string',
                     'default': None,
-                }
+                },
+                'source-checksum': {
+                    'type': 'string',
+                    'default': None,
+                },
             },
             'required': [
                 'source',
             ]
         }
 
+    @property
+    def subsourcedir(self):
+        """The directory in sourcedir to build from, as set by source-subdir.
+        """
+        source_subdir = getattr(self.options, 'source_subdir', None)
+        if source_subdir:
+            return os.path.join(self.sourcedir, source_subdir)
+        return self.sourcedir
+
     @property
     def PLUGIN_STAGE_SOURCES(self):
         """Define additional sources.list."""
@@ -181,6 +199,9 @@ class BasePlugin:
         self.installdir = os.path.join(self.partdir, 'install')
 
         self.build_basedir = os.path.join(self.partdir, 'build')
+        # What was copied from sourcedir by the previous build.
+        self._build_manifest = os.path.join(
+            self.partdir, 'build-sources.json')
         source_subdir = getattr(self.options, 'source_subdir', None)
         if source_subdir:
             self.builddir = os.path.join(self.build_basedir, source_subdir)
@@ -207,6 +228,16 @@ class BasePlugin:
         if getattr(self.options, 'source', None):
             sources.get(self.sourcedir, self.build_basedir, self.options)
 
+    def prefetch(self):
+        """Fetch what pull needs into the shared user caches.
+
+        This is what `snapcraft prefetch` runs for the part, it must not
+        touch the part directories. The base implementation prefetches the
+        source, override or inherit from this method if pull downloads more.
+        """
+        if getattr(self.options, 'source', None):
+            sources.prefetch(self.sourcedir, self.options)
+
     def clean_pull(self):
         """Clean the pulled source for this part.
 
@@ -226,15 +257,34 @@ class BasePlugin:
         The base implementation only copies sourcedir to build_basedir.
         Override this method if you need to process the source code to make it
         runnable.
-        """
 
+        For plugins with incremental_build set, only the files changed since
+        the previous build are copied and what the previous build left in
+        build_basedir is kept.
+        """
+        if not self.incremental_build:
+            if os.path.exists(self.build_basedir):
+                shutil.rmtree(self.build_basedir)
+            if os.path.exists(self._build_manifest):
+                os.remove(self._build_manifest)
+
+            shutil.copytree(
+                self.sourcedir, self.build_basedir, symlinks=True,
+                ignore=lambda d, s: common.SNAPCRAFT_FILES
+                if d is self.sourcedir else [])
+            return
+
+        manifest = {}
         if os.path.exists(self.build_basedir):
-            shutil.rmtree(self.build_basedir)
+            with contextlib.suppress(FileNotFoundError, ValueError):
+                with open(self._build_manifest) as f:
+                    manifest = json.load(f)
 
-        shutil.copytree(
-            self.sourcedir, self.build_basedir, symlinks=True,
-            ignore=lambda d, s: common.SNAPCRAFT_FILES
-            if d is self.sourcedir else [])
+        manifest = common.sync_tree(
+            self.sourcedir, self.build_basedir, manifest,
+            ignore=common.SNAPCRAFT_FILES)
+        with open(self._build_manifest, 'w') as f:
+            json.dump(manifest, f)
 
     def clean_build(self):
         """Clean the artifacts that resulted from building this part.
@@ -247,6 +297,9 @@ class BasePlugin:
         if os.path.exists(self.build_basedir):
             shutil.rmtree(self.build_basedir)
 
+        if os.path.exists(self._build_manifest):
+            os.remove(self._build_manifest)
+
         if os.path.exists(self.installdir):
             shutil.rmtree(self.installdir)
 
@@ -16,17 +16,28 @@
 
 # Data/methods shared between plugins and snapcraft
 
+import concurrent.futures
+import contextlib
+import fcntl
 import glob
+import hashlib
 import logging
+import mmap
 import multiprocessing
 import os
 import platform
+import shutil
+import stat
 import subprocess
 import tempfile
+import threading
 import urllib
 
+from xdg import BaseDirectory
 
-SNAPCRAFT_FILES = ['snapcraft.yaml', 'parts', 'stage', 'snap']
+
+SNAPCRAFT_FILES = ['snapcraft.yaml', 'snapcraft.lock', 'parts', 'stage',
+                   'snap']
 COMMAND_ORDER = ['pull', 'build', 'stage', 'strip']
 _DEFAULT_ENABLE_PARALLEL_BUILDS = True
 _enable_parallel_builds = _DEFAULT_ENABLE_PARALLEL_BUILDS
@@ -34,6 +45,21 @@ _DEFAULT_PLUGINDIR = '/usr/share/snapcraft/plugins'
 _plugindir = _DEFAULT_PLUGINDIR
 _DEFAULT_SCHEMADIR = '/usr/share/snapcraft/schema'
 _schemadir = _DEFAULT_SCHEMADIR
+_DEFAULT_CACHEDIR = os.path.join(BaseDirectory.xdg_cache_home, 'snapcraft')
+_cachedir = _DEFAULT_CACHEDIR
+_refresh_indexes = False
+# Files starting with one of these are never searched by replace_in_file.
+_BINARY_MAGIC = (
+    b'\x7fELF', b'!<arch>\n', b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00',
+    b'PK\x03\x04', b'\x89PNG',
+)
+_BINARY_PROBE_SIZE = 1024
+# ioctl sharing the extents of a file with another, on btrfs or xfs.
+_FICLONE = 0x40049409
+_offline = False
+_jobserver = None
+_path_locks = {}
+_path_locks_lock = threading.Lock()
 
 host_machine = platform.machine()
 target_machine = host_machine
@@ -47,12 +73,21 @@ def assemble_env():
     return '\n'.join(['export ' + e for e in env])
 
 
+def _pass_jobserver_fds(kwargs):
+    # Only the makes run with get_parallel_build_args() use the jobserver,
+    # but they need its pipe.
+    if _jobserver:
+        kwargs['pass_fds'] = \
+            tuple(kwargs.get('pass_fds', ())) + _jobserver.fds
+
+
 def run(cmd, **kwargs):
     assert isinstance(cmd, list), 'run command must be a list'
     # FIXME: This is gross to keep writing this, even when env is the same
     with tempfile.NamedTemporaryFile(mode='w+') as f:
         f.write(assemble_env())
         f.write('\n')
+        _pass_jobserver_fds(kwargs)
         f.write('exec $*')
         f.flush()
         subprocess.check_call(['/bin/sh', f.name] + cmd, **kwargs)
@@ -64,6 +99,7 @@ def run_output(cmd, **kwargs):
     with tempfile.NamedTemporaryFile(mode='w+') as f:
         f.write(assemble_env())
         f.write('\n')
+        _pass_jobserver_fds(kwargs)
         f.write('exec $*')
         f.flush()
         return subprocess.check_output(['/bin/sh', f.name] + cmd,
@@ -183,6 +219,59 @@ def get_schemadir():
     return _schemadir
 
 
+def set_cachedir(cachedir):
+    global _cachedir
+    _cachedir = cachedir
+
+
+def get_cachedir():
+    """Return the user level cache directory shared by all projects."""
+    return _cachedir
+
+
+def set_refresh_indexes(refresh):
+    global _refresh_indexes
+    _refresh_indexes = refresh
+
+
+def get_refresh_indexes():
+    return _refresh_indexes
+
+
+def set_offline(offline):
+    global _offline
+    _offline = offline
+
+
+def get_offline():
+    """Return True if nothing should be fetched from the network."""
+    return _offline
+
+
+def get_path_lock(path):
+    """Return the lock the threads of this run share for path.
+
+    Parts pulled in parallel hold it while updating path in the user cache.
+    """
+    with _path_locks_lock:
+        return _path_locks.setdefault(path, threading.Lock())
+
+
+class MissingArtifactsError(Exception):
+    """Artifacts needed while offline are not in the local caches."""
+
+    @property
+    def message(self):
+        return ('The following are not available offline:\n' +
+                '\n'.join('  - {}'.format(a) for a in self.artifacts))
+
+    def __init__(self, artifacts):
+        self.artifacts = artifacts
+
+    def __str__(self):
+        return self.message
+
+
 def set_enable_parallel_builds(enable):
     global _enable_parallel_builds
     _enable_parallel_builds = enable
@@ -204,6 +293,28 @@ def get_parallel_build_count():
     return build_count
 
 
+def set_jobserver(jobserver):
+    """Share jobserver with the makes run from now on, None to stop."""
+    global _jobserver
+    _jobserver = jobserver
+
+
+def get_jobserver():
+    return _jobserver
+
+
+def get_parallel_build_args():
+    """Return the arguments to run make with for a parallel build.
+
+    When a jobserver is set make gets its jobs from it, a -j of its own
+    would make it ignore the jobserver. Makes run without these arguments,
+    such as the ones installing, run serially.
+    """
+    if _jobserver:
+        return _jobserver.make_args
+    return ['-j{}'.format(get_parallel_build_count())]
+
+
 def get_python2_path(root):
     """Return a valid PYTHONPATH or raise an exception."""
     python_paths = glob.glob(os.path.join(
@@ -224,32 +335,241 @@ def reset_env():
     env = []
 
 
-def replace_in_file(directory, file_pattern, search_pattern, replacement):
+def replace_in_file(directory, file_pattern, search_pattern, replacement,
+                    contains=None):
     """Searches and replaces patterns that match a file pattern.
+
+    Binary files are skipped and the matching files are processed in
+    parallel, only the files that changed are rewritten.
+
     :param str directory: The directory to look for files.
     :param str file_pattern: The file pattern to match inside directory.
     :param search_pattern: A re.compile'd pattern to search for within
                            matching files.
     :param str replacement: The string to replace the matching search_pattern
                             with.
+    :param bytes contains: if set, only files containing these bytes are
+                           searched, for a cheap way to skip files
+                           search_pattern cannot match.
     """
+    # Symlinks are kept, their targets are rewritten, once.
+    paths = set()
     for root, directories, files in os.walk(directory):
         for file_name in files:
-            if file_pattern.match(file_name):
-                _search_and_replace_contents(os.path.join(root, file_name),
-                                             search_pattern, replacement)
+            path = os.path.realpath(os.path.join(root, file_name))
+            if file_pattern.match(file_name) and os.path.isfile(path):
+                paths.add(path)
 
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=get_parallel_build_count()) as executor:
+        # Consume the results so errors are raised here.
+        list(executor.map(
+            lambda path: _search_and_replace_contents(
+                path, search_pattern, replacement, contains), paths))
 
-def _search_and_replace_contents(file_path, search_pattern, replacement):
-    with open(file_path, 'r+') as f:
+
+def _search_and_replace_contents(file_path, search_pattern, replacement,
+                                 contains=None):
+    with open(file_path, 'rb') as f:
         try:
-            original = f.read()
-        except UnicodeDecodeError:
-            # This was probably a binary file. Skip it.
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped, there is nothing to replace.
             return
+        with mapped:
+            if _is_binary(mapped):
+                return
+            if contains and mapped.find(contains) == -1:
+                return
+            data = mapped[:]
+
+    try:
+        original = data.decode()
+    except UnicodeDecodeError:
+        # This was probably a binary file. Skip it.
+        return
+
+    replaced = search_pattern.sub(replacement, original)
+    if replaced != original:
+        replace_file_contents(file_path, replaced.encode())
+
+
+def _is_binary(data):
+    head = data[:_BINARY_PROBE_SIZE]
+    return head.startswith(_BINARY_MAGIC) or b'\0' in head
+
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst, replacing dst if it exists.
+
+    Symlinks are copied as symlinks, and files are copied when they cannot
+    be hardlinked (e.g. across filesystems).
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def reflink_or_copy(src, dst):
+    """Copy src to dst sharing its blocks if possible, replacing dst.
+
+    Unlike a hardlink, writing to dst never changes src. Symlinks are
+    copied as symlinks.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            # Not supported by the filesystem, or across filesystems.
+            shutil.copyfileobj(fsrc, fdst)
+    shutil.copystat(src, dst)
+
+
+def replace_file_contents(file_path, contents):
+    """Replace the contents of file_path keeping its permissions.
+
+    The new contents are written to a new file which is then renamed over
+    file_path, so other hard links to the original file (e.g. from the
+    staging area or the user caches) are left untouched. If file_path is a
+    symlink its target is replaced instead. contents can be either str or
+    bytes.
+    """
+    file_path = os.path.realpath(file_path)
+    mode = 'wb' if isinstance(contents, bytes) else 'w'
+    with tempfile.NamedTemporaryFile(
+            mode=mode, dir=os.path.dirname(file_path), delete=False) as f:
+        f.write(contents)
+    shutil.copymode(file_path, f.name)
+    os.replace(f.name, file_path)
+
+
+def sync_tree(srcdir, dstdir, manifest=None, ignore=()):
+    """Update dstdir with the contents of srcdir, copying what changed.
+
+    A file is copied if its size or modification time differ from the
+    previous sync and its checksum does too, a file only touched keeps its
+    previous copy and timestamp. Copies get the current time as their
+    modification time, so whatever was built from their previous contents
+    is older. A previous copy changed in dstdir since the previous sync
+    is copied again. Files synced before and since
+    removed from srcdir are removed from dstdir, anything else in dstdir
+    (e.g. build artifacts) is left alone.
+
+    :param dict manifest: the manifest returned by the previous sync.
+    :param ignore: names to skip at the top of srcdir.
+    :returns: the manifest of this sync.
+    """
+    previous = manifest or {}
+    current = {}
+    os.makedirs(dstdir, exist_ok=True)
+    for root, dirs, files in os.walk(srcdir):
+        reldir = os.path.relpath(root, srcdir)
+        if reldir == os.curdir:
+            reldir = ''
+            dirs[:] = [d for d in dirs if d not in ignore]
+            files = [f for f in files if f not in ignore]
+        # Symlinks to directories are synced as symlinks.
+        links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        dirs[:] = [d for d in dirs if d not in links]
+
+        for name in dirs:
+            path = os.path.join(reldir, name)
+            dst = os.path.join(dstdir, path)
+            if os.path.islink(dst) or not os.path.isdir(dst):
+                _remove_path(dst)
+                os.makedirs(dst)
+            current[path] = ['dir']
+        for name in files + links:
+            path = os.path.join(reldir, name)
+            current[path] = _sync_file(
+                os.path.join(root, name), os.path.join(dstdir, path),
+                previous.get(path))
+
+    # Children go before their parents.
+    for path in sorted(set(previous) - set(current), reverse=True):
+        dst = os.path.join(dstdir, path)
+        if previous[path] == ['dir']:
+            # Kept if there is anything else left in it.
+            with contextlib.suppress(OSError):
+                os.rmdir(dst)
+        elif not os.path.isdir(dst) or os.path.islink(dst):
+            _remove_path(dst)
+
+    return current
+
+
+def _sync_file(src, dst, previous):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    st = os.lstat(src)
+    if stat.S_ISLNK(st.st_mode):
+        entry = ['link', os.readlink(src)]
+        if (entry != previous or not os.path.islink(dst) or
+                os.readlink(dst) != entry[1]):
+            _remove_path(dst)
+            os.symlink(entry[1], dst)
+        return entry
+
+    entry = ['file', st.st_size, st.st_mtime_ns]
+    copied = _is_previous_copy(dst, previous)
+    if copied and previous[1:3] == entry[1:]:
+        return previous
+
+    checksum = hashlib.sha256()
+    if copied:
+        with open(src, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                checksum.update(chunk)
+        if checksum.hexdigest() == previous[3]:
+            return entry + previous[3:]
+
+    _remove_path(dst)
+    checksum = _copy_file(src, dst)
+    return entry + [checksum, os.lstat(dst).st_mtime_ns]
+
+
+def _is_previous_copy(dst, previous):
+    # Whatever changes a file, e.g. a build writing to it, changes its size
+    # or modification time.
+    if not previous or previous[0] != 'file' or len(previous) < 5:
+        return False
+    try:
+        st = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+
+    return (stat.S_ISREG(st.st_mode) and st.st_size == previous[1] and
+            st.st_mtime_ns == previous[4])
+
+
+def _copy_file(src, dst):
+    # Copies src to dst, with its permissions, returning its checksum. The
+    # copy is newer than anything built from its previous contents, the
+    # mtime of src could well be older.
+    checksum = hashlib.sha256()
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        for chunk in iter(lambda: fsrc.read(1024 * 1024), b''):
+            checksum.update(chunk)
+            fdst.write(chunk)
+    shutil.copymode(src, dst)
+
+    return checksum.hexdigest()
+
 
-        replaced = search_pattern.sub(replacement, original)
-        if replaced != original:
-            f.seek(0)
-            f.truncate()
-            f.write(replaced)
+def _remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
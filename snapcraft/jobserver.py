@@ -0,0 +1,77 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2016 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A GNU make compatible jobserver.
+
+A make given a jobserver takes a token from its pipe before starting each
+job beyond its first one and writes it back once the job is done, and
+passes the jobserver on to its sub-makes. All the makes sharing the pipe
+run at most as many jobs together as there are tokens, plus one each.
+"""
+
+import os
+
+
+class JobServer:
+
+    def __init__(self, jobs):
+        """Create a jobserver for jobs concurrent jobs.
+
+        :param int jobs: the number of jobs to allow, at least 1.
+        """
+        self._read_fd, self._write_fd = os.pipe()
+        self.jobs = max(1, jobs)
+        # The first job of every make does not need a token.
+        os.write(self._write_fd, b'+' * (self.jobs - 1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def fds(self):
+        """The pipe file descriptors the makes need to inherit."""
+        return (self._read_fd, self._write_fd)
+
+    @property
+    def make_args(self):
+        """The arguments telling make to use this jobserver."""
+        return ['--jobserver-fds={},{}'.format(*self.fds)]
+
+    def resize(self, jobs):
+        """Change the number of jobs allowed to jobs, at least 1.
+
+        Only the tokens not taken by a running job can be taken back, this
+        is meant to be called between builds.
+        """
+        jobs = max(1, jobs)
+        if jobs > self.jobs:
+            os.write(self._write_fd, b'+' * (jobs - self.jobs))
+            self.jobs = jobs
+        elif jobs < self.jobs:
+            os.set_blocking(self._read_fd, False)
+            try:
+                self.jobs -= len(os.read(self._read_fd, self.jobs - jobs))
+            except BlockingIOError:
+                pass
+            finally:
+                os.set_blocking(self._read_fd, True)
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
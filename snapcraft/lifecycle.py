@@ -14,13 +14,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import concurrent.futures
+import contextlib
 import logging
+import os
+import threading
+import time
+
+import yaml
 
 import snapcraft
 import snapcraft.yaml
 
 from snapcraft import (
     common,
+    jobserver,
     meta,
     pluginhandler,
     repo,
@@ -29,6 +38,9 @@ from snapcraft import (
 
 logger = logging.getLogger(__name__)
 
+# Seconds between two samples of the memory used by a build.
+_MEMORY_SAMPLE_INTERVAL = 0.5
+
 
 def execute(step, part_names=None):
     """Exectute until step in the lifecycle.
@@ -47,6 +59,17 @@ def execute(step, part_names=None):
                           over.
     :returns: A dict with the snap name, version and architectures.
     """
+    # All the makes run for the parts share a jobserver, the number of
+    # jobs stays at the parallel build count however they are nested.
+    with jobserver.JobServer(common.get_parallel_build_count()) as server:
+        common.set_jobserver(server)
+        try:
+            return _execute(step, part_names)
+        finally:
+            common.set_jobserver(None)
+
+
+def _execute(step, part_names):
     config = snapcraft.yaml.load_config()
     repo.install_build_packages(config.build_tools)
 
@@ -58,10 +81,37 @@ def execute(step, part_names=None):
             'type': config.data.get('type', '')}
 
 
+def prefetch(part_names=None):
+    """Download everything the parts need to be pulled into the caches.
+
+    Nothing is pulled into the parts, a later pull or an --offline run is
+    served from the caches instead of the network.
+
+    :param list part_names: only prefetch for these parts, all of them if
+                            not set.
+    """
+    config = snapcraft.yaml.load_config()
+    repo.install_build_packages(config.build_tools)
+
+    if part_names:
+        config.validate_parts(part_names)
+        parts = [p for p in config.all_parts if p.name in part_names]
+    else:
+        parts = config.all_parts
+
+    max_workers = max(1, min(len(parts), common.get_parallel_build_count()))
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers) as executor:
+        # Consuming the results raises the first failure.
+        list(executor.map(lambda part: part.prefetch(), parts))
+
+
 class _Executor:
 
     def __init__(self, config):
         self.config = config
+        self._stats = _load_stats(config.data['name'])
+        self._prefetches = {}
 
     def run(self, step, part_names=None, recursed=False):
         if part_names:
@@ -71,16 +121,89 @@ class _Executor:
             parts = self.config.all_parts
             part_names = self.config.part_names
 
-        dirty = {p.name for p in parts if p.should_step_run('stage')}
+        dirty = {p.name for p in parts
+                 if p.should_step_run('stage') or p.stage_packages_changed()}
+        parts = self._by_critical_path(parts)
+        if recursed:
+            self._run_steps(step, parts, part_names, dirty, recursed)
+        else:
+            with self._prefetching(parts):
+                self._run_steps(step, parts, part_names, dirty, recursed)
+
+        self._create_meta(step, part_names)
+
+    def _run_steps(self, step, parts, part_names, dirty, recursed):
         step_index = common.COMMAND_ORDER.index(step) + 1
 
         for step in common.COMMAND_ORDER[0:step_index]:
             if step == 'stage':
                 pluginhandler.check_for_collisions(self.config.all_parts)
+            # Report everything missing when offline instead of stopping
+            # at the first part.
+            missing = []
             for part in parts:
-                self._run_step(step, part, part_names, dirty, recursed)
+                try:
+                    self._run_step(step, part, part_names, dirty, recursed)
+                except common.MissingArtifactsError as e:
+                    missing.extend(a for a in e.artifacts if a not in missing)
+            if missing:
+                raise common.MissingArtifactsError(missing)
 
-        self._create_meta(step, part_names)
+    def _by_critical_path(self, parts):
+        """Sort parts to start with the longest chain of parts after them.
+
+        The chain of a part is how long pulling and building it took in the
+        previous runs plus the longest chain of the parts after it. Parts
+        always come before the parts after them, the others keep their order
+        on a tie.
+        """
+        chains = {}
+
+        def chain(part):
+            if part.name not in chains:
+                stats = self._stats.get(part.name, {})
+                after = [p for p in self.config.all_parts
+                         if part.name in self.config.part_prereqs(p.name)]
+                chains[part.name] = (
+                    stats.get('pull', 0) + stats.get('build', 0) +
+                    max([chain(p) for p in after], default=0))
+            return chains[part.name]
+
+        order = {p.name: i for i, p in enumerate(self.config.all_parts)}
+        return sorted(parts, key=lambda p: (-chain(p), order[p.name]))
+
+    @contextlib.contextmanager
+    def _prefetching(self, parts):
+        """Fetch the sources of parts into the caches ahead of their pull.
+
+        Parts are pulled one at a time, their sources are fetched
+        concurrently in the same order meanwhile.
+        """
+        parts = [p for p in parts if p.should_step_run('pull')]
+        if common.get_offline() or not parts:
+            yield
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=common.get_parallel_build_count()) as executor:
+            for part in parts:
+                self._prefetches[part.name] = executor.submit(
+                    part.code.prefetch)
+            try:
+                yield
+            finally:
+                for future in self._prefetches.values():
+                    future.cancel()
+
+    def _wait_for_prefetch(self, part):
+        future = self._prefetches.pop(part.name, None)
+        if not future:
+            return
+        try:
+            future.result()
+        except Exception as e:
+            # Pulling fetches whatever is missing and reports the errors.
+            logger.debug('Prefetching {!r} failed: {}'.format(part.name, e))
 
     def _run_step(self, step, part, part_names, dirty, recursed):
         common.reset_env()
@@ -102,9 +225,148 @@ class _Executor:
             self.run('stage', prereqs, recursed=True)
 
         common.env = self.config.build_env_for_part(part)
-        getattr(part, step)()
+        if step == 'pull':
+            self._wait_for_prefetch(part)
+            if (not part.should_step_run('pull') and
+                    part.stage_packages_changed()):
+                # What was staged from the previous stage packages is
+                # removed, updating them has the part built and staged
+                # again.
+                part.clean(self.config.get_project_state('stage'),
+                           self.config.get_project_state('strip'), 'stage')
+        if step in ('pull', 'build') and part.should_step_run(step):
+            # How long it took decides the order of the next runs.
+            start = time.monotonic()
+            if step == 'build':
+                self._build(part)
+            else:
+                part.pull()
+            self._stats.setdefault(part.name, {})[step] = round(
+                time.monotonic() - start, 1)
+            _save_stats(self.config.data['name'], self._stats)
+        else:
+            getattr(part, step)()
+
+    def _build(self, part):
+        # The jobs are lowered for parts which would not fit in the memory
+        # available with the memory they used in previous runs.
+        jobserver = common.get_jobserver()
+        jobs = self._get_build_jobs(part)
+        jobserver.resize(jobs)
+        monitor = _MemoryMonitor()
+        try:
+            with monitor:
+                part.build()
+        finally:
+            jobserver.resize(common.get_parallel_build_count())
+            # Recorded even if the build failed, e.g. killed for using too
+            # much memory.
+            if monitor.peak:
+                self._stats.setdefault(part.name, {}).update(
+                    {'peak-rss': monitor.peak, 'jobs': jobs})
+                _save_stats(self.config.data['name'], self._stats)
+
+    def _get_build_jobs(self, part):
+        jobs = common.get_parallel_build_count()
+        stats = self._stats.get(part.name, {})
+        available = _get_available_memory()
+        if 'peak-rss' not in stats or not available:
+            return jobs
+
+        job_rss = stats['peak-rss'] / stats['jobs']
+        fitting = max(1, int(available // job_rss))
+        if fitting >= jobs:
+            return jobs
+
+        logger.info(
+            'Building {!r} with {} jobs instead of {}, {} MiB of memory are '
+            'available and it used {} MiB per job before'.format(
+                part.name, fitting, jobs, available // 2**20,
+                int(job_rss) // 2**20))
+        return fitting
 
     def _create_meta(self, step, part_names):
         if step == 'strip' and part_names == self.config.part_names:
             common.env = self.config.snap_env()
             meta.create(self.config.data)
+
+
+class _MemoryMonitor:
+    """Track the peak memory used by the processes snapcraft started."""
+
+    def __init__(self):
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stopped.wait(_MEMORY_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, _get_descendants_rss(os.getpid()))
+
+
+def _get_descendants_rss(pid):
+    """Return the resident memory of all the descendants of pid, in bytes."""
+    children = collections.defaultdict(list)
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', entry, 'stat')) as f:
+                stat = f.read()
+        except OSError:
+            # The process is already gone.
+            continue
+        # The command name before the other fields may contain spaces.
+        fields = stat[stat.rindex(')') + 2:].split()
+        children[int(fields[1])].append(int(entry))
+        rss[int(entry)] = int(fields[21])
+
+    total = 0
+    pending = list(children[pid])
+    while pending:
+        child = pending.pop()
+        total += rss[child]
+        pending.extend(children[child])
+
+    return total * os.sysconf('SC_PAGE_SIZE')
+
+
+def _get_available_memory():
+    """Return the memory available without swapping, in bytes or None."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _get_stats_path(name):
+    return os.path.join(common.get_cachedir(), 'stats', name + '.yaml')
+
+
+def _load_stats(name):
+    """Return what previous runs recorded about the parts of snap name."""
+    try:
+        with open(_get_stats_path(name)) as f:
+            return yaml.load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def _save_stats(name, stats):
+    path = _get_stats_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        yaml.dump(stats, f, default_flow_style=False)
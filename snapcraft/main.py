@@ -32,6 +32,12 @@ Options:
                          CPUs)
   --target-arch ARCH     EXPERIMENTAL: sets the target architecture. Very few
                          plugins support this.
+  --refresh-indexes      update the cached Ubuntu package indexes even if
+                         they are recent (they are otherwise reused for up
+                         to $SNAPCRAFT_INDEX_MAX_AGE seconds, one day by
+                         default)
+  --offline              do not access the network, use what is already in
+                         the local caches and fail listing anything missing
 
 The available commands are:
   list-parts   List available parts which are like "source packages" for snaps.
@@ -46,6 +52,8 @@ The available commands are:
 The available lifecycle commands are:
   clean        Remove content - cleans downloads, builds or install artifacts.
   cleanbuild   Create a snap using a clean environment managed by lxd.
+  prefetch     Download what the parts need into the local caches, for
+               faster or --offline pulls later on.
   pull         Download or retrieve artifacts defined for a part.
   build        Build artifacts defined for a part. Build systems capable of
                running parallel build jobs will do so unless
@@ -82,6 +90,7 @@ _VALID_COMMANDS = [
     'list-plugins',
     'init',
     'add-part',
+    'prefetch',
     'pull',
     'build',
     'clean',
@@ -118,6 +127,8 @@ def main():
     log.configure(log_level=log_level)
 
     common.set_enable_parallel_builds(not args['--no-parallel-build'])
+    common.set_refresh_indexes(args['--refresh-indexes'])
+    common.set_offline(args['--offline'])
 
     if args['--target-arch']:
         common.set_target_machine(args['--target-arch'])
@@ -128,7 +139,11 @@ def main():
         if args['--debug']:
             raise
 
-        sys.exit(textwrap.fill(str(e)))
+        message = str(e)
+        # Messages laid out on several lines are kept as they are.
+        if '\n' not in message:
+            message = textwrap.fill(message)
+        sys.exit(message)
 
 
 if __name__ == '__main__':  # pragma: no cover
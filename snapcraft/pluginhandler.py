@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import contextlib
 import filecmp
 import glob
@@ -22,6 +23,8 @@ import logging
 import os
 import shutil
 import sys
+import tempfile
+import threading
 
 import jsonschema
 import yaml
@@ -33,6 +36,9 @@ from snapcraft import (
 )
 
 _SNAPCRAFT_STAGE = '$SNAPCRAFT_STAGE'
+_LOCKFILE = 'snapcraft.lock'
+# Parts pulled concurrently update their locks in the same file.
+_lockfile_lock = threading.Lock()
 
 logger = logging.getLogger(__name__)
 
@@ -88,15 +94,18 @@ class StageState(yaml.YAMLObject):
 class PullState(yaml.YAMLObject):
     yaml_tag = u'!PullState'
 
-    def __init__(self, stage_package_files, stage_package_directories):
+    def __init__(self, stage_package_files, stage_package_directories,
+                 stage_packages=None, package_contents=None):
         self.stage_package_files = stage_package_files
         self.stage_package_directories = stage_package_directories
+        self.stage_packages = stage_packages or []
+        self.package_contents = package_contents or {}
 
     def __repr__(self):
         return ('{}(stage-package-files: {}, '
-                'stage-package-directories: {})').format(
+                'stage-package-directories: {}, stage-packages: {})').format(
             self.__class__, self.stage_package_files,
-            self.stage_package_directories)
+            self.stage_package_directories, self.stage_packages)
 
     def __eq__(self, other):
         if type(other) is type(self):
@@ -125,6 +134,7 @@ class PluginHandler:
 
         self.stagedir = os.path.join(os.getcwd(), 'stage')
         self.snapdir = os.path.join(os.getcwd(), 'snap')
+        self.lockfile = os.path.join(os.getcwd(), _LOCKFILE)
 
         parts_dir = common.get_partsdir()
         self.ubuntudir = os.path.join(parts_dir, part_name, 'ubuntu')
@@ -244,33 +254,90 @@ class PluginHandler:
     def _step_state_file(self, step):
         return os.path.join(self.statedir, step)
 
-    def _setup_stage_packages(self):
+    def _setup_stage_packages(self, previous=None):
         ubuntu = repo.Ubuntu(
             self.ubuntudir, sources=self.code.PLUGIN_STAGE_SOURCES)
-        ubuntu.get(self.code.stage_packages)
-        ubuntu.unpack(self.installdir)
+        previous_lock = _load_locks(self.lockfile).get(self.name)
+        lock = ubuntu.get(self.code.stage_packages, lock=previous_lock)
+        if lock != previous_lock:
+            with _lockfile_lock:
+                locks = _load_locks(self.lockfile)
+                locks[self.name] = lock
+                _save_locks(self.lockfile, locks)
+        contents = ubuntu.unpack(self.installdir, previous)
 
         package_files, package_dirs = self.migratable_fileset_for('stage')
         _migrate_files(package_files, package_dirs, self.code.installdir,
                        self.stagedir, missing_ok=True)
 
-        return (package_files, package_dirs)
+        return (package_files, package_dirs, contents)
+
+    def prefetch(self):
+        """Warm the caches with what pull needs, without pulling."""
+        self.notify_stage('Prefetching')
+        if self.code.stage_packages:
+            with tempfile.TemporaryDirectory() as tempdir:
+                ubuntu = repo.Ubuntu(
+                    tempdir, sources=self.code.PLUGIN_STAGE_SOURCES)
+                ubuntu.get(self.code.stage_packages,
+                           lock=_load_locks(self.lockfile).get(self.name))
+        self.code.prefetch()
 
     def pull(self, force=False):
-        if not self.should_step_run('pull', force):
+        if self.should_step_run('pull', force):
+            self.makedirs()
+            self.notify_stage('Pulling')
+            state = self._pull_stage_packages_and_code()
+        elif self.stage_packages_changed():
+            self.notify_stage('Updating stage packages for')
+            state = self._pull_stage_packages()
+        else:
             self.notify_stage('Skipping pull', ' (already ran)')
             return
-        self.makedirs()
-        self.notify_stage('Pulling')
+
+        self.mark_done('pull', state)
+
+    def _pull_stage_packages_and_code(self):
+        # Plugins may rely on the stage packages being unpacked when they
+        # pull, the source is fetched into the shared caches while they
+        # are set up so the plugin pull is served from there.
+        if not self.code.stage_packages or common.get_offline():
+            state = self._pull_stage_packages()
+            self.code.pull()
+            return state
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            prefetch = executor.submit(self.code.prefetch)
+            state = self._pull_stage_packages()
+            prefetch.result()
+        self.code.pull()
+
+        return state
+
+    def stage_packages_changed(self):
+        """Return True if the stage-packages changed since the last pull."""
+        state = self.get_state('pull')
+        if not hasattr(state, 'stage_packages'):
+            # Pulled by an older version, which did not record them.
+            return False
+
+        return sorted(state.stage_packages) != sorted(
+            self.code.stage_packages)
+
+    def _pull_stage_packages(self):
+        # Packages already unpacked into installdir by a previous pull are
+        # kept, only the difference with the new set is applied.
+        previous = getattr(self.get_state('pull'), 'package_contents', None)
         package_files = set()
         package_directories = set()
-        if self.code.stage_packages:
-            package_files, package_directories = self._setup_stage_packages()
-        self.code.pull()
+        contents = {}
+        if self.code.stage_packages or previous:
+            package_files, package_directories, contents = \
+                self._setup_stage_packages(previous)
 
         # Record the files and directories unpacked from the stage packages
-        state = PullState(package_files, package_directories)
-        self.mark_done('pull', state)
+        return PullState(package_files, package_directories,
+                         list(self.code.stage_packages), contents)
 
     def clean_pull(self):
         state_file = self._step_state_file('pull')
@@ -580,6 +647,20 @@ def load_plugin(part_name, plugin_name, properties=None):
     return PluginHandler(plugin_name, part_name, properties)
 
 
+def _load_locks(lockfile):
+    """Return the stage package locks for all the parts in the project."""
+    try:
+        with open(lockfile) as f:
+            return yaml.load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def _save_locks(lockfile, locks):
+    with open(lockfile, 'w') as f:
+        yaml.dump(locks, f, default_flow_style=False)
+
+
 def _migratable_filesets(fileset, srcdir):
     includes, excludes = _get_file_list(fileset)
 
@@ -36,6 +36,12 @@ In additon, this plugin uses the following plugin-specific keywords:
       (enum, 'destdir' or 'prefix')
       Whether to install via DESTDIR or by using --prefix (default is
       'destdir')
+    - out-of-tree:
+      (boolean)
+      run configure from the pulled source in the build directory (a VPATH
+      build) instead of copying the source over first. The build directory
+      is kept between builds. Sources without a configure script are still
+      copied over first, to run autogen or autoreconf in (default is false)
 """
 
 import os
@@ -47,6 +53,8 @@ import snapcraft.common
 
 class AutotoolsPlugin(snapcraft.BasePlugin):
 
+    incremental_build = True
+
     @classmethod
     def schema(cls):
         schema = super().schema()
@@ -65,6 +73,11 @@ class AutotoolsPlugin(snapcraft.BasePlugin):
             'default': 'destdir',
         }
 
+        schema['properties']['out-of-tree'] = {
+            'type': 'boolean',
+            'default': False,
+        }
+
         return schema
 
     def __init__(self, name, options):
@@ -86,9 +99,21 @@ class AutotoolsPlugin(snapcraft.BasePlugin):
                 options.install_via))
 
     def build(self):
-        super().build()
-        if not os.path.exists(os.path.join(self.builddir, "configure")):
-            autogen_path = os.path.join(self.builddir, "autogen.sh")
+        sourcedir = self.subsourcedir
+        # Bootstrapping writes next to the sources, and the pulled source
+        # may well be the project itself. Sources without a configure are
+        # bootstrapped and built in a copy of them.
+        if (self.options.out_of_tree and
+                os.path.exists(os.path.join(sourcedir, 'configure'))):
+            os.makedirs(self.builddir, exist_ok=True)
+            configure_command = [os.path.join(sourcedir, 'configure')]
+        else:
+            super().build()
+            sourcedir = self.builddir
+            configure_command = ['./configure']
+
+        if not os.path.exists(os.path.join(sourcedir, "configure")):
+            autogen_path = os.path.join(sourcedir, "autogen.sh")
             if os.path.exists(autogen_path):
                 # Make sure it's executable
                 if not os.access(autogen_path, os.X_OK):
@@ -97,11 +122,11 @@ class AutotoolsPlugin(snapcraft.BasePlugin):
                              stat.S_IRGRP | stat.S_IWGRP | stat.S_IXGRP |
                              stat.S_IROTH | stat.S_IWOTH | stat.S_IXOTH)
 
-                self.run(['env', 'NOCONFIGURE=1', './autogen.sh'])
+                self.run(['env', 'NOCONFIGURE=1', './autogen.sh'],
+                         cwd=sourcedir)
             else:
-                self.run(['autoreconf', '-i'])
+                self.run(['autoreconf', '-i'], cwd=sourcedir)
 
-        configure_command = ['./configure']
         make_install_command = ['make', 'install']
 
         if self.install_via_destdir:
@@ -112,6 +137,5 @@ class AutotoolsPlugin(snapcraft.BasePlugin):
             configure_command.append('--prefix=' + self.installdir)
 
         self.run(configure_command + self.options.configflags)
-        self.run(['make', '-j{}'.format(
-            snapcraft.common.get_parallel_build_count())])
+        self.run(['make'] + snapcraft.common.get_parallel_build_args())
         self.run(make_install_command)
@@ -281,35 +281,31 @@ deb http://${security}.ubuntu.com/${suffix} trusty-security main universe
         # Looking for any path-like string
         common.replace_in_file(self.rosdir, re.compile(r'.*Config.cmake$'),
                                re.compile(r'"(.*?/.*?)"'),
-                               rewrite_paths)
+                               rewrite_paths, contains=b'/')
 
     def _finish_build(self):
         # Fix all shebangs to use the in-snap python.
         common.replace_in_file(self.rosdir, re.compile(r''),
                                re.compile(r'#!.*python'),
-                               r'#!/usr/bin/env python')
+                               r'#!/usr/bin/env python', contains=b'#!')
 
         # Replace the CMAKE_PREFIX_PATH in _setup_util.sh
         setup_util_file = os.path.join(self.rosdir, '_setup_util.py')
         if os.path.isfile(setup_util_file):
-            with open(setup_util_file, 'r+') as f:
+            with open(setup_util_file, 'r') as f:
                 pattern = re.compile(r"CMAKE_PREFIX_PATH = '{}.*".format(
                     self.rosdir))
                 replaced = pattern.sub('CMAKE_PREFIX_PATH = []', f.read())
-                f.seek(0)
-                f.truncate()
-                f.write(replaced)
+            common.replace_file_contents(setup_util_file, replaced)
 
         # Also replace the python usage in 10.ros.sh to use the in-snap python.
         ros10_file = os.path.join(self.rosdir,
                                   'etc/catkin/profile.d/10.ros.sh')
         if os.path.isfile(ros10_file):
-            with open(ros10_file, 'r+') as f:
+            with open(ros10_file, 'r') as f:
                 pattern = re.compile(r'/usr/bin/python')
                 replaced = pattern.sub(r'python', f.read())
-                f.seek(0)
-                f.truncate()
-                f.write(replaced)
+            common.replace_file_contents(ros10_file, replaced)
 
     def _build_catkin_packages(self):
         # Nothing to do if no packages were specified
@@ -28,6 +28,11 @@ Additionally, this plugin uses the following plugin-specific keywords:
     - configflags:
       (list of strings)
       configure flags to pass to the build using the common cmake semantics.
+    - out-of-tree:
+      (boolean)
+      cmake always builds from the pulled source, this keeps the build
+      directory between builds instead of starting from an empty one so
+      only what changed is rebuilt.
 """
 
 import os
@@ -52,6 +57,11 @@ class CMakePlugin(snapcraft.plugins.make.MakePlugin):
             'default': [],
         }
 
+        schema['properties']['out-of-tree'] = {
+            'type': 'boolean',
+            'default': False,
+        }
+
         return schema
 
     def __init__(self, name, options):
@@ -59,23 +69,16 @@ class CMakePlugin(snapcraft.plugins.make.MakePlugin):
         self.build_packages.append('cmake')
 
     def build(self):
-        if os.path.exists(self.builddir):
+        if not self.options.out_of_tree and os.path.exists(self.builddir):
             shutil.rmtree(self.builddir)
-        os.mkdir(self.builddir)
-
-        source_subdir = getattr(self.options, 'source_subdir', None)
-        if source_subdir:
-            sourcedir = os.path.join(self.sourcedir, source_subdir)
-        else:
-            sourcedir = self.sourcedir
+        os.makedirs(self.builddir, exist_ok=True)
 
         env = self._build_environment()
 
-        self.run(['cmake', sourcedir, '-DCMAKE_INSTALL_PREFIX='] +
+        self.run(['cmake', self.subsourcedir, '-DCMAKE_INSTALL_PREFIX='] +
                  self.options.configflags, env=env)
 
-        self.run(['make', '-j{}'.format(common.get_parallel_build_count())],
-                 env=env)
+        self.run(['make'] + common.get_parallel_build_args(), env=env)
 
         self.run(['make', 'install', 'DESTDIR=' + self.installdir], env=env)
 
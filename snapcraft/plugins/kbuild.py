@@ -38,6 +38,12 @@ explained above:
       definitions.  If you don't want default for one or more implicit configs
       coming out of these, just add them to this list as well.
 
+    - out-of-tree:
+      (boolean)
+      build from the pulled source into the build directory using kbuild's
+      O= instead of copying the source over first. The build directory is
+      kept between builds. default: false
+
 The plugin applies your selected defconfig first by running
 
     make defconfig
@@ -69,6 +75,8 @@ logger = logging.getLogger(__name__)
 
 class KBuildPlugin(BasePlugin):
 
+    incremental_build = True
+
     @classmethod
     def schema(cls):
         schema = super().schema()
@@ -93,6 +101,11 @@ class KBuildPlugin(BasePlugin):
             'default': [],
         }
 
+        schema['properties']['out-of-tree'] = {
+            'type': 'boolean',
+            'default': False,
+        }
+
         return schema
 
     def __init__(self, name, options):
@@ -101,10 +114,12 @@ class KBuildPlugin(BasePlugin):
 
         self.make_targets = []
         self.make_install_targets = ['install']
-        self.make_cmd = [
-            'make', '-j{}'.format(common.get_parallel_build_count())]
+        self.make_cmd = ['make'] + common.get_parallel_build_args()
         if logger.isEnabledFor(logging.DEBUG):
             self.make_cmd.append('V=1')
+        if self.options.out_of_tree:
+            self.make_cmd.extend(
+                ['-C', self.subsourcedir, 'O=' + self.builddir])
 
     def do_base_config(self, config_path):
         # if kconfigfile is provided use that
@@ -137,8 +152,12 @@ class KBuildPlugin(BasePlugin):
             f.write(config)
 
     def do_remake_config(self):
-        # update config to include kconfig amendments using oldconfig
-        cmd = 'yes "" | {} oldconfig'.format(' '.join(self.make_cmd))
+        # update config to include kconfig amendments using oldconfig,
+        # which runs serially, so without the jobserver args as its pipe
+        # is not passed through the shell
+        parallel_args = common.get_parallel_build_args()
+        make_cmd = [arg for arg in self.make_cmd if arg not in parallel_args]
+        cmd = 'yes "" | {} oldconfig'.format(' '.join(make_cmd))
         subprocess.check_call(cmd, shell=True, cwd=self.builddir)
 
     def do_build(self):
@@ -152,7 +171,10 @@ class KBuildPlugin(BasePlugin):
                  self.make_install_targets)
 
     def build(self):
-        super().build()
+        if self.options.out_of_tree:
+            os.makedirs(self.builddir, exist_ok=True)
+        else:
+            super().build()
 
         config_path = os.path.join(self.builddir, '.config')
 
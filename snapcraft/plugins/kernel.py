@@ -59,7 +59,15 @@ import subprocess
 import tempfile
 
 from snapcraft import storeapi
-from snapcraft.common import get_machine_info, target_machine
+from snapcraft.common import (
+    get_cachedir,
+    get_machine_info,
+    get_offline,
+    get_path_lock,
+    link_or_copy,
+    target_machine,
+    MissingArtifactsError,
+)
 from snapcraft.config import load_config
 from snapcraft.plugins import kbuild
 
@@ -143,6 +151,9 @@ class KernelPlugin(kbuild.KBuildPlugin):
 
         self.os_snap = os.path.join(self.sourcedir, 'os.snap')
         self._target_arch = get_machine_info(target_machine)
+        self._cached_os_snap = os.path.join(
+            get_cachedir(), 'snaps',
+            'ubuntu-core_edge_{}.snap'.format(self._target_arch['deb']))
 
     def set_target_machine(self, machine):
         self._target_arch = get_machine_info(machine)
@@ -286,11 +297,36 @@ class KernelPlugin(kbuild.KBuildPlugin):
             for f in found_dtbs:
                 os.link(f, os.path.join(dtb_dir, os.path.basename(f)))
 
+    def prefetch(self):
+        super().prefetch()
+        self._download_os_snap()
+
     def pull(self):
         super().pull()
+        if not get_offline():
+            self._download_os_snap()
+        elif not os.path.exists(self._cached_os_snap):
+            if not os.path.exists(self.os_snap):
+                raise MissingArtifactsError(['ubuntu-core/edge'])
+            logger.info('Offline, using the previously downloaded os snap')
+            return
+
+        os.makedirs(os.path.dirname(self.os_snap), exist_ok=True)
+        link_or_copy(self._cached_os_snap, self.os_snap)
+
+    def _download_os_snap(self):
+        # The os snap is kept in the user cache, the download is skipped
+        # if the cached one is still the latest.
+        cachedir = os.path.dirname(self._cached_os_snap)
+        os.makedirs(cachedir, exist_ok=True)
         config = load_config()
-        storeapi.download(
-            'ubuntu-core/edge', self.os_snap, config, self._target_arch['deb'])
+        # Parts sharing an os snap in the cache download it one at a time.
+        # They hardlink the cached snap, which the store replaces rather
+        # than writes to when a newer one is downloaded.
+        with get_path_lock(self._cached_os_snap):
+            storeapi.download(
+                'ubuntu-core/edge', self._cached_os_snap, config,
+                self._target_arch['deb'])
 
     def do_install(self):
         super().do_install()
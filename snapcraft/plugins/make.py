@@ -36,6 +36,8 @@ import snapcraft.common
 
 class MakePlugin(snapcraft.BasePlugin):
 
+    incremental_build = True
+
     @classmethod
     def schema(cls):
         schema = super().schema()
@@ -57,6 +59,5 @@ class MakePlugin(snapcraft.BasePlugin):
         if self.options.makefile:
             command.extend(['-f', self.options.makefile])
 
-        self.run(command + ['-j{}'.format(
-            snapcraft.common.get_parallel_build_count())])
+        self.run(command + snapcraft.common.get_parallel_build_args())
         self.run(command + ['install', 'DESTDIR=' + self.installdir])
@@ -81,6 +81,10 @@ class NodePlugin(snapcraft.BasePlugin):
         os.makedirs(os.path.join(self.partdir, 'npm'))
         self._nodejs_tar.pull()
 
+    def prefetch(self):
+        super().prefetch()
+        self._nodejs_tar.prefetch()
+
     def clean_pull(self):
         super().clean_pull()
 
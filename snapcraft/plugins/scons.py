@@ -27,6 +27,11 @@ Additionally, this plugin uses the following plugin-specific keywords:
     - scons-options:
       (list of strings)
       flags to pass to the build using the scons semantics for parameters.
+    - out-of-tree:
+      (boolean)
+      run scons in the build directory with the pulled source as its
+      repository (-Y) instead of copying the source over first. The build
+      directory is kept between builds.
 """
 
 import os
@@ -49,6 +54,11 @@ class SconsPlugin(snapcraft.BasePlugin):
             'default': []
         }
 
+        schema['properties']['out-of-tree'] = {
+            'type': 'boolean',
+            'default': False,
+        }
+
         return schema
 
     def __init__(self, name, options):
@@ -56,8 +66,14 @@ class SconsPlugin(snapcraft.BasePlugin):
         self.build_packages.append('scons')
 
     def build(self):
-        super().build()
+        scons_options = self.options.scons_options
+        if self.options.out_of_tree:
+            os.makedirs(self.builddir, exist_ok=True)
+            scons_options = ['-Y', self.subsourcedir] + scons_options
+        else:
+            super().build()
+
         env = os.environ.copy()
         env['DESTDIR'] = self.installdir
-        self.run(['scons', ] + self.options.scons_options)
-        self.run(['scons', 'install'] + self.options.scons_options, env=env)
+        self.run(['scons', ] + scons_options)
+        self.run(['scons', 'install'] + scons_options, env=env)
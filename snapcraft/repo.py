@@ -14,9 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import concurrent.futures
+import contextlib
+import fcntl
 import glob
+import hashlib
 import itertools
 import logging
+import netrc
 import os
 import platform
 import re
@@ -24,7 +30,11 @@ import string
 import shutil
 import stat
 import subprocess
+import tempfile
+import threading
+import time
 import urllib
+import urllib.parse
 import urllib.request
 
 import apt
@@ -40,6 +50,15 @@ _BIN_PATHS = (
     'usr/sbin',
 )
 
+_CONFIG_SCRIPTS = (
+    'usr/bin/xml2-config',
+    'usr/bin/xslt-config',
+)
+
+# The kernel does not read more than this from a shebang line.
+_MAX_SHEBANG = 256
+_PYTHON_SHEBANG = re.compile(rb'#!.*python\n')
+
 logger = logging.getLogger(__name__)
 
 _DEFAULT_SOURCES = \
@@ -55,6 +74,39 @@ deb http://${security}.ubuntu.com/${suffix} ${release}-security multiverse
 '''
 _GEOIP_SERVER = "http://geoip.ubuntu.com/lookup"
 
+# Number of debs downloaded at the same time.
+_DOWNLOAD_CONNECTIONS = 4
+# Timeout (in seconds) for stalled deb downloads.
+_DOWNLOAD_TIMEOUT = 30
+# Timeout (in seconds) for the geoip lookup and each mirror probe.
+_PROBE_TIMEOUT = 5
+# Bytes downloaded from each candidate mirror to rate it.
+_PROBE_SIZE = 64 * 1024
+# The selected mirror is kept in the user cache and selected again when
+# older than this (in seconds). Can be overridden with
+# SNAPCRAFT_MIRROR_MAX_AGE.
+_DEFAULT_MIRROR_MAX_AGE = 7 * 24 * 60 * 60
+_MIRROR_FILE = 'mirror'
+# Mirrors that failed during this run.
+_failed_mirrors = set()
+
+# Updated apt caches keyed by the sources they were set up for, these are
+# shared within a run by all the parts using the same sources.list.
+_apt_caches = {}
+# Guards the shared apt caches when parts fetch their packages concurrently.
+_apt_lock = threading.RLock()
+# Index cache directories that were updated during this run.
+_updated_indexes = set()
+
+# Cached package indexes older than this (in seconds) are updated before
+# use. Can be overridden with SNAPCRAFT_INDEX_MAX_AGE.
+_DEFAULT_INDEX_MAX_AGE = 24 * 60 * 60
+_INDEX_STAMP = 'last-update'
+
+_DPKG_STATUS = '/var/lib/dpkg/status'
+_DPKG_STATUS_FIELDS = re.compile(
+    r'^(Package|Status|Architecture|Provides): (.*)$', re.MULTILINE)
+
 
 def is_package_installed(package):
     """Return True if a package is installed on the system.
@@ -62,12 +114,43 @@ def is_package_installed(package):
     :param str package: the deb package to query for.
     :returns: True if the package is installed, False if not.
     """
-    with apt.Cache() as apt_cache:
-        return apt_cache[package].installed
+    return package in _get_installed_packages()
+
+
+def _get_installed_packages():
+    """Return the names of the packages installed on the system.
+
+    The dpkg status database is read directly, which is a lot cheaper than
+    opening an apt cache. Arch qualified names and the virtual packages
+    provided by the installed packages are included.
+    """
+    try:
+        with open(_DPKG_STATUS) as f:
+            paragraphs = f.read().split('\n\n')
+    except FileNotFoundError:
+        return set()
+
+    installed = set()
+    for paragraph in paragraphs:
+        fields = dict(_DPKG_STATUS_FIELDS.findall(paragraph))
+        if not fields.get('Status', '').endswith(' installed'):
+            continue
+        names = [fields['Package']] + [
+            p.split()[0] for p in fields.get('Provides', '').split(',')
+            if p.strip()]
+        installed.update(names)
+        if 'Architecture' in fields:
+            installed.update('{}:{}'.format(name, fields['Architecture'])
+                             for name in names)
+
+    return installed
 
 
 def install_build_packages(packages):
-    unique_packages = set(packages)
+    unique_packages = set(packages) - _get_installed_packages()
+    if not unique_packages:
+        return
+
     new_packages = []
     with apt.Cache() as apt_cache:
         for pkg in unique_packages:
@@ -113,6 +196,25 @@ class UnpackError(Exception):
         self.package_name = package_name
 
 
+class LockedPackagesNotFoundError(Exception):
+    """Locked stage packages could not be fetched."""
+
+    @property
+    def message(self):
+        return ('The following locked stage packages could not be '
+                'fetched:\n' +
+                '\n'.join('  - {} {}'.format(p['name'], p['version'])
+                          for p in self.packages) +
+                '\nThey may no longer be in the archive, remove the part '
+                'from snapcraft.lock to resolve its stage-packages again.')
+
+    def __init__(self, packages):
+        self.packages = packages
+
+    def __str__(self):
+        return self.message
+
+
 class Ubuntu:
 
     def __init__(self, rootdir, recommends=False, sources=_DEFAULT_SOURCES):
@@ -126,11 +228,78 @@ class Ubuntu:
             print('using local sources')
             sources = _get_local_sources_list()
             local = True
-        self.apt_cache, self.apt_progress = _setup_apt_cache(
-            rootdir, sources, local)
+        self._sources = sources
+        self._local = local
+        self._apt_cache = None
 
-    def get(self, package_names):
+    @property
+    def apt_cache(self):
+        # The cache is only set up when needed, fetching locked packages
+        # does not need the package indexes at all.
+        if not self._apt_cache:
+            self._apt_cache, self.apt_progress, self._indexdir = \
+                _get_apt_cache(self._sources, self._local)
+
+        return self._apt_cache
+
+    def get(self, package_names, lock=None):
+        """Fetch package_names and their dependencies.
+
+        :param dict lock: a lock returned by a previous call. If it is still
+                          valid for package_names, the packages it lists are
+                          fetched without resolving any dependencies.
+        :returns: the lock for the fetched packages.
+        """
         os.makedirs(self.downloaddir, exist_ok=True)
+        # Only keep the debs fetched by this call around for unpack.
+        for deb in glob.glob(os.path.join(self.downloaddir, '*.deb')):
+            os.remove(deb)
+
+        new_lock = {
+            'stage-packages': sorted(package_names),
+            'sources': hashlib.sha1(self._sources.encode()).hexdigest(),
+            # The default sources only name the release once formatted.
+            'release': _get_series(),
+            'arch': common.get_arch(),
+        }
+        if lock and all(lock.get(k) == v for k, v in new_lock.items()):
+            logger.info('Fetching the locked stage packages')
+            try:
+                _fetch_debs(lock['packages'], self.downloaddir)
+            except apt.cache.FetchFailedException:
+                pooldir = _get_pooldir()
+                raise LockedPackagesNotFoundError(
+                    [p for p in lock['packages'] if not os.path.exists(
+                        _get_pool_path(pooldir, p))])
+            return lock
+
+        try:
+            new_lock['packages'] = self._get(package_names)
+        except apt.cache.FetchFailedException:
+            # The cached indexes may refer to packages that are no longer
+            # in the archive.
+            with _apt_lock:
+                if not _refresh_apt_cache(
+                        self.apt_cache, self.apt_progress, self._indexdir):
+                    raise
+            logger.info('Retrying with updated package indexes')
+            new_lock['packages'] = self._get(package_names)
+
+        return new_lock
+
+    def _get(self, package_names):
+        # The package caches are shared by all the parts, resolving is
+        # serialized but the downloads are not.
+        with _apt_lock:
+            packages = self._resolve(package_names)
+        _fetch_debs(packages, self.downloaddir)
+
+        return packages
+
+    def _resolve(self, package_names):
+        # The cache may have been used by another part, start from a clean
+        # set of marks.
+        self.apt_cache.clear()
 
         manifest_dep_names = self._manifest_dep_names()
 
@@ -168,22 +337,37 @@ class Ubuntu:
             print('Skipping blacklisted from manifest packages:',
                   skipped_blacklisted)
 
-        # download the remaining ones with proper progress
-        apt.apt_pkg.config.set("Dir::Cache::Archives", self.downloaddir)
-        self.apt_cache.fetch_archives(progress=self.apt_progress)
-
-    def unpack(self, rootdir):
-        pkgs_abs_path = glob.glob(os.path.join(self.downloaddir, '*.deb'))
-        for pkg in pkgs_abs_path:
-            # TODO needs elegance and error control
-            try:
-                subprocess.check_call(['dpkg-deb', '--extract', pkg, rootdir])
-            except subprocess.CalledProcessError:
-                raise UnpackError(pkg)
-
-        _fix_symlinks(rootdir)
-        _fix_xml_tools(rootdir)
-        _fix_shebangs(rootdir)
+        # download the remaining ones
+        return [_get_package_info(pkg.candidate)
+                for pkg in self.apt_cache.get_changes()
+                if pkg.marked_install or pkg.marked_upgrade]
+
+    def unpack(self, rootdir, unpacked=None):
+        """Unpack the fetched packages into rootdir.
+
+        :param dict unpacked: the contents returned by a previous unpack into
+                              rootdir. Packages in it which were not fetched
+                              this time are removed from rootdir, and the
+                              ones that were are not unpacked again.
+        :returns: the files and directories unpacked from each package.
+        """
+        unpacked = unpacked or {}
+        debs = sorted(glob.glob(os.path.join(self.downloaddir, '*.deb')))
+        names = {os.path.basename(deb) for deb in debs}
+
+        contents = {n: c for n, c in unpacked.items() if n in names}
+        removed = {n: c for n, c in unpacked.items() if n not in names}
+        if removed:
+            _remove_deb_contents(
+                rootdir, removed, keep=set(itertools.chain(
+                    *contents.values())))
+        contents.update(_extract_debs(
+            [deb for deb in debs if os.path.basename(deb) not in unpacked],
+            rootdir))
+
+        _fix_tree(rootdir)
+
+        return contents
 
     def _manifest_dep_names(self):
         manifest_dep_names = set()
@@ -212,22 +396,118 @@ def _get_local_sources_list():
 
 def _get_geoip_country_code_prefix():
     try:
-        with urllib.request.urlopen(_GEOIP_SERVER) as f:
+        with urllib.request.urlopen(
+                _GEOIP_SERVER, timeout=_PROBE_TIMEOUT) as f:
             xml_data = f.read()
         et = ElementTree.fromstring(xml_data)
         cc = et.find("CountryCode")
         if cc is None:
             return ""
         return cc.text.lower()
-    except (ElementTree.ParseError, urllib.error.URLError):
+    except (ElementTree.ParseError, OSError):
         pass
     return ''
 
 
+def _get_archive_prefix(release):
+    """Return the host prefix of the archive mirror to use.
+
+    The mirror is selected by probing the candidates and the choice is kept
+    in the user cache, it is only selected again when older than
+    SNAPCRAFT_MIRROR_MAX_AGE or after it failed. When offline, the kept
+    choice is used regardless of its age.
+    """
+    mirror_file = os.path.join(common.get_cachedir(), _MIRROR_FILE)
+    max_age = _get_max_age('SNAPCRAFT_MIRROR_MAX_AGE', _DEFAULT_MIRROR_MAX_AGE)
+    if common.get_offline():
+        max_age = float('inf')
+    try:
+        if time.time() - os.stat(mirror_file).st_mtime <= max_age:
+            with open(mirror_file) as f:
+                return f.read().strip()
+    except FileNotFoundError:
+        if common.get_offline():
+            return 'archive'
+
+    prefix = _select_mirror(release)
+    if prefix:
+        os.makedirs(os.path.dirname(mirror_file), exist_ok=True)
+        with open(mirror_file, 'w') as f:
+            f.write(prefix)
+    else:
+        logger.warning('Could not reach any archive mirror')
+        prefix = 'archive'
+
+    return prefix
+
+
+def _select_mirror(release):
+    geoip_prefix = _get_geoip_country_code_prefix()
+    candidates = ['archive']
+    if geoip_prefix:
+        candidates.insert(0, geoip_prefix + '.archive')
+    candidates = [c for c in candidates if c not in _failed_mirrors]
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(candidates) or 1) as executor:
+        timings = list(executor.map(
+            lambda prefix: _probe_mirror(prefix, release), candidates))
+
+    reachable = [(t, c) for t, c in zip(timings, candidates) if t is not None]
+    if not reachable:
+        return None
+
+    prefix = min(reachable)[1]
+    logger.info('Using the {}.ubuntu.com archive mirror'.format(prefix))
+    return prefix
+
+
+def _probe_mirror(prefix, release):
+    """Return the time taken to download a sample from the mirror.
+
+    This accounts for both the latency and the throughput of the mirror,
+    None is returned if the mirror could not be reached.
+    """
+    url = 'http://{}.ubuntu.com/ubuntu/dists/{}/Release'.format(
+        prefix, release)
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(url, timeout=_PROBE_TIMEOUT) as f:
+            latency = time.monotonic() - start
+            size = len(f.read(_PROBE_SIZE))
+    except OSError as e:
+        logger.debug('Mirror {} is unreachable: {}'.format(prefix, e))
+        return None
+
+    elapsed = time.monotonic() - start
+    logger.debug('Mirror {}: {:.3f}s latency, {:.0f} bytes/s'.format(
+        prefix, latency, size / max(elapsed - latency, 1e-6)))
+    return elapsed
+
+
+def _forget_mirror():
+    """Drop the selected mirror so a different one is used from now on.
+
+    :returns: True if there was a selected mirror to drop.
+    """
+    mirror_file = os.path.join(common.get_cachedir(), _MIRROR_FILE)
+    try:
+        with open(mirror_file) as f:
+            _failed_mirrors.add(f.read().strip())
+        os.remove(mirror_file)
+    except FileNotFoundError:
+        return False
+
+    return True
+
+
+def _get_series():
+    return platform.linux_distribution()[2]
+
+
 def _format_sources_list(sources, arch, release='vivid'):
     if arch in ('amd64', 'i386'):
-        geoip_prefix = _get_geoip_country_code_prefix()
-        prefix = geoip_prefix + '.archive' if geoip_prefix else 'archive'
+        prefix = _get_archive_prefix(release)
         suffix = 'ubuntu'
         security = 'security'
     else:
@@ -243,13 +523,42 @@ def _format_sources_list(sources, arch, release='vivid'):
     })
 
 
-def _setup_apt_cache(rootdir, sources, local=False):
-    os.makedirs(os.path.join(rootdir, 'etc', 'apt'), exist_ok=True)
-    srcfile = os.path.join(rootdir, 'etc', 'apt', 'sources.list')
+def _get_apt_cache(sources, local=False):
+    key = (sources, local, common.get_arch())
+    with _apt_lock:
+        if key not in _apt_caches:
+            _apt_caches[key] = _setup_apt_cache(sources, local)
+        else:
+            logger.debug('Reusing the package cache from a previous part')
+
+        return _apt_caches[key]
 
-    if not local:
-        series = platform.linux_distribution()[2]
-        sources = _format_sources_list(sources, common.get_arch(), series)
+
+def _setup_apt_cache(sources, local=False):
+    if local:
+        return _open_apt_cache(sources)
+
+    series = _get_series()
+    try:
+        return _open_apt_cache(
+            _format_sources_list(sources, common.get_arch(), series))
+    except apt.cache.FetchFailedException:
+        if not _forget_mirror():
+            raise
+        logger.warning('The archive mirror failed, selecting another one')
+        return _open_apt_cache(
+            _format_sources_list(sources, common.get_arch(), series))
+
+
+def _open_apt_cache(sources):
+    # The package indexes are kept in a persistent cache for each
+    # combination of sources.list (which includes the series) and
+    # architecture, so they are only downloaded again when too old.
+    digest = hashlib.sha1(
+        '{}\n{}'.format(common.get_arch(), sources).encode()).hexdigest()
+    indexdir = os.path.join(common.get_cachedir(), 'apt', digest)
+    os.makedirs(os.path.join(indexdir, 'etc', 'apt'), exist_ok=True)
+    srcfile = os.path.join(indexdir, 'etc', 'apt', 'sources.list')
 
     with open(srcfile, 'w') as f:
         f.write(sources)
@@ -257,9 +566,10 @@ def _setup_apt_cache(rootdir, sources, local=False):
     # Do not install recommends
     apt.apt_pkg.config.set('Apt::Install-Recommends', 'False')
 
-    # Make sure we always use the system GPG configuration, even with
-    # apt.Cache(rootdir).
-    for key in 'Dir::Etc::Trusted', 'Dir::Etc::TrustedParts':
+    # Make sure we always use the system GPG configuration and archive
+    # credentials, even with apt.Cache(rootdir).
+    for key in ('Dir::Etc::Trusted', 'Dir::Etc::TrustedParts',
+                'Dir::Etc::netrc', 'Dir::Etc::netrcparts'):
         apt.apt_pkg.config.set(key, apt.apt_pkg.config.find_file(key))
 
     progress = apt.progress.text.AcquireProgress()
@@ -268,70 +578,479 @@ def _setup_apt_cache(rootdir, sources, local=False):
         progress.pulse = lambda owner: True
         progress._width = 0
 
-    apt_cache = apt.Cache(rootdir=rootdir, memonly=True)
+    with _index_lock(indexdir):
+        apt_cache = apt.Cache(rootdir=indexdir)
+        if not _index_is_stale(indexdir):
+            logger.info('Using cached package indexes')
+        elif common.get_offline():
+            raise common.MissingArtifactsError(
+                ['the package indexes for {}'.format(srcfile)])
+        else:
+            _update_apt_cache(apt_cache, progress, indexdir)
+        apt_cache.open()
+
+    return apt_cache, progress, indexdir
+
+
+def _refresh_apt_cache(apt_cache, progress, indexdir):
+    """Update and reopen apt_cache unless it was already updated this run.
+
+    :returns: True if the package indexes were updated.
+    """
+    if indexdir in _updated_indexes or common.get_offline():
+        return False
+
+    with _index_lock(indexdir):
+        try:
+            _update_apt_cache(apt_cache, progress, indexdir)
+        except apt.cache.FetchFailedException:
+            # Do not keep using a mirror that went away in later runs.
+            _forget_mirror()
+            raise
+        apt_cache.open()
+
+    return True
+
+
+def _update_apt_cache(apt_cache, progress, indexdir):
+    # Files already in the cache are only downloaded again if they changed
+    # on the server (apt sends If-Modified-Since for them).
+    srcfile = os.path.join(indexdir, 'etc', 'apt', 'sources.list')
     apt.apt_pkg.config.clear("APT::Update::Post-Invoke-Success")
     apt_cache.update(fetch_progress=progress, sources_list=srcfile)
-    apt_cache.open()
 
-    return apt_cache, progress
+    with open(os.path.join(indexdir, _INDEX_STAMP), 'w'):
+        pass
+    _updated_indexes.add(indexdir)
 
 
-def _fix_symlinks(debdir):
-    '''
-    Sometimes debs will contain absolute symlinks (e.g. if the relative
-    path would go all the way to root, they just do absolute).  We can't
-    have that, so instead clean those absolute symlinks.
+def _index_is_stale(indexdir):
+    if common.get_offline():
+        # Any index is better than none.
+        return not os.path.exists(os.path.join(indexdir, _INDEX_STAMP))
+    if common.get_refresh_indexes():
+        return True
+
+    try:
+        mtime = os.stat(os.path.join(indexdir, _INDEX_STAMP)).st_mtime
+    except FileNotFoundError:
+        return True
+
+    max_age = _get_max_age('SNAPCRAFT_INDEX_MAX_AGE', _DEFAULT_INDEX_MAX_AGE)
+    return time.time() - mtime > max_age
+
+
+def _get_max_age(variable, default):
+    """Return the age in seconds set in the variable environment variable.
+    """
+    value = os.environ.get(variable)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise EnvironmentError(
+            '{} must be a number of seconds, not {!r}'.format(
+                variable, value))
+
+
+@contextlib.contextmanager
+def _index_lock(indexdir):
+    # Serialize access to the cached indexes between snapcraft processes.
+    with open(os.path.join(indexdir, 'lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _get_package_info(version):
+    return {
+        'name': version.package.name,
+        'version': version.version,
+        'filename': version.filename,
+        'sha256': version.sha256,
+        'uris': list(version.uris),
+    }
+
+
+def _fetch_debs(packages, downloaddir):
+    """Download the debs for packages into downloaddir.
+
+    packages is a list of dicts as returned by _get_package_info.
+
+    Debs are kept in a pool in the user cache shared by all the parts and
+    projects, and are hardlinked from there into downloaddir. Missing ones
+    are downloaded over several connections, spread across all the URIs
+    known for each deb plus the mirrors in $SNAPCRAFT_ARCHIVE_MIRRORS (e.g.
+    a local proxy), failing over to the next one when a download fails.
+    """
+    pooldir = _get_pooldir()
+    os.makedirs(pooldir, exist_ok=True)
+    os.makedirs(downloaddir, exist_ok=True)
+    mirrors = os.environ.get('SNAPCRAFT_ARCHIVE_MIRRORS', '').split()
+    if common.get_offline():
+        missing = [os.path.basename(p['filename']) for p in packages
+                   if not os.path.exists(_get_pool_path(pooldir, p))]
+        if missing:
+            raise common.MissingArtifactsError(missing)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_DOWNLOAD_CONNECTIONS) as executor:
+        debs = list(executor.map(
+            lambda job: _fetch_deb(job[1], pooldir, mirrors, job[0]),
+            enumerate(packages)))
+
+    for package, deb in zip(packages, debs):
+        common.link_or_copy(deb, os.path.join(
+            downloaddir, os.path.basename(package['filename'])))
+
+
+def _fetch_deb(package, pooldir, mirrors, index):
+    name = os.path.basename(package['filename'])
+    path = _get_pool_path(pooldir, package)
+    if os.path.exists(path):
+        logger.debug('Using {} from the download cache'.format(name))
+        return path
+
+    uris = _get_deb_uris(package, mirrors)
+    # Spread the downloads over the mirrors, starting each one on a
+    # different mirror and trying the others in turn if it fails.
+    start = index % len(uris) if uris else 0
+    for uri in uris[start:] + uris[:start]:
+        try:
+            _download_deb(uri, path, package['sha256'])
+        except OSError as e:
+            logger.warning('Failed to download {}: {}'.format(uri, e))
+            continue
+        logger.info('Downloaded {}'.format(name))
+        return path
+
+    raise apt.cache.FetchFailedException(
+        'Could not download {}'.format(name))
+
+
+def _get_pooldir():
+    return os.path.join(common.get_cachedir(), 'archives')
+
+
+def _get_pool_path(pooldir, package):
+    return os.path.join(
+        pooldir, package['sha256'] or os.path.basename(package['filename']))
+
+
+def _get_deb_uris(package, mirrors):
+    uris = list(package['uris'])
+    for mirror in mirrors:
+        uri = '{}/{}'.format(mirror.rstrip('/'), package['filename'])
+        if uri not in uris:
+            uris.append(uri)
+
+    return uris
+
+
+def _download_deb(uri, path, sha256):
+    checksum = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with open(fd, 'wb') as dst, _open_deb_uri(uri) as src:
+            for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                checksum.update(chunk)
+                dst.write(chunk)
+        if sha256 and checksum.hexdigest() != sha256:
+            raise OSError('checksum mismatch')
+        # Only verified debs ever make it into the pool.
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _open_deb_uri(uri):
+    # Debs are downloaded through the proxy and with the credentials apt
+    # is configured to use for the archive.
+    request = urllib.request.Request(uri)
+    handlers = []
+    parsed = urllib.parse.urlsplit(uri)
+    if parsed.scheme in ('http', 'https'):
+        proxy = _get_apt_proxy(parsed)
+        if proxy is not None:
+            handlers.append(urllib.request.ProxyHandler(
+                {parsed.scheme: proxy} if proxy else {}))
+        credentials = _get_apt_credentials(parsed)
+        if credentials:
+            request.add_header('Authorization', 'Basic {}'.format(
+                base64.b64encode('{}:{}'.format(
+                    *credentials).encode()).decode()))
+
+    return urllib.request.build_opener(*handlers).open(
+        request, timeout=_DOWNLOAD_TIMEOUT)
+
+
+def _get_apt_proxy(parsed):
+    """Return the proxy apt uses for the parsed uri.
+
+    An empty string means a direct connection, None that apt has no proxy
+    configured and the proxy environment variables apply.
+    """
+    keys = ['Acquire::{}::Proxy::{}', 'Acquire::{}::Proxy']
+    schemes = [parsed.scheme]
+    if parsed.scheme == 'https':
+        # apt falls back to the http proxy for https.
+        schemes.append('http')
+    for scheme in schemes:
+        for key in keys:
+            proxy = apt.apt_pkg.config.find(
+                key.format(scheme, parsed.hostname))
+            if proxy:
+                return '' if proxy == 'DIRECT' else proxy
+
+    return None
+
+
+def _get_apt_credentials(parsed):
+    """Return the login and password apt's auth.conf has for parsed."""
+    paths = [apt.apt_pkg.config.find_file('Dir::Etc::netrc')]
+    partsdir = apt.apt_pkg.config.find_dir('Dir::Etc::netrcparts')
+    if partsdir:
+        paths.extend(sorted(glob.glob(os.path.join(partsdir, '*.conf'))))
+    for path in paths:
+        if not path or not os.path.isfile(path):
+            continue
+        try:
+            hosts = netrc.netrc(path).hosts
+        except (netrc.NetrcParseError, OSError) as e:
+            logger.warning('Ignoring {}: {}'.format(path, e))
+            continue
+        for machine, (login, _, password) in hosts.items():
+            if _auth_machine_matches(machine, parsed):
+                return login, password
+
+    return None
+
+
+def _auth_machine_matches(machine, parsed):
+    # Machines are a host with an optional scheme, port and path prefix.
+    scheme, sep, machine = machine.rpartition('://')
+    if sep and scheme != parsed.scheme:
+        return False
+    host, _, path = machine.partition('/')
+    return (host in (parsed.hostname, parsed.netloc) and
+            parsed.path.lstrip('/').startswith(path))
+
+
+def _extract_debs(debs, rootdir):
+    """Provision rootdir with the contents of debs.
+
+    Every deb is extracted and post-processed once into a tree in the user
+    cache, keyed by the checksum of the deb, using a pool of dpkg-deb
+    processes. These trees are then copied into rootdir in the order given
+    by debs, so a file shipped by more than one deb always comes from the
+    last one. They are not hardlinked, a build writing to a file in rootdir
+    must not change the cached tree, the copies share their blocks with it
+    where the filesystem supports it instead.
+
+    :returns: a dict with the paths installed from each deb, relative to
+              rootdir and keyed by the deb file name.
+    """
+    os.makedirs(rootdir, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=common.get_parallel_build_count()) as executor:
+        trees = list(executor.map(_get_deb_tree, debs))
+
+    contents = {}
+    for deb, tree in zip(debs, trees):
+        contents[os.path.basename(deb)] = _merge_tree(
+            tree, rootdir, install=common.reflink_or_copy)
+
+    return contents
+
+
+def _remove_deb_contents(rootdir, removed, keep):
+    """Remove from rootdir the paths installed from the removed debs.
 
-    Some unpacked items will also contain suid binaries which we do not want in
-    the resulting snap.
-    '''
-    for root, dirs, files in os.walk(debdir):
+    Paths in keep, which are shipped by other debs, are left alone and so
+    are directories which are not empty.
+    """
+    paths = set(itertools.chain(*removed.values())) - keep
+    # Sorting in reverse removes the contents of a directory before it.
+    for path in sorted(paths, reverse=True):
+        path = os.path.join(rootdir, path)
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+        elif os.path.isdir(path):
+            with contextlib.suppress(OSError):
+                os.rmdir(path)
+
+
+def _get_deb_tree(deb):
+    debsdir = os.path.join(common.get_cachedir(), 'debs')
+    os.makedirs(debsdir, exist_ok=True)
+    tree = os.path.join(debsdir, _get_file_checksum(deb))
+    if os.path.isdir(tree):
+        return tree
+
+    # Extract somewhere private and rename when done so a cached tree is
+    # never seen half populated.
+    tempdir = tempfile.mkdtemp(dir=debsdir)
+    try:
+        _extract_deb(deb, tempdir)
+        _fix_tree(tempdir, final=False)
+        os.chmod(tempdir, 0o755)
+        os.rename(tempdir, tree)
+    except OSError:
+        # Another process cached the same deb while we were at it.
+        if not os.path.isdir(tree):
+            raise
+    finally:
+        if os.path.isdir(tempdir):
+            shutil.rmtree(tempdir)
+
+    return tree
+
+
+def _get_file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+def _extract_deb(deb, destdir):
+    try:
+        subprocess.check_call(['dpkg-deb', '--extract', deb, destdir])
+    except subprocess.CalledProcessError:
+        raise UnpackError(deb)
+
+
+def _merge_tree(srcdir, dstdir, install=os.replace):
+    """Install the contents of srcdir into dstdir, replacing existing files.
+
+    install is called with the source and destination path of every file
+    and is expected to replace the destination if it already exists.
+
+    :returns: the installed paths, relative to dstdir.
+    """
+    installed = []
+    for root, dirs, files in os.walk(srcdir):
+        relroot = os.path.relpath(root, srcdir)
+        dst_root = os.path.join(dstdir, relroot)
+        # Symlinks to directories are installed like any other file.
+        links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        for entry in links:
+            dirs.remove(entry)
+            files.append(entry)
+
+        for entry in dirs:
+            src = os.path.join(root, entry)
+            dst = os.path.join(dst_root, entry)
+            if os.path.islink(dst) or os.path.isfile(dst):
+                os.remove(dst)
+            if not os.path.isdir(dst):
+                os.mkdir(dst)
+                shutil.copystat(src, dst)
+
+        for entry in files:
+            dst = os.path.join(dst_root, entry)
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                shutil.rmtree(dst)
+            install(os.path.join(root, entry), dst)
+
+        installed.extend(os.path.normpath(os.path.join(relroot, entry))
+                         for entry in itertools.chain(dirs, files))
+
+    return installed
+
+
+def _fix_tree(root, final=True):
+    """Apply all the stage package fixups to root in a single traversal.
+
+    Absolute symlinks are made relative and suid/guid bits are removed,
+    python shebangs in _BIN_PATHS are changed to use env and the prefix of
+    _CONFIG_SCRIPTS is pointed at root. Symlinks and config scripts depend
+    on where the tree is finally unpacked, so they are left alone unless
+    final is True.
+    """
+    bin_dirs = tuple(os.path.join(root, p) + os.sep for p in _BIN_PATHS)
+    config_scripts = {os.path.join(root, p) for p in _CONFIG_SCRIPTS}
+    for dirpath, dirs, files in os.walk(root):
+        in_bin = (dirpath + os.sep).startswith(bin_dirs)
         # Symlinks to directories will be in dirs, while symlinks to
         # non-directories will be in files.
         for entry in itertools.chain(files, dirs):
-            path = os.path.join(root, entry)
-            if os.path.islink(path) and os.path.isabs(os.readlink(path)):
-                target = os.path.join(debdir, os.readlink(path)[1:])
-                if _skip_link(os.readlink(path)):
-                    logger.debug('Skipping {}'.format(target))
-                    continue
-                if not os.path.exists(target):
-                    if not _try_copy_local(path, target):
-                        continue
-                os.remove(path)
-                os.symlink(os.path.relpath(target, root), path)
-            elif os.path.exists(path):
-                _fix_filemode(path)
-
-
-def _fix_xml_tools(root):
-    xml2_config_path = os.path.join(root, 'usr', 'bin', 'xml2-config')
-    if os.path.isfile(xml2_config_path):
-        common.run(
-            ['sed', '-i', '-e', 's|prefix=/usr|prefix={}/usr|'.
-                format(root), xml2_config_path])
-
-    xslt_config_path = os.path.join(root, 'usr', 'bin', 'xslt-config')
-    if os.path.isfile(xslt_config_path):
-        common.run(
-            ['sed', '-i', '-e', 's|prefix=/usr|prefix={}/usr|'.
-                format(root), xslt_config_path])
-
-
-def _fix_filemode(path):
-    mode = stat.S_IMODE(os.stat(path, follow_symlinks=False).st_mode)
+            path = os.path.join(dirpath, entry)
+            mode = os.lstat(path).st_mode
+            if stat.S_ISLNK(mode):
+                if final:
+                    _fix_symlink(root, dirpath, path)
+                continue
+
+            _fix_filemode(path, mode)
+            if not stat.S_ISREG(mode):
+                continue
+            if in_bin:
+                _fix_shebang(path)
+            if final and path in config_scripts:
+                _fix_config_script(root, path)
+
+
+def _fix_symlink(root, dirpath, path):
+    """Make an absolute symlink relative to root.
+
+    Sometimes debs will contain absolute symlinks (e.g. if the relative
+    path would go all the way to root, they just do absolute).  We can't
+    have that, so instead clean those absolute symlinks.
+    """
+    link = os.readlink(path)
+    if not os.path.isabs(link):
+        return
+
+    target = os.path.join(root, link[1:])
+    if _skip_link(link):
+        logger.debug('Skipping {}'.format(target))
+        return
+    if not os.path.exists(target):
+        if not _try_copy_local(path, target):
+            return
+    os.remove(path)
+    os.symlink(os.path.relpath(target, dirpath), path)
+
+
+def _fix_filemode(path, mode):
+    """Remove suid/guid bits, which we do not want in the resulting snap."""
+    mode = stat.S_IMODE(mode)
     if mode & 0o4000 or mode & 0o2000:
         logger.warning('Removing suid/guid from {}'.format(path))
         os.chmod(path, mode & 0o1777)
 
 
-def _fix_shebangs(path):
-    """Changes hard coded shebangs for files in _BIN_PATHS to use env."""
-    paths = [p for p in _BIN_PATHS if os.path.exists(os.path.join(path, p))]
-    for p in [os.path.join(path, p) for p in paths]:
-        common.replace_in_file(p, re.compile(r''),
-                               re.compile(r'#!.*python\n'),
-                               r'#!/usr/bin/env python\n')
+def _fix_shebang(path):
+    """Change a hard coded python shebang to use env."""
+    with open(path, 'rb') as f:
+        if f.read(2) != b'#!':
+            return
+        shebang = b'#!' + f.readline(_MAX_SHEBANG)
+        if not _PYTHON_SHEBANG.fullmatch(shebang):
+            return
+        contents = f.read()
+
+    new_shebang = b'#!/usr/bin/env python\n'
+    if shebang != new_shebang:
+        common.replace_file_contents(path, new_shebang + contents)
+
+
+def _fix_config_script(root, path):
+    """Point the prefix of a -config script into root."""
+    with open(path) as f:
+        lines = f.readlines()
+
+    replaced = [line.replace('prefix=/usr', 'prefix={}/usr'.format(root), 1)
+                for line in lines]
+    if replaced != lines:
+        common.replace_file_contents(path, ''.join(replaced))
 
 
 _skip_list = None
@@ -45,13 +45,23 @@ A part that uses common source options can have these keyword entries:
       (string)
       A source directory within a repository or tarfile to enter and build
       from.
+    - source-checksum:
+      (string)
+      The sha256 checksum of a tarball source. A download that does not
+      match it results in an error, and the tarball is never downloaded
+      again once it is in the cache.
 """
 
 
+import concurrent.futures
+import contextlib
+import email.utils
+import hashlib
 import logging
 import os
 import os.path
 import requests
+import requests.adapters
 import shutil
 import tarfile
 import re
@@ -61,6 +71,7 @@ import tempfile
 import snapcraft.common
 
 
+logger = logging.getLogger(__name__)
 logging.getLogger('urllib3').setLevel(logging.CRITICAL)
 
 
@@ -79,6 +90,62 @@ class Base:
         self.source_tag = source_tag
         self.source_branch = source_branch
 
+    def prefetch(self):
+        """Fetch the source into the shared user caches, if any.
+
+        Only sources which are kept in a cache shared between projects have
+        anything to prefetch. This never touches source_dir.
+        """
+        pass
+
+    def _skip_offline(self, pulled, mirror=None):
+        """Return True if pulling from the network must be skipped.
+
+        :param bool pulled: True if the source was already pulled.
+        :param str mirror: a local mirror a source never pulled can be
+                           pulled from when offline.
+        :raises snapcraft.common.MissingArtifactsError: if offline and the
+                                                        source was never
+                                                        pulled.
+        """
+        if not snapcraft.common.get_offline():
+            return False
+        if not pulled:
+            if mirror and os.path.exists(mirror):
+                return False
+            raise snapcraft.common.MissingArtifactsError([self.source])
+
+        logger.info('Offline, using the previously pulled {!r}'.format(
+            self.source))
+        return True
+
+    def _is_unchanged(self, local_cmd, remote_cmd, field=0):
+        """Return True if the source has not changed since it was pulled.
+
+        This is a cheap check done before pulling an existing checkout.
+
+        :param list local_cmd: prints the revision that was pulled.
+        :param list remote_cmd: prints the current revision of the source.
+        :param int field: the whitespace separated field holding the
+                          revision in their output.
+        """
+        if snapcraft.common.get_offline():
+            return False
+        try:
+            local, remote = (
+                subprocess.check_output(
+                    cmd, stderr=subprocess.DEVNULL).split()[field]
+                for cmd in (local_cmd, remote_cmd))
+        except (subprocess.CalledProcessError, IndexError, OSError):
+            # Pull to find out.
+            return False
+        if local != remote:
+            return False
+
+        logger.info('{!r} has not changed since it was pulled'.format(
+            self.source))
+        return True
+
 
 class Bazaar(Base):
 
@@ -89,20 +156,52 @@ class Bazaar(Base):
             raise IncompatibleOptionsError(
                 'can\'t specify a source-branch for a bzr source')
 
+    def prefetch(self):
+        self._get_mirror()
+
     def pull(self):
+        pulled = os.path.exists(os.path.join(self.source_dir, '.bzr'))
         tag_opts = []
         if self.source_tag:
             tag_opts = ['-r', 'tag:' + self.source_tag]
-        if os.path.exists(os.path.join(self.source_dir, '.bzr')):
+        if pulled and self._is_unchanged(
+                ['bzr', 'revision-info', '-d', self.source_dir] + tag_opts,
+                ['bzr', 'revision-info', '-d', self.source] + tag_opts,
+                field=1):
+            return
+
+        mirror = self._get_mirror()
+        if self._skip_offline(pulled, mirror):
+            return
+
+        if pulled:
             cmd = ['bzr', 'pull'] + tag_opts + \
-                  [self.source, '-d', self.source_dir]
+                  [mirror, '-d', self.source_dir]
         else:
-            os.rmdir(self.source_dir)
-            cmd = ['bzr', 'branch'] + tag_opts + \
-                  [self.source, self.source_dir]
+            # Only the revisions not in the mirror are stored in the part.
+            cmd = ['bzr', 'branch', '--stacked', '--use-existing-dir'] + \
+                tag_opts + [mirror, self.source_dir]
 
         subprocess.check_call(cmd)
 
+    def _get_mirror(self):
+        if os.path.isdir(self.source):
+            # Local branches are as good as a mirror.
+            return self.source
+
+        def create(repo):
+            subprocess.check_call(['bzr', 'init-repo', '--no-trees', repo])
+            subprocess.check_call(['bzr', 'branch', '--no-tree', self.source,
+                                   os.path.join(repo, 'branch')])
+
+        def refresh(repo):
+            subprocess.check_call(['bzr', 'pull', '--overwrite', '-d',
+                                   os.path.join(repo, 'branch'),
+                                   self.source])
+
+        return os.path.join(
+            _get_mirror('bzr', self.source, create, refresh), 'branch')
+
 
 class Git(Base):
 
@@ -114,30 +213,74 @@ class Git(Base):
                 'can\'t specify both source-tag and source-branch for '
                 'a git source')
 
+    def prefetch(self):
+        self._get_mirror()
+
     def pull(self):
-        if os.path.exists(os.path.join(self.source_dir, '.git')):
-            refspec = 'HEAD'
-            if self.source_branch:
-                refspec = 'refs/heads/' + self.source_branch
-            elif self.source_tag:
-                refspec = 'refs/tags/' + self.source_tag
-
-            # Pull changes to this repository and any submodules.
+        pulled = os.path.exists(os.path.join(self.source_dir, '.git'))
+        refspec = 'HEAD'
+        if self.source_branch:
+            refspec = 'refs/heads/' + self.source_branch
+        elif self.source_tag:
+            refspec = 'refs/tags/' + self.source_tag
+        if pulled and self._is_unchanged(
+                ['git', '-C', self.source_dir, 'rev-parse', refspec],
+                ['git', 'ls-remote', self.source, refspec]):
+            return
+
+        mirror = self._get_mirror()
+        if self._skip_offline(pulled, mirror):
+            return
+
+        # Submodules are fetched in parallel by git versions that support it.
+        submodule_jobs = 'submodule.fetchJobs={}'.format(
+            snapcraft.common.get_parallel_build_count())
+        if pulled:
+            # Pull changes to this repository and any submodules, the
+            # mirror is already up to date.
             subprocess.check_call(['git', '-C', self.source_dir, 'pull',
-                                   '--recurse-submodules=yes', self.source,
+                                   '--recurse-submodules=yes', mirror,
                                    refspec])
 
             # Merge any updates for the submodules (if any).
-            subprocess.check_call(['git', '-C', self.source_dir, 'submodule',
+            subprocess.check_call(['git', '-C', self.source_dir,
+                                   '-c', submodule_jobs, 'submodule',
                                    'update'])
         else:
             branch_opts = []
             if self.source_tag or self.source_branch:
                 branch_opts = ['--branch',
                                self.source_tag or self.source_branch]
-            subprocess.check_call(['git', 'clone', '--depth', '1',
-                                  '--recursive'] + branch_opts +
-                                  [self.source, self.source_dir])
+            # The objects are shared with the mirror instead of copied. The
+            # objects of a local repository are hardlinked instead, the
+            # user may prune them from under a shared clone.
+            shared_opts = [] if mirror == self.source else ['--shared']
+            subprocess.check_call(['git', 'clone'] + shared_opts +
+                                  branch_opts + [mirror, self.source_dir])
+            # Relative submodule urls are relative to the source.
+            subprocess.check_call(['git', '-C', self.source_dir, 'remote',
+                                   'set-url', 'origin', self.source])
+            subprocess.check_call(['git', '-C', self.source_dir,
+                                   '-c', submodule_jobs, 'submodule',
+                                   'update', '--init', '--recursive'])
+
+    def _get_mirror(self):
+        if os.path.isdir(self.source):
+            # Local repositories are as good as a mirror.
+            return self.source
+
+        def create(mirror):
+            subprocess.check_call(
+                ['git', 'clone', '--mirror', self.source, mirror])
+            # Objects must never be pruned, clones borrow them.
+            subprocess.check_call(
+                ['git', '-C', mirror, 'config', 'gc.auto', '0'])
+
+        def refresh(mirror):
+            subprocess.check_call(
+                ['git', '-C', mirror, 'fetch', '--prune', 'origin'])
+
+        return _get_mirror('git', self.source, create, refresh)
 
 
 class Mercurial(Base):
@@ -150,27 +293,58 @@ class Mercurial(Base):
                 'can\'t specify both source-tag and source-branch for a '
                 'mercurial source')
 
+    def prefetch(self):
+        self._get_mirror()
+
     def pull(self):
-        if os.path.exists(os.path.join(self.source_dir, '.hg')):
+        pulled = os.path.exists(os.path.join(self.source_dir, '.hg'))
+        rev = self.source_tag or self.source_branch
+        # The store is shared with the mirror, so compare the revision the
+        # working copy is at rather than what the store holds.
+        if pulled and self._is_unchanged(
+                ['hg', '-R', self.source_dir, 'identify', '--id', '-r', '.'],
+                ['hg', 'identify', '--id', '-r', rev or 'default',
+                 self.source]):
+            return
+
+        mirror = self._get_mirror()
+        if self._skip_offline(pulled, mirror):
+            return
+
+        if pulled:
             ref = []
             if self.source_tag:
                 ref = ['-r', self.source_tag]
             elif self.source_branch:
                 ref = ['-b', self.source_branch]
-            cmd = ['hg', 'pull'] + ref + [self.source, ]
+            subprocess.check_call(
+                ['hg', '-R', self.source_dir, 'pull'] + ref + [mirror])
         else:
-            ref = []
-            if self.source_tag or self.source_branch:
-                ref = ['-u', self.source_tag or self.source_branch]
-            cmd = ['hg', 'clone'] + ref + [self.source, self.source_dir]
+            # The part shares the store of the mirror instead of copying it.
+            subprocess.check_call(['hg', '--config', 'extensions.share=',
+                                   'share', '-U', mirror, self.source_dir])
+        subprocess.check_call(['hg', '-R', self.source_dir, 'update'] +
+                              ([rev] if rev else []))
 
-        subprocess.check_call(cmd)
+    def _get_mirror(self):
+        if os.path.isdir(self.source):
+            # Local repositories are as good as a mirror.
+            return self.source
+
+        def create(mirror):
+            subprocess.check_call(['hg', 'clone', '-U', '--uncompressed',
+                                   self.source, mirror])
+
+        def refresh(mirror):
+            subprocess.check_call(['hg', '-R', mirror, 'pull'])
+
+        return _get_mirror('hg', self.source, create, refresh)
 
 
 class Tar(Base):
 
     def __init__(self, source, source_dir, source_tag=None,
-                 source_branch=None):
+                 source_branch=None, source_checksum=None):
         super().__init__(source, source_dir, source_tag, source_branch)
         if source_tag:
             raise IncompatibleOptionsError(
@@ -178,25 +352,125 @@ class Tar(Base):
         elif source_branch:
             raise IncompatibleOptionsError(
                 'can\'t specify a source-branch for a tar source')
+        self.source_checksum = source_checksum
 
-    def pull(self):
+    def prefetch(self):
         if snapcraft.common.isurl(self.source):
             self._download()
-        self.provision(self.source_dir)
 
-    def _download(self):
-        req = requests.get(self.source, stream=True, allow_redirects=True)
-        if req.status_code is not 200:
+    def pull(self):
+        if not snapcraft.common.isurl(self.source):
+            self.provision(self.source_dir)
+        elif not self._pull_tarball():
+            self.provision(self.source_dir)
+
+    def _pull_tarball(self):
+        # Returns True if the tarball was extracted while downloading it.
+        tarball = os.path.join(
+            self.source_dir, os.path.basename(self.source))
+        cached_tarball = self._get_cached_tarball()
+        extracted = False
+        if not snapcraft.common.get_offline():
+            extracted = self._download(extract_to=self.source_dir)
+        elif os.path.exists(tarball):
+            logger.info('Offline, using the previously pulled {!r}'.format(
+                self.source))
+            return False
+        elif not os.path.exists(cached_tarball):
+            raise snapcraft.common.MissingArtifactsError([self.source])
+
+        os.makedirs(self.source_dir, exist_ok=True)
+        snapcraft.common.link_or_copy(cached_tarball, tarball)
+        return extracted
+
+    def _get_cached_tarball(self):
+        # Tarballs with a known checksum are shared by every url serving
+        # them, the others are keyed by their url.
+        key = self.source_checksum or hashlib.sha256(
+            self.source.encode()).hexdigest()
+        return os.path.join(snapcraft.common.get_cachedir(), 'tarballs',
+                            key, os.path.basename(self.source))
+
+    def _download(self, extract_to=None):
+        """Download the tarball into the user cache.
+
+        A tarball with a checksum is only downloaded once, the others are
+        only downloaded again if the server reports they were modified.
+
+        :param str extract_to: if set, the tarball is also extracted into
+                               this directory while it is downloaded.
+        :returns: True if the tarball was downloaded.
+        """
+        cached_tarball = self._get_cached_tarball()
+        # Parts sharing a tarball wait for a single download of it, its
+        # partial download dir is only ever written by one of them.
+        with snapcraft.common.get_path_lock(cached_tarball):
+            return self._fetch(cached_tarball, extract_to)
+
+    def _fetch(self, cached_tarball, extract_to):
+        headers = {}
+        if os.path.exists(cached_tarball):
+            if self.source_checksum:
+                return False
+            headers['If-Modified-Since'] = email.utils.formatdate(
+                os.path.getmtime(cached_tarball), usegmt=True)
+
+        req = _get_session().get(self.source, stream=True,
+                                 allow_redirects=True, headers=headers)
+        if req.status_code == 304:
+            logger.debug('Using the cached {!r}'.format(self.source))
+            return False
+        elif req.status_code != 200:
             raise EnvironmentError('unexpected http status code when '
                                    'downloading {}'.format(req.status_code))
 
-        file = os.path.join(self.source_dir, os.path.basename(self.source))
-        with open(file, 'wb') as f:
-            for chunk in req.iter_content(1024):
-                f.write(chunk)
+        os.makedirs(os.path.dirname(cached_tarball), exist_ok=True)
+        partialdir = cached_tarball + '.partial'
+        if _accepts_segments(req):
+            # The segments are only extracted once all of them are
+            # downloaded, while they are joined into the tarball.
+            req.close()
+            body = _download_segments(req.url, req.headers, partialdir)
+        else:
+            body = req.iter_content(_CHUNK_SIZE)
+        with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(cached_tarball), delete=False) as f:
+            try:
+                checksum = hashlib.sha256()
+                chunks = _tee(body, f, checksum)
+                with contextlib.ExitStack() as stack:
+                    if extract_to:
+                        stack.enter_context(_staged_extract(
+                            _ChunkReader(chunks), extract_to))
+                    # Whatever is left after the end of the archive, or all
+                    # of it when not extracting.
+                    for chunk in chunks:
+                        pass
+                    f.flush()
+                    shutil.rmtree(partialdir, ignore_errors=True)
+                    self._verify(checksum.hexdigest())
+                    _set_last_modified(f.name, req.headers)
+                    # Only complete and verified tarballs make it into the
+                    # cache, and into extract_to.
+                    os.replace(f.name, cached_tarball)
+            finally:
+                if os.path.exists(f.name):
+                    os.remove(f.name)
+
+        return True
+
+    def _verify(self, checksum):
+        if self.source_checksum and checksum != self.source_checksum:
+            raise EnvironmentError(
+                'checksum mismatch for {!r}: expected {} but got {}'.format(
+                    self.source, self.source_checksum, checksum))
 
     def provision(self, dst, clean_target=True):
-        # TODO add unit tests.
+        """Extract the tarball into dst.
+
+        :param bool clean_target: replace the contents of dst instead of
+                                  extracting on top of them.
+        """
         if snapcraft.common.isurl(self.source):
             tarball = os.path.join(
                 self.source_dir,
@@ -204,48 +478,271 @@ class Tar(Base):
         else:
             tarball = os.path.abspath(self.source)
 
-        if clean_target:
-            tmp_tarball = tempfile.NamedTemporaryFile().name
-            shutil.move(tarball, tmp_tarball)
-            shutil.rmtree(dst)
-            os.makedirs(dst)
-            shutil.move(tmp_tarball, tarball)
-
-        self._extract(tarball, dst)
-
-    def _extract(self, tarball, dst):
-        with tarfile.open(tarball) as tar:
-            def filter_members(tar):
-                """Filters members and member names:
-                    - strips common prefix
-                    - bans dangerous names"""
-                members = tar.getmembers()
-                common = os.path.commonprefix([m.name for m in members])
-
-                # commonprefix() works a character at a time and will
-                # consider "d/ab" and "d/abc" to have common prefix "d/ab";
-                # check all members either start with common dir
-                for m in members:
-                    if not (m.name.startswith(common + '/') or
-                            m.isdir() and m.name == common):
-                        # commonprefix() didn't return a dir name; go up one
-                        # level
-                        common = os.path.dirname(common)
-                        break
-
-                for m in members:
-                    if m.name == common:
-                        continue
-                    if m.name.startswith(common + '/'):
-                        m.name = m.name[len(common + '/'):]
-                    # strip leading '/', './' or '../' as many times as needed
-                    m.name = re.sub(r'^(\.{0,2}/)*', r'', m.name)
-                    # We mask all files to be writable to be able to easily
-                    # extract on top.
-                    m.mode = m.mode | 0o200
-                    yield m
-
-            tar.extractall(members=filter_members(tar), path=dst)
+        with open(tarball, 'rb') as f:
+            with _staged_extract(f, dst, clean_target, keep=tarball):
+                pass
+
+
+_CHUNK_SIZE = 1024 * 1024
+# Downloads at least this big are split in _SEGMENTS concurrent ranges.
+_SEGMENTED_MIN_SIZE = 32 * 1024 * 1024
+_SEGMENTS = 4
+_SEGMENT_RETRIES = 3
+_SEGMENT_TIMEOUT = 30
+
+_session = None
+
+
+def _get_session():
+    # A single session keeps the connections to a server alive across
+    # downloads, and allows for one connection per segment.
+    global _session
+    if not _session:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=_SEGMENTS)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+
+    return _session
+
+
+def _accepts_segments(req):
+    with contextlib.suppress(KeyError, ValueError):
+        return (req.headers.get('Accept-Ranges') == 'bytes' and
+                int(req.headers['Content-Length']) >= _SEGMENTED_MIN_SIZE)
+
+    return False
+
+
+def _download_segments(url, headers, partialdir):
+    """Download url as concurrent ranges into partialdir.
+
+    The ranges already in partialdir from an interrupted download of the
+    same content are resumed instead of downloaded again.
+
+    :param headers: the headers of a response for url.
+    :returns: an iterator over the downloaded content.
+    """
+    length = int(headers['Content-Length'])
+    validator = '{} {}'.format(
+        length, headers.get('ETag') or headers.get('Last-Modified', ''))
+    validator_file = os.path.join(partialdir, 'validator')
+    with contextlib.suppress(FileNotFoundError):
+        with open(validator_file) as f:
+            if f.read() != validator:
+                logger.debug('Discarding the outdated partial download '
+                             'of {!r}'.format(url))
+                shutil.rmtree(partialdir)
+    if not os.path.exists(validator_file):
+        os.makedirs(partialdir, exist_ok=True)
+        with open(validator_file, 'w') as f:
+            f.write(validator)
+
+    size = -(-length // _SEGMENTS)
+    segments = [(os.path.join(partialdir, str(start)), start,
+                 min(start + size, length) - 1)
+                for start in range(0, length, size)]
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(segments)) as executor:
+        list(executor.map(
+            lambda segment: _download_segment(url, *segment), segments))
+
+    return _read_files([path for path, start, end in segments])
+
+
+def _download_segment(url, path, start, end):
+    # Whatever is already in path is kept, on retries too.
+    for attempt in range(_SEGMENT_RETRIES):
+        offset = start + _get_size(path)
+        if offset > end:
+            break
+        try:
+            req = _get_session().get(
+                url, stream=True, timeout=_SEGMENT_TIMEOUT,
+                headers={'Range': 'bytes={}-{}'.format(offset, end)})
+            if req.status_code != 206:
+                raise EnvironmentError(
+                    'unexpected http status code when downloading '
+                    '{}'.format(req.status_code))
+            with open(path, 'ab') as f:
+                for chunk in req.iter_content(_CHUNK_SIZE):
+                    f.write(chunk)
+        except requests.exceptions.RequestException as e:
+            logger.debug('Retrying {!r} from byte {}: {}'.format(
+                url, start + _get_size(path), e))
+
+    if start + _get_size(path) != end + 1:
+        raise EnvironmentError(
+            'failed to download bytes {}-{} of {}'.format(start, end, url))
+
+
+def _get_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _read_files(paths):
+    for path in paths:
+        with open(path, 'rb') as f:
+            yield from iter(lambda: f.read(_CHUNK_SIZE), b'')
+
+
+def _tee(chunks, f, checksum):
+    for chunk in chunks:
+        checksum.update(chunk)
+        f.write(chunk)
+        yield chunk
+
+
+class _ChunkReader:
+    """A readable file object over an iterator of bytes."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._chunk = b''
+        self._offset = 0
+
+    def read(self, size=-1):
+        data = []
+        while size != 0:
+            if self._offset == len(self._chunk):
+                self._chunk = next(self._chunks, b'')
+                self._offset = 0
+                if not self._chunk:
+                    break
+            end = len(self._chunk)
+            if size > 0:
+                end = min(end, self._offset + size)
+                size -= end - self._offset
+            data.append(self._chunk[self._offset:end])
+            self._offset = end
+
+        return b''.join(data)
+
+
+@contextlib.contextmanager
+def _staged_extract(fileobj, dst, clean_target=True, keep=None):
+    """Extract the tarball read from fileobj for dst.
+
+    The tarball is read as a stream and extracted into a staging directory
+    next to dst, which only replaces dst (or is merged into it, if not
+    clean_target) when the context exits without an error.
+
+    :param str keep: a file in dst to move over to the new dst.
+    """
+    dst = os.path.abspath(dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    staging = tempfile.mkdtemp(
+        prefix='.{}-'.format(os.path.basename(dst)),
+        dir=os.path.dirname(dst))
+    try:
+        tree = os.path.join(staging, 'tree')
+        os.mkdir(tree, 0o755)
+        root = os.path.join(tree, _extract_stream(fileobj, tree))
+        yield
+        if not clean_target:
+            _merge_tree(root, dst)
+            return
+        previous = os.path.join(staging, 'previous')
+        if os.path.lexists(dst):
+            os.rename(dst, previous)
+        os.rename(root, dst)
+        if keep and os.path.dirname(os.path.abspath(keep)) == dst:
+            os.rename(os.path.join(previous, os.path.basename(keep)), keep)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _extract_stream(fileobj, path):
+    """Extract the tarball read from fileobj into path, as it is read.
+
+    :returns: the directory, relative to path, common to all the members.
+    """
+    members = []
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+        def filter_members(tar):
+            """Filters members and member names:
+                - bans dangerous names
+                - records names, for the common prefix"""
+            for m in tar:
+                # strip leading '/', './' or '../' as many times as needed
+                m.name = re.sub(r'^(\.{0,2}/)*', r'', m.name)
+                if not m.name:
+                    continue
+                # We mask all files to be writable to be able to easily
+                # extract on top.
+                m.mode = m.mode | 0o200
+                members.append((m.name, m.isdir()))
+                yield m
+
+        tar.extractall(members=filter_members(tar), path=path)
+
+    common = os.path.commonprefix([name for name, isdir in members])
+    # commonprefix() works a character at a time and will consider "d/ab"
+    # and "d/abc" to have common prefix "d/ab"; check all members either
+    # start with common dir
+    for name, isdir in members:
+        if not (name.startswith(common + '/') or isdir and name == common):
+            # commonprefix() didn't return a dir name; go up one level
+            common = os.path.dirname(common)
+            break
+
+    return common
+
+
+def _merge_tree(src, dst):
+    for root, dirs, files in os.walk(src):
+        dstroot = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(dstroot, exist_ok=True)
+        for name in files + [d for d in dirs
+                             if os.path.islink(os.path.join(root, d))]:
+            os.replace(os.path.join(root, name), os.path.join(dstroot, name))
+
+
+def _set_last_modified(path, headers):
+    # The modification time is sent back as If-Modified-Since.
+    with contextlib.suppress(KeyError, TypeError, ValueError):
+        mtime = email.utils.parsedate_to_datetime(
+            headers['Last-Modified']).timestamp()
+        os.utime(path, (mtime, mtime))
+
+
+# Mirrors created or refreshed during this run.
+_refreshed_mirrors = set()
+
+
+def _get_mirror(kind, source, create, refresh):
+    """Return the path to the mirror of source in the user cache.
+
+    The mirror is created with create(path), or refreshed with
+    refresh(path) the first time it is used in a run. Offline, it is
+    returned as is, whether it exists or not.
+
+    :param str kind: the kind of version control system.
+    """
+    mirror = os.path.join(snapcraft.common.get_cachedir(), 'mirrors', kind,
+                          hashlib.sha256(source.encode()).hexdigest())
+    # Parts sharing a source wait for a single update of its mirror.
+    with snapcraft.common.get_path_lock(mirror):
+        if snapcraft.common.get_offline() or mirror in _refreshed_mirrors:
+            return mirror
+
+        if os.path.exists(mirror):
+            logger.info('Updating the mirror of {!r}'.format(source))
+            refresh(mirror)
+        else:
+            os.makedirs(os.path.dirname(mirror), exist_ok=True)
+            tempdir = tempfile.mkdtemp(dir=os.path.dirname(mirror))
+            try:
+                create(tempdir)
+                os.rename(tempdir, mirror)
+            finally:
+                shutil.rmtree(tempdir, ignore_errors=True)
+        _refreshed_mirrors.add(mirror)
+
+    return mirror
 
 
 class Local(Base):
@@ -271,14 +768,35 @@ def get(sourcedir, builddir, options):
     :param str builddir: The build directory to use.
     :param options: source options.
     """
+    _get_handler(sourcedir, options).pull()
+
+
+def prefetch(sourcedir, options):
+    """Fetch the source defined in options into the shared user caches.
+
+    :param str sourcedir: The source directory pull would use.
+    :param options: source options.
+    """
+    _get_handler(sourcedir, options).prefetch()
+
+
+def _get_handler(sourcedir, options):
     source_type = getattr(options, 'source_type', None)
     source_tag = getattr(options, 'source_tag', None)
     source_branch = getattr(options, 'source_branch', None)
 
+    source_checksum = getattr(options, 'source_checksum', None)
+
     handler_class = _get_source_handler(source_type, options.source)
-    handler = handler_class(options.source, sourcedir, source_tag,
-                            source_branch)
-    handler.pull()
+    if handler_class is Tar:
+        return Tar(options.source, sourcedir, source_tag, source_branch,
+                   source_checksum)
+    elif source_checksum:
+        raise IncompatibleOptionsError(
+            'can\'t specify a source-checksum for a non tar source')
+
+    return handler_class(options.source, sourcedir, source_tag,
+                         source_branch)
 
 
 def get_required_packages(options):
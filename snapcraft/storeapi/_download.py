@@ -18,6 +18,7 @@ import hashlib
 import json
 import os
 import logging
+import tempfile
 
 from .common import get_oauth_session
 
@@ -45,8 +46,17 @@ def download(snap, download_path, config, arch):
     else:
         logger.info('Downloading {!r}'.format(snap))
         download = session.get(download_url)
-        with open(download_path, 'wb') as f:
-            f.write(download.content)
+        # Any links to a previous download keep it.
+        fd, partial = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(download_path)),
+            suffix='.partial')
+        try:
+            with open(fd, 'wb') as f:
+                f.write(download.content)
+            os.replace(partial, download_path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
         if _is_downloaded(download_path, download_sha):
             logger.info('Successfully downloaded {!r}'.format(snap))
         else:
@@ -28,12 +28,13 @@ from snapcraft.tests import fixture_setup
 class MockOptions:
 
     def __init__(self, source=None, source_type=None, source_branch=None,
-                 source_tag=None, source_subdir=None):
+                 source_tag=None, source_subdir=None, source_checksum=None):
         self.source = source
         self.source_type = source_type
         self.source_branch = source_branch
         self.source_tag = source_tag
         self.source_subdir = source_subdir
+        self.source_checksum = source_checksum
 
 
 class TestCase(testscenarios.WithScenarios, fixtures.TestWithFixtures):
@@ -52,6 +53,13 @@ class TestCase(testscenarios.WithScenarios, fixtures.TestWithFixtures):
         self.addCleanup(common.set_enable_parallel_builds,
                         common.get_enable_parallel_builds())
         self.addCleanup(common.reset_env)
+        self.addCleanup(common.set_refresh_indexes,
+                        common.get_refresh_indexes())
+        self.addCleanup(common.set_offline, common.get_offline())
+        self.addCleanup(common.set_jobserver, common.get_jobserver())
+        # Keep the user level caches away from the real ones.
+        self.addCleanup(common.set_cachedir, common.get_cachedir())
+        common.set_cachedir(self.useFixture(fixtures.TempDir()).path)
         common.set_schemadir(os.path.join(__file__,
                              '..', '..', '..', 'schema'))
         self.useFixture(fixtures.FakeLogger(level=logging.ERROR))
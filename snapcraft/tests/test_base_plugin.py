@@ -62,6 +62,7 @@ class TestBasePlugin(tests.TestCase):
         self.assertEqual(
             os.path.join(plugin.build_basedir, options.source_subdir),
             plugin.builddir)
+        self.assertEqual(subdir, plugin.subsourcedir)
 
         plugin.build()
 
@@ -76,6 +77,7 @@ class TestBasePlugin(tests.TestCase):
         open(os.path.join(plugin.sourcedir, 'file'), 'w').close()
 
         self.assertEqual(plugin.build_basedir, plugin.builddir)
+        self.assertEqual(plugin.sourcedir, plugin.subsourcedir)
 
         plugin.build()
 
@@ -201,6 +203,45 @@ class BuildTestCase(tests.TestCase):
             self.assertFalse(
                 os.path.exists(os.path.join(plugin.builddir, file_)))
 
+    def test_build_copies_everything_again(self):
+        plugin = snapcraft.BasePlugin('test-part', options=None)
+        os.makedirs(plugin.sourcedir)
+        open(os.path.join(plugin.sourcedir, 'file'), 'w').close()
+        open(os.path.join(plugin.sourcedir, 'removed'), 'w').close()
+        plugin.build()
+
+        open(os.path.join(plugin.build_basedir, 'file.o'), 'w').close()
+        os.remove(os.path.join(plugin.sourcedir, 'removed'))
+        plugin.build()
+
+        self.assertEqual(['file'], os.listdir(plugin.build_basedir))
+        self.assertFalse(os.path.exists(plugin._build_manifest))
+
+    def test_build_is_incremental(self):
+        plugin = snapcraft.BasePlugin('test-part', options=None)
+        plugin.incremental_build = True
+        os.makedirs(plugin.sourcedir)
+        open(os.path.join(plugin.sourcedir, 'file'), 'w').close()
+        open(os.path.join(plugin.sourcedir, 'removed'), 'w').close()
+        plugin.build()
+
+        open(os.path.join(plugin.build_basedir, 'file.o'), 'w').close()
+        os.remove(os.path.join(plugin.sourcedir, 'removed'))
+        plugin.build()
+
+        self.assertEqual(['file', 'file.o'],
+                         sorted(os.listdir(plugin.build_basedir)))
+
+    def test_clean_build_removes_the_sync_manifest(self):
+        plugin = snapcraft.BasePlugin('test-part', options=None)
+        plugin.incremental_build = True
+        os.makedirs(plugin.sourcedir)
+        plugin.build()
+
+        plugin.clean_build()
+
+        self.assertFalse(os.path.exists(plugin._build_manifest))
+
 
 class CleanBuildTestCase(tests.TestCase):
 
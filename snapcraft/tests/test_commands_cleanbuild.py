@@ -65,6 +65,7 @@ parts:
         files_tar = [
             os.path.join(common.get_partsdir(), 'plugins', 'x-plugin.py'),
             'main.c',
+            'snapcraft.lock',
         ]
         files_no_tar = [
             os.path.join(common.get_stagedir(), 'binary'),
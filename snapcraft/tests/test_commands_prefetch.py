@@ -0,0 +1,35 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2016 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import mock
+
+from snapcraft import tests
+from snapcraft.commands import prefetch
+
+
+class PrefetchCommandTestCase(tests.TestCase):
+
+    @mock.patch('snapcraft.lifecycle.prefetch')
+    def test_prefetch_all_parts(self, mock_prefetch):
+        prefetch.main()
+
+        mock_prefetch.assert_called_once_with([])
+
+    @mock.patch('snapcraft.lifecycle.prefetch')
+    def test_prefetch_some_parts(self, mock_prefetch):
+        prefetch.main(['part1', 'part2'])
+
+        mock_prefetch.assert_called_once_with(['part1', 'part2'])
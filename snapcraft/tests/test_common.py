@@ -17,8 +17,11 @@
 import os
 import platform
 import re
+import stat
+from unittest import mock
 from unittest.mock import patch
 
+import fixtures
 import testtools
 from testtools.matchers import (
     Contains,
@@ -26,6 +29,7 @@ from testtools.matchers import (
 
 from snapcraft import (
     common,
+    jobserver,
     tests
 )
 
@@ -91,6 +95,124 @@ class CommonTestCase(tests.TestCase):
                 with open(file_info['path'], 'r') as f:
                     self.assertEqual(f.read(), file_info['expected'])
 
+    def test_replace_in_file_does_not_change_hardlinks(self):
+        os.makedirs('bin')
+        path = os.path.join('bin', 'foo')
+        with open(path, 'w') as f:
+            f.write('#!/foo/bar/python')
+        os.chmod(path, 0o755)
+        os.link(path, 'link')
+
+        common.replace_in_file('bin', re.compile(r''),
+                               re.compile(r'#!.*python'),
+                               r'#!/usr/bin/env python')
+
+        with open(path) as f:
+            self.assertEqual('#!/usr/bin/env python', f.read())
+        with open('link') as f:
+            self.assertEqual('#!/foo/bar/python', f.read())
+        self.assertEqual(0o755, os.stat(path).st_mode & 0o777)
+
+    def test_replace_in_file_keeps_symlinks(self):
+        os.makedirs('bin')
+        path = os.path.join('bin', 'foo')
+        with open(path, 'w') as f:
+            f.write('#!/foo/bar/python')
+        os.symlink('foo', os.path.join('bin', 'link1'))
+        os.symlink('foo', os.path.join('bin', 'link2'))
+
+        common.replace_in_file('bin', re.compile(r''),
+                               re.compile(r'#!.*python'),
+                               r'#!/usr/bin/env python')
+
+        for link in ('link1', 'link2'):
+            self.assertEqual('foo', os.readlink(os.path.join('bin', link)))
+        with open(path) as f:
+            self.assertEqual('#!/usr/bin/env python', f.read())
+
+    def test_replace_file_contents_keeps_symlinks(self):
+        with open('target', 'w') as f:
+            f.write('old')
+        os.symlink('target', 'link')
+
+        common.replace_file_contents('link', 'new')
+
+        self.assertEqual('target', os.readlink('link'))
+        with open('target') as f:
+            self.assertEqual('new', f.read())
+
+    def test_replace_in_file_skips_binaries(self):
+        os.makedirs('bin')
+        contents = {
+            'elf': b'\x7fELF#!/foo/bar/python',
+            'nul': b'#!/foo/bar/python\0',
+            'latin1': b'#!/foo/bar/python\xe9',
+            'empty': b'',
+        }
+        for name, data in contents.items():
+            with open(os.path.join('bin', name), 'wb') as f:
+                f.write(data)
+
+        common.replace_in_file('bin', re.compile(r''),
+                               re.compile(r'#!.*python'),
+                               r'#!/usr/bin/env python')
+
+        for name, data in contents.items():
+            with self.subTest(key=name):
+                with open(os.path.join('bin', name), 'rb') as f:
+                    self.assertEqual(data, f.read())
+
+    def test_replace_in_file_only_searches_files_with_contains(self):
+        os.makedirs('bin')
+        with open(os.path.join('bin', 'foo'), 'w') as f:
+            f.write('foo/bar/python')
+
+        common.replace_in_file('bin', re.compile(r''),
+                               re.compile(r'.*python'),
+                               r'#!/usr/bin/env python', contains=b'#!')
+
+        with open(os.path.join('bin', 'foo')) as f:
+            self.assertEqual('foo/bar/python', f.read())
+
+    def test_link_or_copy_replaces_existing_files(self):
+        with open('src', 'w') as f:
+            f.write('new')
+        with open('dst', 'w') as f:
+            f.write('old')
+
+        common.link_or_copy('src', 'dst')
+
+        self.assertEqual(os.stat('src').st_ino, os.stat('dst').st_ino)
+
+    def test_reflink_or_copy(self):
+        with open('src', 'w') as f:
+            f.write('src')
+        os.chmod('src', 0o755)
+        with open('dst', 'w') as f:
+            f.write('old')
+
+        common.reflink_or_copy('src', 'dst')
+        with open('dst', 'w') as f:
+            f.write('new')
+
+        with open('src') as f:
+            self.assertEqual('src', f.read())
+        self.assertEqual(0o755, os.stat('dst').st_mode & 0o777)
+
+    def test_reflink_or_copy_symlinks(self):
+        os.symlink('target', 'src')
+
+        common.reflink_or_copy('src', 'dst')
+
+        self.assertEqual('target', os.readlink('dst'))
+
+    def test_link_or_copy_symlinks(self):
+        os.symlink('target', 'src')
+
+        common.link_or_copy('src', 'dst')
+
+        self.assertEqual('target', os.readlink('dst'))
+
     @patch('multiprocessing.cpu_count')
     def test_get_parallel_build_count(self, mock_cpu_count):
         mock_cpu_count.return_value = 3
@@ -107,6 +229,75 @@ class CommonTestCase(tests.TestCase):
         mock_cpu_count.side_effect = NotImplementedError
         self.assertEqual(common.get_parallel_build_count(), 1)
 
+    @patch('multiprocessing.cpu_count')
+    def test_get_parallel_build_args(self, mock_cpu_count):
+        mock_cpu_count.return_value = 3
+        self.assertEqual(['-j3'], common.get_parallel_build_args())
+
+    def test_get_parallel_build_args_with_jobserver(self):
+        server = self.useFixture(_JobServerFixture(3)).server
+        common.set_jobserver(server)
+
+        self.assertEqual(['--jobserver-fds={},{}'.format(*server.fds)],
+                         common.get_parallel_build_args())
+
+    @patch('subprocess.check_call')
+    def test_run_passes_the_jobserver_fds(self, mock_check_call):
+        server = self.useFixture(_JobServerFixture(3)).server
+        common.set_jobserver(server)
+        scripts = []
+        mock_check_call.side_effect = \
+            lambda cmd, **kwargs: scripts.append(open(cmd[1]).read())
+
+        common.run(['make'], cwd='dir')
+
+        mock_check_call.assert_called_once_with(
+            ['/bin/sh', mock.ANY, 'make'], cwd='dir', pass_fds=server.fds)
+        # Only the makes given the jobserver arguments use it.
+        self.assertNotIn('MAKEFLAGS', scripts[0])
+
+    def test_only_parallel_makes_use_the_jobserver(self):
+        server = self.useFixture(_JobServerFixture(2)).server
+        common.set_jobserver(server)
+        with open('Makefile', 'w') as f:
+            f.write('all: a b c d\n'
+                    'a b c d:\n'
+                    '\t@echo "$(MAKEFLAGS)" > $@\n')
+
+        common.run(['make'])
+        with open('a') as f:
+            self.assertNotIn('jobserver', f.read())
+
+        common.run(['make', '-B'] + common.get_parallel_build_args())
+        with open('a') as f:
+            self.assertIn('jobserver', f.read())
+
+    @patch('subprocess.check_call')
+    def test_run_without_jobserver(self, mock_check_call):
+        common.run(['make'], cwd='dir')
+
+        mock_check_call.assert_called_once_with(
+            ['/bin/sh', mock.ANY, 'make'], cwd='dir')
+
+    def test_get_path_lock(self):
+        lock = common.get_path_lock(os.path.join(self.path, 'a'))
+
+        self.assertIs(lock, common.get_path_lock(os.path.join(self.path, 'a')))
+        self.assertIsNot(
+            lock, common.get_path_lock(os.path.join(self.path, 'b')))
+
+
+class _JobServerFixture(fixtures.Fixture):
+
+    def __init__(self, jobs):
+        super().__init__()
+        self.jobs = jobs
+
+    def setUp(self):
+        super().setUp()
+        self.server = jobserver.JobServer(self.jobs)
+        self.addCleanup(self.server.close)
+
 
 class ArchTestCase(testtools.TestCase):
 
@@ -138,3 +329,125 @@ class ArchTestCase(testtools.TestCase):
             'badarch is not supported, please log a bug at '
             'https://bugs.launchpad.net/snapcraft/+filebug?'
             'field.title=please+add+support+for+badarch', str(e))
+
+
+class SyncTreeTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join('src', 'dir'))
+        self.write('src/a', 'a')
+        self.write('src/dir/b', 'b')
+        os.symlink('a', os.path.join('src', 'link'))
+        self.manifest = common.sync_tree('src', 'dst')
+
+    def write(self, path, contents):
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_sync_copies_the_tree(self):
+        self.assertEqual('a', self.read('dst/a'))
+        self.assertEqual('b', self.read('dst/dir/b'))
+        self.assertEqual('a', os.readlink('dst/link'))
+
+    def test_sync_copies_changed_files_only(self):
+        unchanged = os.stat('dst/dir/b').st_ino
+        self.write('src/a', 'changed')
+        os.utime('src/a', (0, 0))
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertEqual('changed', self.read('dst/a'))
+        self.assertEqual(unchanged, os.stat('dst/dir/b').st_ino)
+
+    def test_sync_copies_are_newer_than_build_artifacts(self):
+        self.write('dst/a.o', 'object')
+        self.write('src/a', 'changed')
+        # The source was changed long before it was synced.
+        os.utime('src/a', (0, 0))
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertGreaterEqual(os.stat('dst/a').st_mtime_ns,
+                                os.stat('dst/a.o').st_mtime_ns)
+
+    def test_sync_copies_the_permissions(self):
+        os.chmod('src/a', 0o755)
+        self.write('src/a', 'changed')
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertEqual(0o755, stat.S_IMODE(os.stat('dst/a').st_mode))
+
+    def test_sync_keeps_touched_files(self):
+        mtime = os.stat('dst/a').st_mtime_ns
+        os.utime('src/a', (0, 0))
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertEqual(mtime, os.stat('dst/a').st_mtime_ns)
+
+    def test_sync_restores_files_changed_in_dstdir(self):
+        self.write('dst/a', 'changed by the build')
+        os.remove('dst/link')
+        os.symlink('dir', 'dst/link')
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertEqual('a', self.read('dst/a'))
+        self.assertEqual('a', os.readlink('dst/link'))
+
+    def test_sync_restores_changed_touched_files(self):
+        os.utime('src/a', (0, 0))
+        manifest = common.sync_tree('src', 'dst', self.manifest)
+        self.write('dst/a', 'b')
+
+        common.sync_tree('src', 'dst', manifest)
+
+        self.assertEqual('a', self.read('dst/a'))
+
+    def test_sync_keeps_build_artifacts(self):
+        self.write('dst/dir/b.o', 'object')
+        os.remove('src/dir/b')
+        os.rmdir('src/dir')
+        os.remove('src/a')
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertFalse(os.path.exists('dst/a'))
+        self.assertFalse(os.path.exists('dst/dir/b'))
+        self.assertEqual('object', self.read('dst/dir/b.o'))
+
+    def test_sync_removes_empty_removed_directories(self):
+        os.remove('src/dir/b')
+        os.rmdir('src/dir')
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertFalse(os.path.exists('dst/dir'))
+
+    def test_sync_replaces_changed_types(self):
+        os.remove('src/link')
+        os.mkdir('src/link')
+        os.remove('src/dir/b')
+        os.rmdir('src/dir')
+        self.write('src/dir', 'file')
+
+        common.sync_tree('src', 'dst', self.manifest)
+
+        self.assertTrue(os.path.isdir('dst/link'))
+        self.assertFalse(os.path.islink('dst/link'))
+        self.assertEqual('file', self.read('dst/dir'))
+
+    def test_sync_ignores_top_level_names(self):
+        os.mkdir('src/parts')
+        self.write('src/dir/parts', 'parts')
+
+        common.sync_tree('src', 'dst', self.manifest, ignore=['parts'])
+
+        self.assertFalse(os.path.exists('dst/parts'))
+        self.assertTrue(os.path.exists('dst/dir/parts'))
@@ -0,0 +1,74 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2016 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from snapcraft import (
+    jobserver,
+    tests,
+)
+
+
+class JobServerTestCase(tests.TestCase):
+
+    def get_tokens(self, server):
+        os.set_blocking(server.fds[0], False)
+        try:
+            return os.read(server.fds[0], 1024)
+        except BlockingIOError:
+            return b''
+
+    def test_tokens(self):
+        with jobserver.JobServer(4) as server:
+            self.assertEqual(4, server.jobs)
+            # Every make has one job without a token.
+            self.assertEqual(b'+++', self.get_tokens(server))
+
+    def test_at_least_one_job(self):
+        with jobserver.JobServer(0) as server:
+            self.assertEqual(1, server.jobs)
+            self.assertEqual(b'', self.get_tokens(server))
+
+    def test_resize(self):
+        with jobserver.JobServer(2) as server:
+            server.resize(4)
+            self.assertEqual(4, server.jobs)
+            server.resize(3)
+            self.assertEqual(3, server.jobs)
+            self.assertEqual(b'++', self.get_tokens(server))
+
+    def test_resize_only_takes_back_free_tokens(self):
+        with jobserver.JobServer(3) as server:
+            # A running job holds a token.
+            os.read(server.fds[0], 1)
+
+            server.resize(1)
+
+            self.assertEqual(2, server.jobs)
+            self.assertEqual(b'', self.get_tokens(server))
+
+    def test_make_args(self):
+        with jobserver.JobServer(2) as server:
+            self.assertEqual(
+                ['--jobserver-fds={},{}'.format(*server.fds)],
+                server.make_args)
+
+    def test_close(self):
+        with jobserver.JobServer(2) as server:
+            fds = server.fds
+
+        for fd in fds:
+            self.assertRaises(OSError, os.fstat, fd)
@@ -15,6 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+import subprocess
+import time
+from unittest import mock
 
 import fixtures
 
@@ -120,3 +124,329 @@ parts:
             'type': 'os'
         }
         self.assertEqual(snap_info, expected_snap_info)
+
+    @mock.patch('snapcraft.repo.Ubuntu')
+    def test_stage_packages_changes_are_built_and_staged(self, ubuntu_mock):
+        yaml_template = """name: stage-packages
+version: 0
+summary: test stage-packages
+description: the stage-packages changes are staged
+icon: icon.png
+
+parts:
+  part1:
+    plugin: nil
+    stage-packages: [{}]
+"""
+        self.make_snapcraft_yaml(yaml_template.format('foo, bar'))
+        open('icon.png', 'w').close()
+
+        def get(package_names, lock=None):
+            ubuntu_mock.package_names = package_names
+
+        def unpack(rootdir, unpacked=None):
+            # Like repo.Ubuntu.unpack, without any debs.
+            for name in set(unpacked or {}) - set(ubuntu_mock.package_names):
+                os.remove(os.path.join(rootdir, name))
+            for name in ubuntu_mock.package_names:
+                open(os.path.join(rootdir, name), 'w').close()
+            return {name: [name] for name in ubuntu_mock.package_names}
+        ubuntu_mock.return_value.get.side_effect = get
+        ubuntu_mock.return_value.unpack.side_effect = unpack
+
+        lifecycle.execute('stage')
+        self.assertEqual(['bar', 'foo'], sorted(os.listdir('stage')))
+
+        with open('snapcraft.yaml', 'w') as f:
+            f.write(yaml_template.format('foo'))
+        with mock.patch('snapcraft.BasePlugin.build') as mock_build:
+            lifecycle.execute('stage')
+
+        mock_build.assert_called_once_with()
+        self.assertEqual(['foo'], os.listdir('stage'))
+        self.assertEqual(
+            ['foo'], os.listdir(os.path.join('parts', 'part1', 'install')))
+
+    @mock.patch('snapcraft.repo.install_build_packages')
+    def test_build_packages_installed_before_pull(self, mock_install):
+        self.make_snapcraft_yaml("""name: build-packages
+version: 0
+summary: test build-packages
+description: build-packages are installed before pulling
+build-packages: [foo]
+
+parts:
+  part1:
+    plugin: nil
+""")
+        open('icon.png', 'w').close()
+
+        def pull():
+            mock_install.assert_called_once_with(['foo'])
+
+        with mock.patch('snapcraft.pluginhandler.PluginHandler.pull',
+                        side_effect=pull) as mock_pull:
+            lifecycle.execute('pull')
+
+        mock_pull.assert_called_once_with()
+
+    @mock.patch('snapcraft.repo.install_build_packages')
+    def test_build_packages_error_is_raised(self, mock_install):
+        self.make_snapcraft_yaml("""name: build-packages
+version: 0
+summary: test build-packages
+description: build-packages are installed before pulling
+build-packages: [foo]
+
+parts:
+  part1:
+    plugin: nil
+""")
+        open('icon.png', 'w').close()
+
+        mock_install.side_effect = EnvironmentError('no foo')
+
+        with self.assertRaises(EnvironmentError):
+            lifecycle.execute('pull')
+
+    def test_missing_artifacts_are_reported_for_all_parts(self):
+        self.make_snapcraft_yaml("""name: offline
+version: 0
+summary: test offline
+description: everything missing offline is reported at once
+
+parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+""")
+        open('icon.png', 'w').close()
+
+        def pull(self):
+            raise common.MissingArtifactsError([self.name, 'shared'])
+
+        with mock.patch('snapcraft.pluginhandler.PluginHandler.pull', pull):
+            with self.assertRaises(common.MissingArtifactsError) as raised:
+                lifecycle.execute('pull')
+
+        self.assertEqual(['part1', 'part2', 'shared'],
+                         sorted(raised.exception.artifacts))
+
+    @mock.patch('snapcraft.pluginhandler.PluginHandler.pull')
+    def test_parts_share_a_jobserver(self, mock_pull):
+        self.make_snapcraft_yaml("""name: jobserver
+version: 0
+summary: test jobserver
+description: the makes run for all the parts share a jobserver
+
+parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+""")
+        common.set_enable_parallel_builds(False)
+        jobservers = []
+        mock_pull.side_effect = \
+            lambda *args: jobservers.append(common.get_jobserver())
+
+        lifecycle.execute('pull')
+
+        self.assertEqual(2, len(jobservers))
+        self.assertIs(jobservers[0], jobservers[1])
+        self.assertEqual(1, jobservers[0].jobs)
+        self.assertIsNone(common.get_jobserver())
+
+    @mock.patch('snapcraft.lifecycle._get_available_memory',
+                return_value=2 * 2**30)
+    @mock.patch('snapcraft.common.get_parallel_build_count', return_value=8)
+    @mock.patch('snapcraft.pluginhandler.PluginHandler.build', autospec=True)
+    def test_build_jobs_lowered_when_memory_is_short(
+            self, mock_build, mock_count, mock_available):
+        self.make_snapcraft_yaml("""name: memory
+version: 0
+summary: test memory
+description: jobs are lowered for parts which would not fit in memory
+
+parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+""")
+        lifecycle._save_stats('memory', {
+            'part1': {'peak-rss': 4 * 2**30, 'jobs': 4},
+            'part2': {'peak-rss': 2**30, 'jobs': 4},
+        })
+        jobs = {}
+
+        def build(part, *args):
+            jobs[part.name] = common.get_jobserver().jobs
+
+        mock_build.side_effect = build
+
+        lifecycle.execute('build')
+
+        # part1 used 1GiB per job, part2 256MiB.
+        self.assertEqual({'part1': 2, 'part2': 8}, jobs)
+
+    @mock.patch('snapcraft.lifecycle._MEMORY_SAMPLE_INTERVAL', 0.01)
+    @mock.patch('snapcraft.lifecycle._get_descendants_rss',
+                return_value=2**30)
+    @mock.patch('snapcraft.common.get_parallel_build_count', return_value=2)
+    @mock.patch('snapcraft.pluginhandler.PluginHandler.build')
+    def test_build_records_the_peak_memory(
+            self, mock_build, mock_count, mock_rss):
+        self.make_snapcraft_yaml("""name: memory
+version: 0
+summary: test memory
+description: the peak memory used by builds is recorded
+
+parts:
+  part1:
+    plugin: nil
+""")
+        mock_build.side_effect = lambda *args: time.sleep(0.1)
+
+        lifecycle.execute('build')
+
+        stats = lifecycle._load_stats('memory')['part1']
+        self.assertEqual(2**30, stats['peak-rss'])
+        self.assertEqual(2, stats['jobs'])
+
+    def test_step_durations_are_recorded(self):
+        self.make_snapcraft_yaml("""name: durations
+version: 0
+summary: test durations
+description: how long pulling and building took is recorded
+
+parts:
+  part1:
+    plugin: nil
+""")
+        lifecycle.execute('build')
+
+        stats = lifecycle._load_stats('durations')['part1']
+        self.assertIn('pull', stats)
+        self.assertIn('build', stats)
+
+    def test_parts_ordered_by_critical_path(self):
+        fake_logger = fixtures.FakeLogger(level=logging.INFO)
+        self.useFixture(fake_logger)
+
+        self.make_snapcraft_yaml("""name: critical-path
+version: 0
+summary: test critical path
+description: the longest chain of parts goes first
+
+parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after:
+      - part1
+  part3:
+    plugin: nil
+""")
+        lifecycle._save_stats('critical-path', {
+            'part1': {'pull': 0.5, 'build': 0.5},
+            'part2': {'build': 20},
+            'part3': {'build': 30},
+        })
+
+        lifecycle.execute('pull')
+
+        self.assertEqual(
+            'Pulling part3 \n'
+            'Pulling part1 \n'
+            '\'part2\' has prerequisites that need to be staged: part1\n'
+            'Skipping pull part1  (already ran)\n'
+            'Building part1 \n'
+            'Staging part1 \n'
+            'Pulling part2 \n',
+            fake_logger.output)
+
+    @mock.patch('snapcraft.plugins.nil.NilPlugin.prefetch', autospec=True)
+    def test_sources_prefetched_ahead_of_pull(self, mock_prefetch):
+        self.make_snapcraft_yaml("""name: prefetch
+version: 0
+summary: test prefetch
+description: sources are fetched while the parts are pulled
+
+parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+""")
+        lifecycle.execute('pull')
+
+        self.assertEqual(
+            ['part1', 'part2'],
+            sorted(c[0][0].name for c in mock_prefetch.call_args_list))
+
+        lifecycle.execute('pull')
+
+        # Nothing to fetch for parts already pulled.
+        self.assertEqual(2, mock_prefetch.call_count)
+
+    @mock.patch('snapcraft.plugins.nil.NilPlugin.prefetch')
+    def test_sources_not_prefetched_offline(self, mock_prefetch):
+        self.make_snapcraft_yaml("""name: prefetch
+version: 0
+summary: test prefetch
+description: nothing is fetched when offline
+
+parts:
+  part1:
+    plugin: nil
+""")
+        common.set_offline(True)
+
+        lifecycle.execute('pull')
+
+        self.assertFalse(mock_prefetch.called)
+
+    def test_get_descendants_rss(self):
+        self.assertEqual(0, lifecycle._get_descendants_rss(os.getpid()))
+
+        child = subprocess.Popen(['sleep', '10'])
+        self.addCleanup(child.wait)
+        self.addCleanup(child.kill)
+
+        self.assertGreater(lifecycle._get_descendants_rss(os.getpid()), 0)
+
+    @mock.patch('snapcraft.pluginhandler.PluginHandler.prefetch')
+    def test_prefetch_only_requested_parts(self, mock_prefetch):
+        self.make_snapcraft_yaml("""name: prefetch
+version: 0
+summary: test prefetch
+description: prefetch warms the caches without pulling
+
+parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+""")
+
+        lifecycle.prefetch(['part2'])
+
+        mock_prefetch.assert_called_once_with()
+        self.assertFalse(os.path.exists(common.get_partsdir()))
+
+    def test_prefetch_invalid_part(self):
+        self.make_snapcraft_yaml("""name: prefetch
+version: 0
+summary: test prefetch
+description: prefetch warms the caches without pulling
+
+parts:
+  part1:
+    plugin: nil
+""")
+
+        with self.assertRaises(EnvironmentError):
+            lifecycle.prefetch(['no-part'])
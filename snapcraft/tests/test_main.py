@@ -34,6 +34,7 @@ class TestMain(TestCase):
             'list-plugins',
             'init',
             'add-part',
+            'prefetch',
             'pull',
             'build',
             'clean',
@@ -55,6 +56,8 @@ class TestMain(TestCase):
             '--debug': False,
             '--no-parallel-build': False,
             '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': False,
             'ARGS': [],
         }
 
@@ -70,6 +73,8 @@ class TestMain(TestCase):
             '--debug': False,
             '--no-parallel-build': False,
             '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': False,
             'ARGS': [],
         }
         with mock.patch('snapcraft.commands.snap.main') as mock_cmd:
@@ -84,6 +89,8 @@ class TestMain(TestCase):
             '--debug': False,
             '--no-parallel-build': False,
             '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': False,
             'ARGS': [],
         }
 
@@ -96,6 +103,53 @@ class TestMain(TestCase):
         self.assertEqual(str(cm.exception), 'some error')
         mock_log_configure.assert_called_once_with(log_level=logging.INFO)
 
+    @mock.patch('snapcraft.main.docopt')
+    def test_command_error_is_wrapped(self, mock_docopt):
+        mock_docopt.return_value = {
+            'COMMAND': 'help',
+            '--debug': False,
+            '--no-parallel-build': False,
+            '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': False,
+            'ARGS': [],
+        }
+
+        with mock.patch('snapcraft.commands.help.main') as mock_cmd:
+            mock_cmd.side_effect = Exception(' '.join(['error'] * 20))
+
+            with self.assertRaises(SystemExit) as cm:
+                snapcraft.main.main()
+
+        self.assertEqual(
+            str(cm.exception),
+            ' '.join(['error'] * 11) + '\n' + ' '.join(['error'] * 9))
+
+    @mock.patch('snapcraft.main.docopt')
+    def test_command_error_on_several_lines(self, mock_docopt):
+        mock_docopt.return_value = {
+            'COMMAND': 'help',
+            '--debug': False,
+            '--no-parallel-build': False,
+            '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': True,
+            'ARGS': [],
+        }
+
+        with mock.patch('snapcraft.commands.help.main') as mock_cmd:
+            mock_cmd.side_effect = snapcraft.common.MissingArtifactsError(
+                ['foo', 'bar'])
+
+            with self.assertRaises(SystemExit) as cm:
+                snapcraft.main.main()
+
+        self.assertEqual(
+            str(cm.exception),
+            'The following are not available offline:\n'
+            '  - foo\n'
+            '  - bar')
+
     @mock.patch('snapcraft.log.configure')
     @mock.patch('snapcraft.main.docopt')
     def test_command_error_debug(self, mock_docopt, mock_log_configure):
@@ -104,6 +158,8 @@ class TestMain(TestCase):
             '--debug': True,
             '--no-parallel-build': False,
             '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': False,
             'ARGS': [],
         }
 
@@ -127,6 +183,8 @@ class TestMain(TestCase):
             '--debug': False,
             '--no-parallel-build': False,
             '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': False,
             'ARGS': [],
         }
 
@@ -144,6 +202,8 @@ class TestMain(TestCase):
             '--debug': False,
             '--no-parallel-build': True,
             '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': False,
             'ARGS': [],
         }
 
@@ -154,6 +214,44 @@ class TestMain(TestCase):
 
         self.assertFalse(snapcraft.common.get_enable_parallel_builds())
 
+    @mock.patch('snapcraft.main.docopt')
+    def test_command_refresh_indexes(self, mock_docopt):
+        mock_docopt.return_value = {
+            'COMMAND': 'help',
+            '--debug': False,
+            '--no-parallel-build': False,
+            '--target-arch': None,
+            '--refresh-indexes': True,
+            '--offline': False,
+            'ARGS': [],
+        }
+
+        self.assertFalse(snapcraft.common.get_refresh_indexes())
+
+        with mock.patch('snapcraft.commands.help.main'):
+            snapcraft.main.main()
+
+        self.assertTrue(snapcraft.common.get_refresh_indexes())
+
+    @mock.patch('snapcraft.main.docopt')
+    def test_command_offline(self, mock_docopt):
+        mock_docopt.return_value = {
+            'COMMAND': 'help',
+            '--debug': False,
+            '--no-parallel-build': False,
+            '--target-arch': None,
+            '--refresh-indexes': False,
+            '--offline': True,
+            'ARGS': [],
+        }
+
+        self.assertFalse(snapcraft.common.get_offline())
+
+        with mock.patch('snapcraft.commands.help.main'):
+            snapcraft.main.main()
+
+        self.assertTrue(snapcraft.common.get_offline())
+
     @mock.patch('pkg_resources.require')
     @mock.patch('sys.stdout', new_callable=io.StringIO)
     def test_devel_version(self, mock_stdout, mock_resources):
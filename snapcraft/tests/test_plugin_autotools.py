@@ -31,6 +31,7 @@ class AutotoolsPluginTestCase(tests.TestCase):
         class Options:
             configflags = []
             install_via = 'destdir'
+            out_of_tree = False
 
         self.options = Options()
 
@@ -175,7 +176,8 @@ class AutotoolsPluginTestCase(tests.TestCase):
 
         self.assertEqual(4, run_mock.call_count)
         run_mock.assert_has_calls([
-            mock.call(['env', 'NOCONFIGURE=1', './autogen.sh']),
+            mock.call(['env', 'NOCONFIGURE=1', './autogen.sh'],
+                      cwd=plugin.builddir),
             mock.call(['./configure', '--prefix=']),
             mock.call(['make', '-j2']),
             mock.call(['make', 'install',
@@ -191,7 +193,8 @@ class AutotoolsPluginTestCase(tests.TestCase):
 
         self.assertEqual(4, run_mock.call_count)
         run_mock.assert_has_calls([
-            mock.call(['env', 'NOCONFIGURE=1', './autogen.sh']),
+            mock.call(['env', 'NOCONFIGURE=1', './autogen.sh'],
+                      cwd=plugin.builddir),
             mock.call(['./configure', '--prefix={}'.format(
                 plugin.installdir)]),
             mock.call(['make', '-j2']),
@@ -216,7 +219,7 @@ class AutotoolsPluginTestCase(tests.TestCase):
 
         self.assertEqual(4, run_mock.call_count)
         run_mock.assert_has_calls([
-            mock.call(['autoreconf', '-i']),
+            mock.call(['autoreconf', '-i'], cwd=plugin.builddir),
             mock.call(['./configure', '--prefix=']),
             mock.call(['make', '-j2']),
             mock.call(['make', 'install',
@@ -232,13 +235,49 @@ class AutotoolsPluginTestCase(tests.TestCase):
 
         self.assertEqual(4, run_mock.call_count)
         run_mock.assert_has_calls([
-            mock.call(['autoreconf', '-i']),
+            mock.call(['autoreconf', '-i'], cwd=plugin.builddir),
             mock.call(['./configure', '--prefix={}'.format(
                 plugin.installdir)]),
             mock.call(['make', '-j2']),
             mock.call(['make', 'install'])
         ])
 
+    @mock.patch.object(autotools.AutotoolsPlugin, 'run')
+    def test_build_out_of_tree(self, run_mock):
+        self.options.out_of_tree = True
+        plugin = autotools.AutotoolsPlugin('test-part', self.options)
+        os.makedirs(plugin.sourcedir)
+        open(os.path.join(plugin.sourcedir, 'configure'), 'w').close()
+
+        plugin.build()
+
+        self.assertEqual(3, run_mock.call_count)
+        run_mock.assert_has_calls([
+            mock.call([os.path.join(plugin.sourcedir, 'configure'),
+                       '--prefix=']),
+            mock.call(['make', '-j2']),
+            mock.call(['make', 'install',
+                       'DESTDIR={}'.format(plugin.installdir)])
+        ])
+        self.assertEqual([], os.listdir(plugin.builddir),
+                         'Expected the source not to be copied')
+
+    @mock.patch.object(autotools.AutotoolsPlugin, 'run')
+    def test_build_out_of_tree_bootstraps_a_copy_of_the_source(self,
+                                                               run_mock):
+        self.options.out_of_tree = True
+        plugin = autotools.AutotoolsPlugin('test-part', self.options)
+        os.makedirs(plugin.sourcedir)
+        open(os.path.join(plugin.sourcedir, 'configure.ac'), 'w').close()
+
+        plugin.build()
+
+        run_mock.assert_has_calls([
+            mock.call(['autoreconf', '-i'], cwd=plugin.builddir),
+            mock.call(['./configure', '--prefix=']),
+        ])
+        self.assertEqual(['configure.ac'], os.listdir(plugin.builddir))
+
     @mock.patch('sys.stdout')
     def test_build_nonexecutable_autogen(self, stdout_mock):
         plugin = autotools.AutotoolsPlugin('test-part', self.options)
@@ -252,10 +291,10 @@ class AutotoolsPluginTestCase(tests.TestCase):
         run_mock = patcher.start()
 
         # We want to mock out every run() call except the one to autogen
-        def _run(cmd):
+        def _run(cmd, **kwargs):
             if './autogen.sh' in cmd:
                 patcher.stop()
-                output = plugin.run(cmd)
+                output = plugin.run(cmd, **kwargs)
                 patcher.start()
                 return output
 
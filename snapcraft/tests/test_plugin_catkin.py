@@ -17,7 +17,6 @@
 import os
 import os.path
 import subprocess
-import builtins
 
 from unittest import mock
 
@@ -633,19 +632,15 @@ class CatkinPluginTestCase(tests.TestCase):
         plugin = catkin.CatkinPlugin('test-part', self.properties)
         os.makedirs(plugin.rosdir)
 
-        # Place a file to be discovered by _finish_build().
-        open(os.path.join(plugin.rosdir, 'foo'), 'w').close()
-
-        file_mock = mock.mock_open()
-        with mock.patch.object(builtins, 'open', file_mock):
-            # Reading a binary file may throw a UnicodeDecodeError. Make sure
-            # that's handled.
-            file_mock.return_value.read.side_effect = UnicodeDecodeError(
-                'foo', b'bar', 1, 2, 'baz')
-            try:
-                plugin._finish_build()
-            except UnicodeDecodeError:
-                self.fail('Expected _finish_build to handle binary files')
+        # Place a file to be discovered by _finish_build(). Reading a binary
+        # file may throw a UnicodeDecodeError. Make sure that's handled.
+        with open(os.path.join(plugin.rosdir, 'foo'), 'wb') as f:
+            f.write(b'#!/foo/bar/python\xe9')
+
+        try:
+            plugin._finish_build()
+        except UnicodeDecodeError:
+            self.fail('Expected _finish_build to handle binary files')
 
     @mock.patch.object(catkin.CatkinPlugin, 'run')
     @mock.patch.object(catkin.CatkinPlugin, 'run_output', return_value='foo')
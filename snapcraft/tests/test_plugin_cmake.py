@@ -47,6 +47,7 @@ class CMakeTestCase(tests.TestCase):
     def test_build_referencing_sourcedir_if_no_subdir(self):
         class Options:
             configflags = []
+            out_of_tree = False
 
         plugin = cmake.CMakePlugin('test-part', Options())
         os.makedirs(plugin.builddir)
@@ -65,6 +66,7 @@ class CMakeTestCase(tests.TestCase):
     def test_build_referencing_sourcedir_with_subdir(self):
         class Options:
             configflags = []
+            out_of_tree = False
             source_subdir = 'subdir'
 
         plugin = cmake.CMakePlugin('test-part', Options())
@@ -83,9 +85,26 @@ class CMakeTestCase(tests.TestCase):
                        'DESTDIR={}'.format(plugin.installdir)],
                       cwd=plugin.builddir, env=mock.ANY)])
 
+    def test_build_out_of_tree_keeps_builddir(self):
+        class Options:
+            configflags = []
+            out_of_tree = True
+
+        plugin = cmake.CMakePlugin('test-part', Options())
+        os.makedirs(plugin.builddir)
+        open(os.path.join(plugin.builddir, 'CMakeCache.txt'), 'w').close()
+        plugin.build()
+
+        self.assertTrue(
+            os.path.exists(os.path.join(plugin.builddir, 'CMakeCache.txt')))
+        self.run_mock.assert_has_calls([
+            mock.call(['cmake', plugin.sourcedir, '-DCMAKE_INSTALL_PREFIX='],
+                      cwd=plugin.builddir, env=mock.ANY)])
+
     def test_build_environment(self):
         class Options:
             configflags = []
+            out_of_tree = False
 
         plugin = cmake.CMakePlugin('test-part', Options())
         os.makedirs(plugin.builddir)
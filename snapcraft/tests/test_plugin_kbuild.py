@@ -20,6 +20,7 @@ from unittest import mock
 
 import fixtures
 
+from snapcraft import common
 from snapcraft import tests
 from snapcraft.plugins import kbuild
 
@@ -34,6 +35,7 @@ class KBuildPluginTestCase(tests.TestCase):
             kconfigfile = None
             kdefconfig = []
             kconfigs = []
+            out_of_tree = False
 
         self.options = Options()
 
@@ -62,6 +64,26 @@ class KBuildPluginTestCase(tests.TestCase):
         self.assertEqual(properties['kconfigs']['items']['type'], 'string')
         self.assertTrue(properties['kconfigs']['uniqueItems'])
 
+    @mock.patch('subprocess.check_call')
+    @mock.patch.object(kbuild.KBuildPlugin, 'run')
+    def test_build_with_jobserver(self, run_mock, check_call_mock):
+        common.set_jobserver(mock.Mock(
+            make_args=['--jobserver-fds=3,4'], fds=(3, 4)))
+        self.options.kconfigfile = 'config'
+        with open(self.options.kconfigfile, 'w') as f:
+            f.write('ACCEPT=y\n')
+
+        plugin = kbuild.KBuildPlugin('test-part', self.options)
+
+        os.makedirs(plugin.sourcedir)
+
+        plugin.build()
+
+        # The shell does not get the jobserver pipe, oldconfig is serial.
+        check_call_mock.assert_called_once_with(
+            'yes "" | make oldconfig', shell=True, cwd=plugin.builddir)
+        run_mock.assert_any_call(['make', '--jobserver-fds=3,4'])
+
     @mock.patch('subprocess.check_call')
     @mock.patch.object(kbuild.KBuildPlugin, 'run')
     def test_build_with_kconfigfile(self, run_mock, check_call_mock):
@@ -79,7 +101,7 @@ class KBuildPluginTestCase(tests.TestCase):
 
         self.assertEqual(1, check_call_mock.call_count)
         check_call_mock.assert_has_calls([
-            mock.call('yes "" | make -j2 oldconfig', shell=True,
+            mock.call('yes "" | make oldconfig', shell=True,
                       cwd=plugin.builddir),
         ])
 
@@ -119,7 +141,7 @@ class KBuildPluginTestCase(tests.TestCase):
 
         self.assertEqual(1, check_call_mock.call_count)
         check_call_mock.assert_has_calls([
-            mock.call('yes "" | make -j2 V=1 oldconfig', shell=True,
+            mock.call('yes "" | make V=1 oldconfig', shell=True,
                       cwd=plugin.builddir),
         ])
 
@@ -162,7 +184,7 @@ class KBuildPluginTestCase(tests.TestCase):
 
         self.assertEqual(1, check_call_mock.call_count)
         check_call_mock.assert_has_calls([
-            mock.call('yes "" | make -j2 oldconfig', shell=True,
+            mock.call('yes "" | make oldconfig', shell=True,
                       cwd=plugin.builddir),
         ])
 
@@ -220,7 +242,7 @@ ACCEPT=n
 
         self.assertEqual(1, check_call_mock.call_count)
         check_call_mock.assert_has_calls([
-            mock.call('yes "" | make -j2 oldconfig', shell=True,
+            mock.call('yes "" | make oldconfig', shell=True,
                       cwd=plugin.builddir),
         ])
 
@@ -246,3 +268,38 @@ SOMETHING=y
 ACCEPT=n
 """
         self.assertEqual(config_contents, expected_config)
+
+    @mock.patch('subprocess.check_call')
+    @mock.patch.object(kbuild.KBuildPlugin, 'run')
+    def test_build_out_of_tree(self, run_mock, check_call_mock):
+        self.options.out_of_tree = True
+        self.options.kconfigfile = 'config'
+        with open(self.options.kconfigfile, 'w') as f:
+            f.write('ACCEPT=y\n')
+
+        plugin = kbuild.KBuildPlugin('test-part', self.options)
+
+        os.makedirs(plugin.sourcedir)
+        open(os.path.join(plugin.sourcedir, 'Makefile'), 'w').close()
+
+        plugin.build()
+
+        make_cmd = ['make', '-j2', '-C', plugin.sourcedir,
+                    'O={}'.format(plugin.builddir)]
+        check_call_mock.assert_has_calls([
+            mock.call('yes "" | {} oldconfig'.format(
+                ' '.join(make_cmd[:1] + make_cmd[2:])),
+                      shell=True, cwd=plugin.builddir),
+        ])
+        run_mock.assert_has_calls([
+            mock.call(make_cmd),
+            mock.call(make_cmd +
+                      ['CONFIG_PREFIX={}'.format(plugin.installdir),
+                       'install'])
+        ])
+
+        self.assertFalse(
+            os.path.exists(os.path.join(plugin.builddir, 'Makefile')),
+            'Expected the source not to be copied')
+        self.assertTrue(
+            os.path.exists(os.path.join(plugin.builddir, '.config')))
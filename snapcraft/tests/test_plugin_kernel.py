@@ -22,7 +22,10 @@ from unittest import mock
 
 import fixtures
 
-from snapcraft import tests
+from snapcraft import (
+    common,
+    tests,
+)
 from snapcraft.common import get_machine_info
 from snapcraft.plugins import kernel
 
@@ -37,6 +40,7 @@ class KernelPluginTestCase(tests.TestCase):
             kconfigfile = None
             kdefconfig = []
             kconfigs = []
+            out_of_tree = False
             kernel_image_target = 'bzImage'
             kernel_with_firmware = True
             kernel_initrd_modules = []
@@ -116,7 +120,7 @@ class KernelPluginTestCase(tests.TestCase):
     def _assert_generic_check_call(self, builddir, installdir, os_snap_path):
         self.assertEqual(4, self.check_call_mock.call_count)
         self.check_call_mock.assert_has_calls([
-            mock.call('yes "" | make -j2 oldconfig', shell=True,
+            mock.call('yes "" | make oldconfig', shell=True,
                       cwd=builddir),
             mock.call(['unsquashfs', os_snap_path,
                        'usr/lib/ubuntu-core-generic-initrd'],
@@ -244,7 +248,7 @@ class KernelPluginTestCase(tests.TestCase):
 
         self.assertEqual(4, self.check_call_mock.call_count)
         self.check_call_mock.assert_has_calls([
-            mock.call('yes "" | make -j2 V=1 oldconfig', shell=True,
+            mock.call('yes "" | make V=1 oldconfig', shell=True,
                       cwd=plugin.builddir),
             mock.call(['unsquashfs', plugin.os_snap,
                        'usr/lib/ubuntu-core-generic-initrd'],
@@ -667,10 +671,87 @@ ACCEPT=n
     def test_pull(self, download_mock, config_mock):
         config = {'config_key': 'config_value'}
         config_mock.return_value = config
+        download_mock.side_effect = lambda name, path, *args: open(
+            path, 'w').close()
 
         plugin = kernel.KernelPlugin('test-part', self.options)
         plugin.pull()
 
         download_mock.assert_called_once_with(
-            'ubuntu-core/edge', plugin.os_snap, config,
+            'ubuntu-core/edge', mock.ANY, config,
             plugin._target_arch['deb'])
+        self.assertTrue(os.path.exists(plugin._cached_os_snap))
+        self.assertTrue(os.path.exists(plugin.os_snap))
+
+    @mock.patch.object(kernel, 'load_config')
+    @mock.patch('snapcraft.storeapi.download')
+    def test_prefetch_downloads_to_the_cache(self, download_mock,
+                                             config_mock):
+        download_mock.side_effect = lambda name, path, *args: open(
+            path, 'w').close()
+
+        plugin = kernel.KernelPlugin('test-part', self.options)
+        plugin.prefetch()
+
+        download_mock.assert_called_once_with(
+            'ubuntu-core/edge', plugin._cached_os_snap,
+            config_mock.return_value, plugin._target_arch['deb'])
+        self.assertTrue(os.path.exists(plugin._cached_os_snap))
+        self.assertFalse(os.path.exists(plugin.os_snap))
+
+    @mock.patch.object(kernel, 'load_config')
+    @mock.patch('snapcraft.storeapi.download')
+    def test_download_checks_the_cached_os_snap_in_place(self, download_mock,
+                                                         config_mock):
+        def download(name, path, *args):
+            # The previous snap is there to be checked against the store,
+            # which replaces it with a newer one.
+            with open(path) as f:
+                self.assertEqual(f.read(), 'old')
+            with open(path + '.partial', 'w') as f:
+                f.write('new')
+            os.replace(path + '.partial', path)
+        download_mock.side_effect = download
+
+        plugin = kernel.KernelPlugin('test-part', self.options)
+        os.makedirs(os.path.dirname(plugin._cached_os_snap))
+        with open(plugin._cached_os_snap, 'w') as f:
+            f.write('old')
+        os.makedirs(os.path.dirname(plugin.os_snap))
+        os.link(plugin._cached_os_snap, plugin.os_snap)
+
+        plugin.prefetch()
+
+        with open(plugin._cached_os_snap) as f:
+            self.assertEqual(f.read(), 'new')
+        with open(plugin.os_snap) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(
+            os.listdir(os.path.dirname(plugin._cached_os_snap)),
+            [os.path.basename(plugin._cached_os_snap)])
+
+    @mock.patch('snapcraft.storeapi.download')
+    def test_pull_offline_uses_the_cache(self, download_mock):
+        common.set_offline(True)
+        plugin = kernel.KernelPlugin('test-part', self.options)
+        os.makedirs(os.path.dirname(plugin._cached_os_snap))
+        open(plugin._cached_os_snap, 'w').close()
+
+        plugin.pull()
+
+        self.assertFalse(download_mock.called)
+        self.assertTrue(os.path.exists(plugin.os_snap))
+
+    @mock.patch('snapcraft.storeapi.download')
+    def test_pull_offline(self, download_mock):
+        common.set_offline(True)
+        plugin = kernel.KernelPlugin('test-part', self.options)
+
+        with self.assertRaises(common.MissingArtifactsError):
+            plugin.pull()
+
+        os.makedirs(os.path.dirname(plugin.os_snap), exist_ok=True)
+        open(plugin.os_snap, 'w').close()
+        plugin.pull()
+
+        self.assertFalse(download_mock.called)
@@ -126,6 +126,7 @@ class NodePluginTestCase(tests.TestCase):
                                    'uniqueItems': True},
                  'source': {'type': 'string'},
                  'source-branch': {'default': '', 'type': 'string'},
+                 'source-checksum': {'default': None, 'type': 'string'},
                  'source-subdir': {'default': None, 'type': 'string'},
                  'source-tag': {'default': '', 'type:': 'string'},
                  'source-type': {'default': '', 'type': 'string'}},
@@ -18,6 +18,7 @@ import logging
 import os
 import shutil
 import tempfile
+import threading
 from unittest.mock import (
     call,
     Mock,
@@ -320,6 +321,8 @@ class StateTestCase(tests.TestCase):
 
     @patch('snapcraft.repo.Ubuntu')
     def test_pull_state(self, ubuntu_mock):
+        ubuntu_mock.return_value.get.return_value = {}
+        ubuntu_mock.return_value.unpack.return_value = {}
         self.assertEqual(None, self.handler.last_step())
 
         self.handler.code.stage_packages.append('foo')
@@ -342,6 +345,144 @@ class StateTestCase(tests.TestCase):
         self.assertEqual(1, len(state.stage_package_directories))
         self.assertTrue('bin' in state.stage_package_directories)
 
+    @patch('snapcraft.repo.Ubuntu')
+    def test_pull_writes_the_lock(self, ubuntu_mock):
+        ubuntu_mock.return_value.get.return_value = {'packages': ['foo']}
+        ubuntu_mock.return_value.unpack.return_value = {}
+        self.handler.code.stage_packages.append('foo')
+
+        self.handler.pull()
+
+        with open('snapcraft.lock') as f:
+            self.assertEqual(
+                {'test_part': {'packages': ['foo']}}, yaml.load(f))
+
+    @patch('snapcraft.repo.Ubuntu')
+    def test_lock_is_kept_in_the_project_dir(self, ubuntu_mock):
+        ubuntu_mock.return_value.get.return_value = {'packages': ['foo']}
+        ubuntu_mock.return_value.unpack.return_value = {}
+        self.handler.code.stage_packages.append('foo')
+        projectdir = os.getcwd()
+        self.addCleanup(os.chdir, projectdir)
+        os.mkdir('subdir')
+        os.chdir('subdir')
+
+        self.handler.pull()
+
+        self.assertFalse(os.path.exists('snapcraft.lock'))
+        with open(os.path.join(projectdir, 'snapcraft.lock')) as f:
+            self.assertEqual(
+                {'test_part': {'packages': ['foo']}}, yaml.load(f))
+
+    @patch('snapcraft.repo.Ubuntu')
+    def test_pull_uses_the_lock(self, ubuntu_mock):
+        lock = {'packages': ['foo']}
+        ubuntu_mock.return_value.get.return_value = lock
+        ubuntu_mock.return_value.unpack.return_value = {}
+        with open('snapcraft.lock', 'w') as f:
+            yaml.dump({'test_part': lock, 'other': {}}, f)
+        self.handler.code.stage_packages.append('foo')
+
+        self.handler.pull()
+
+        ubuntu_mock.return_value.get.assert_called_once_with(
+            ['foo'], lock=lock)
+        with open('snapcraft.lock') as f:
+            self.assertEqual(
+                {'test_part': lock, 'other': {}}, yaml.load(f))
+
+    @patch.object(nil.NilPlugin, 'pull')
+    @patch('snapcraft.repo.Ubuntu')
+    def test_pull_applies_stage_packages_changes(self, ubuntu_mock,
+                                                 mock_pull):
+        ubuntu_mock.return_value.get.return_value = {}
+        ubuntu_mock.return_value.unpack.return_value = {'foo.deb': ['foo']}
+        self.handler.code.stage_packages.append('foo')
+        self.handler.pull()
+        self.handler.mark_done('build')
+
+        self.handler.code.stage_packages.append('bar')
+        self.handler.pull()
+
+        ubuntu_mock.return_value.unpack.assert_called_with(
+            self.handler.installdir, {'foo.deb': ['foo']})
+        # The plugin does not pull its sources again.
+        mock_pull.assert_called_once_with()
+        self.assertEqual('pull', self.handler.last_step())
+        self.assertEqual(['foo', 'bar'],
+                         self.handler.get_state('pull').stage_packages)
+
+    @patch('snapcraft.repo.Ubuntu')
+    def test_pull_skipped_without_stage_packages_changes(self, ubuntu_mock):
+        ubuntu_mock.return_value.get.return_value = {}
+        ubuntu_mock.return_value.unpack.return_value = {}
+        self.handler.code.stage_packages.append('foo')
+        self.handler.pull()
+
+        self.handler.pull()
+
+        self.assertEqual(1, ubuntu_mock.return_value.unpack.call_count)
+
+    @patch.object(nil.NilPlugin, 'pull')
+    @patch.object(nil.NilPlugin, 'prefetch')
+    @patch('snapcraft.repo.Ubuntu')
+    def test_pull_fetches_the_source_with_the_stage_packages(
+            self, ubuntu_mock, mock_prefetch, mock_pull):
+        calls = []
+        fetching = threading.Event()
+
+        def prefetch():
+            calls.append('prefetch')
+            fetching.set()
+
+        def get(*args, **kwargs):
+            # Only returns once the source is being fetched concurrently.
+            self.assertTrue(fetching.wait(timeout=10))
+            calls.append('get')
+            return {}
+
+        mock_prefetch.side_effect = prefetch
+        mock_pull.side_effect = lambda: calls.append('pull')
+        ubuntu_mock.return_value.get.side_effect = get
+        ubuntu_mock.return_value.unpack.side_effect = \
+            lambda *args: calls.append('unpack') or {}
+        self.handler.code.stage_packages.append('foo')
+
+        self.handler.pull()
+
+        self.assertEqual(['prefetch', 'get', 'unpack', 'pull'], calls)
+        self.assertEqual('pull', self.handler.last_step())
+
+    @patch.object(nil.NilPlugin, 'prefetch')
+    @patch('snapcraft.repo.Ubuntu')
+    def test_pull_offline_does_not_prefetch(self, ubuntu_mock,
+                                            mock_prefetch):
+        ubuntu_mock.return_value.get.return_value = {}
+        ubuntu_mock.return_value.unpack.return_value = {}
+        common.set_offline(True)
+        self.handler.code.stage_packages.append('foo')
+
+        self.handler.pull()
+
+        self.assertFalse(mock_prefetch.called)
+        self.assertEqual('pull', self.handler.last_step())
+
+    @patch.object(nil.NilPlugin, 'prefetch')
+    @patch('snapcraft.repo.Ubuntu')
+    def test_prefetch_does_not_pull(self, ubuntu_mock, mock_prefetch):
+        lock = {'packages': ['foo']}
+        with open('snapcraft.lock', 'w') as f:
+            yaml.dump({'test_part': lock}, f)
+        self.handler.code.stage_packages.append('foo')
+
+        self.handler.prefetch()
+
+        ubuntu_mock.return_value.get.assert_called_once_with(
+            ['foo'], lock=lock)
+        self.assertFalse(ubuntu_mock.return_value.unpack.called)
+        mock_prefetch.assert_called_once_with()
+        self.assertEqual(None, self.handler.last_step())
+
     @patch.object(nil.NilPlugin, 'clean_pull')
     def test_clean_pull_state(self, mock_clean_pull):
         self.assertEqual(None, self.handler.last_step())
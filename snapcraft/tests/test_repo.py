@@ -15,12 +15,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import fixtures
+import hashlib
+import io
 import logging
 import os
 import stat
+import subprocess
 import tempfile
+import time
 import unittest.mock
+import urllib.error
+import urllib.parse
+import urllib.request
 
+from snapcraft import common
 from snapcraft import repo
 from snapcraft import tests
 
@@ -35,9 +43,9 @@ class UbuntuTestCase(tests.TestCase):
         self.addCleanup(tempdirObj.cleanup)
         self.tempdir = tempdirObj.name
 
-    @unittest.mock.patch('snapcraft.repo._get_geoip_country_code_prefix')
-    def test_sources_amd64_vivid(self, mock_cc):
-        mock_cc.return_value = 'ar'
+    @unittest.mock.patch('snapcraft.repo._get_archive_prefix')
+    def test_sources_amd64_vivid(self, mock_prefix):
+        mock_prefix.return_value = 'ar.archive'
 
         sources_list = repo._format_sources_list(
             repo._DEFAULT_SOURCES, 'amd64', 'vivid')
@@ -55,8 +63,8 @@ deb http://security.ubuntu.com/ubuntu vivid-security multiverse
 '''
         self.assertEqual(sources_list, expected_sources_list)
 
-    @unittest.mock.patch('snapcraft.repo._get_geoip_country_code_prefix')
-    def test_sources_armhf_trusty(self, mock_cc):
+    @unittest.mock.patch('snapcraft.repo._get_archive_prefix')
+    def test_sources_armhf_trusty(self, mock_prefix):
         sources_list = repo._format_sources_list(
             repo._DEFAULT_SOURCES, 'armhf', 'trusty')
 
@@ -72,7 +80,7 @@ deb http://ports.ubuntu.com/ubuntu-ports trusty-security universe
 deb http://ports.ubuntu.com/ubuntu-ports trusty-security multiverse
 '''
         self.assertEqual(sources_list, expected_sources_list)
-        self.assertFalse(mock_cc.called)
+        self.assertFalse(mock_prefix.called)
 
     def test_fix_symlinks(self):
         os.makedirs(self.tempdir + '/a')
@@ -84,7 +92,7 @@ deb http://ports.ubuntu.com/ubuntu-ports trusty-security multiverse
         os.symlink('1', self.tempdir + '/rel-to-1')
         os.symlink('/1', self.tempdir + '/abs-to-1')
 
-        repo._fix_symlinks(debdir=self.tempdir)
+        repo._fix_tree(self.tempdir)
 
         self.assertEqual(os.readlink(self.tempdir + '/rel-to-a'), 'a')
         self.assertEqual(os.readlink(self.tempdir + '/abs-to-a'), 'a')
@@ -106,7 +114,7 @@ deb http://ports.ubuntu.com/ubuntu-ports trusty-security multiverse
                 open(file, mode='w').close()
                 os.chmod(file, files[key][0])
 
-                repo._fix_symlinks(debdir=self.tempdir)
+                repo._fix_tree(self.tempdir)
                 self.assertEqual(
                     stat.S_IMODE(os.stat(file).st_mode), files[key][1])
 
@@ -152,14 +160,670 @@ deb http://ports.ubuntu.com/ubuntu-ports trusty-security multiverse
                 with open(f['path'], 'w') as fd:
                     fd.write(f['content'])
 
-                repo._fix_shebangs(rootdir)
+                repo._fix_tree(rootdir)
 
                 with open(f['path'], 'r') as fd:
                     self.assertEqual(fd.read(), f['expected'])
 
+    def test_fix_shebang_only_reads_the_first_line(self):
+        path = os.path.join('root', 'bin', 'a')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'\x7fELF\n#!/usr/bin/python\n\xff')
+
+        repo._fix_tree('root')
+
+        with open(path, 'rb') as f:
+            self.assertEqual(b'\x7fELF\n#!/usr/bin/python\n\xff', f.read())
+
+    def test_fix_config_scripts(self):
+        rootdir = os.path.join(self.path, 'root')
+        for script in ('xml2-config', 'xslt-config'):
+            with self.subTest(key=script):
+                path = os.path.join(rootdir, 'usr', 'bin', script)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write('prefix=/usr\nexec_prefix=${prefix}\n')
+
+                repo._fix_tree(rootdir)
+
+                with open(path) as f:
+                    self.assertEqual(
+                        'prefix={}/usr\nexec_prefix=${{prefix}}\n'.format(
+                            rootdir), f.read())
+
+    def test_fix_config_scripts_not_final(self):
+        path = os.path.join('root', 'usr', 'bin', 'xml2-config')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('prefix=/usr\n')
+
+        repo._fix_tree('root', final=False)
+
+        with open(path) as f:
+            self.assertEqual('prefix=/usr\n', f.read())
+
+
+class UnpackTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        def fake_extract(cmd):
+            # Every fake deb ships a file with its own name, plus a file
+            # shared by all of them with the deb name as content.
+            deb, destdir = cmd[-2:]
+            name = os.path.basename(deb)
+            os.makedirs(os.path.join(destdir, 'usr', 'share'))
+            open(os.path.join(destdir, 'usr', name), 'w').close()
+            with open(os.path.join(destdir, 'usr', 'share', 'common'),
+                      'w') as f:
+                f.write(name)
+
+        patcher = unittest.mock.patch('subprocess.check_call')
+        self.mock_call = patcher.start()
+        self.mock_call.side_effect = fake_extract
+        self.addCleanup(patcher.stop)
+
+    def make_debs(self, *names):
+        for name in names:
+            with open(name, 'w') as f:
+                f.write(name)
+        return list(names)
+
+    def test_extract_debs_merges_in_order(self):
+        debs = self.make_debs('a.deb', 'b.deb', 'c.deb')
+
+        repo._extract_debs(debs, 'root')
+
+        self.assertEqual(3, self.mock_call.call_count)
+        self.assertEqual(
+            ['a.deb', 'b.deb', 'c.deb', 'share'], sorted(os.listdir(
+                os.path.join('root', 'usr'))))
+        with open(os.path.join('root', 'usr', 'share', 'common')) as f:
+            self.assertEqual('c.deb', f.read())
+
+    def test_extract_debs_keeps_existing_files(self):
+        os.makedirs(os.path.join('root', 'usr'))
+        open(os.path.join('root', 'usr', 'existing'), 'w').close()
+
+        repo._extract_debs(self.make_debs('a.deb'), 'root')
+
+        self.assertTrue(os.path.exists(os.path.join('root', 'usr', 'a.deb')))
+        self.assertTrue(
+            os.path.exists(os.path.join('root', 'usr', 'existing')))
+
+    def test_extract_debs_returns_contents(self):
+        contents = repo._extract_debs(self.make_debs('a.deb', 'b.deb'), 'root')
+
+        self.assertEqual(
+            {'a.deb': ['usr', 'usr/share', 'usr/a.deb', 'usr/share/common'],
+             'b.deb': ['usr', 'usr/share', 'usr/b.deb', 'usr/share/common']},
+            contents)
+
+    def test_unpack_applies_the_difference(self):
+        ubuntu = repo.Ubuntu('part')
+        os.makedirs(ubuntu.downloaddir)
+        self.make_debs(os.path.join(ubuntu.downloaddir, 'a.deb'),
+                       os.path.join(ubuntu.downloaddir, 'b.deb'))
+        unpacked = ubuntu.unpack('root')
+        os.makedirs(os.path.join('root', 'usr', 'c'))
+        os.remove(os.path.join(ubuntu.downloaddir, 'a.deb'))
+        self.mock_call.reset_mock()
+
+        contents = ubuntu.unpack('root', unpacked)
+
+        self.assertEqual(['b.deb'], list(contents))
+        self.assertFalse(self.mock_call.called)
+        self.assertEqual(['b.deb', 'c', 'share'],
+                         sorted(os.listdir(os.path.join('root', 'usr'))))
+        self.assertTrue(
+            os.path.exists(os.path.join('root', 'usr', 'share', 'common')))
+
+    def test_extract_debs_reuses_cached_trees(self):
+        debs = self.make_debs('a.deb')
+
+        repo._extract_debs(debs, 'root1')
+        repo._extract_debs(debs, 'root2')
+
+        self.assertEqual(1, self.mock_call.call_count)
+        self.assertEqual(
+            [repo._get_file_checksum('a.deb')],
+            os.listdir(os.path.join(common.get_cachedir(), 'debs')))
+
+    def test_extract_debs_does_not_share_files_with_the_cache(self):
+        debs = self.make_debs('a.deb')
+
+        repo._extract_debs(debs, 'root1')
+        repo._extract_debs(debs, 'root2')
+        # What e.g. the copy plugin or make install does.
+        with open(os.path.join('root1', 'usr', 'a.deb'), 'w') as f:
+            f.write('override')
+
+        with open(os.path.join('root2', 'usr', 'a.deb')) as f:
+            self.assertNotEqual('override', f.read())
+        tree = repo._get_deb_tree('a.deb')
+        with open(os.path.join(tree, 'usr', 'a.deb')) as f:
+            self.assertNotEqual('override', f.read())
+
+    def test_extract_debs_error(self):
+        self.mock_call.side_effect = subprocess.CalledProcessError(1, 'cmd')
+
+        with self.assertRaises(repo.UnpackError) as raised:
+            repo._extract_debs(self.make_debs('a.deb'), 'root')
+
+        self.assertEqual(
+            'Error while provisioning "a.deb"', raised.exception.message)
+        self.assertEqual(
+            [], os.listdir(os.path.join(common.get_cachedir(), 'debs')))
+
+    def test_merge_tree_replaces_symlinks(self):
+        os.makedirs(os.path.join('src', 'lib'))
+        open(os.path.join('src', 'lib', 'file'), 'w').close()
+        os.symlink('lib', os.path.join('src', 'lib64'))
+        os.makedirs(os.path.join('dst', 'lib64'))
+
+        repo._merge_tree('src', 'dst')
+
+        self.assertTrue(os.path.isfile(os.path.join('dst', 'lib', 'file')))
+        self.assertEqual('lib', os.readlink(os.path.join('dst', 'lib64')))
+
+
+class FetchTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fake_logger = fixtures.FakeLogger(level=logging.INFO)
+        self.useFixture(self.fake_logger)
+        self.contents = {}
+
+        def fake_open(opener, request, timeout):
+            if request.full_url not in self.contents:
+                raise urllib.error.URLError('not found')
+            return io.BytesIO(self.contents[request.full_url])
+
+        patcher = unittest.mock.patch(
+            'urllib.request.OpenerDirector.open', autospec=True)
+        self.mock_urlopen = patcher.start()
+        self.mock_urlopen.side_effect = fake_open
+        self.addCleanup(patcher.stop)
+
+        self.apt_config = {}
+        patcher = unittest.mock.patch('snapcraft.repo.apt.apt_pkg.config')
+        mock_config = patcher.start()
+        mock_config.find.side_effect = self.apt_config.get
+        mock_config.find_file.side_effect = self.apt_config.get
+        mock_config.find_dir.side_effect = self.apt_config.get
+        self.addCleanup(patcher.stop)
+
+    def get_requests(self):
+        return [c[0][1] for c in self.mock_urlopen.call_args_list]
+
+    def get_proxies(self, index=0):
+        opener = self.mock_urlopen.call_args_list[index][0][0]
+        return [h.proxies for h in opener.handlers
+                if isinstance(h, urllib.request.ProxyHandler)]
+
+    def make_version(self, name, content, uris):
+        return {
+            'name': name,
+            'version': '1',
+            'filename': 'pool/main/{}_1_amd64.deb'.format(name),
+            'sha256': hashlib.sha256(content).hexdigest(),
+            'uris': uris,
+        }
+
+    def test_fetch_debs(self):
+        self.contents['http://a/1.deb'] = b'1'
+        self.contents['http://a/2.deb'] = b'2'
+        versions = [self.make_version('1', b'1', ['http://a/1.deb']),
+                    self.make_version('2', b'2', ['http://a/2.deb'])]
+
+        repo._fetch_debs(versions, 'download')
+
+        self.assertEqual(['1_1_amd64.deb', '2_1_amd64.deb'],
+                         sorted(os.listdir('download')))
+        with open(os.path.join('download', '2_1_amd64.deb'), 'rb') as f:
+            self.assertEqual(b'2', f.read())
+
+    def test_fetch_debs_reuses_the_pool(self):
+        self.contents['http://a/1.deb'] = b'1'
+        versions = [self.make_version('1', b'1', ['http://a/1.deb'])]
+
+        repo._fetch_debs(versions, 'download1')
+        repo._fetch_debs(versions, 'download2')
+
+        self.assertEqual(1, self.mock_urlopen.call_count)
+        self.assertEqual(
+            os.stat(os.path.join('download1', '1_1_amd64.deb')).st_ino,
+            os.stat(os.path.join('download2', '1_1_amd64.deb')).st_ino)
+
+    def test_fetch_debs_spreads_over_mirrors(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SNAPCRAFT_ARCHIVE_MIRRORS', 'http://b/'))
+        versions = []
+        for name in ('1', '2'):
+            version = self.make_version(name, name.encode(), [])
+            version['uris'] = ['http://a/' + version['filename']]
+            for mirror in ('http://a/', 'http://b/'):
+                self.contents[mirror + version['filename']] = name.encode()
+            versions.append(version)
+
+        repo._fetch_debs(versions, 'download')
+
+        self.assertEqual(
+            ['http://a/pool/main/1_1_amd64.deb',
+             'http://b/pool/main/2_1_amd64.deb'],
+            sorted(r.full_url for r in self.get_requests()))
+
+    def test_fetch_debs_fails_over(self):
+        self.contents['http://b/1.deb'] = b'1'
+        self.contents['http://c/1.deb'] = b'corrupted'
+        versions = [self.make_version(
+            '1', b'1', ['http://a/1.deb', 'http://c/1.deb',
+                        'http://b/1.deb'])]
+
+        repo._fetch_debs(versions, 'download')
+
+        with open(os.path.join('download', '1_1_amd64.deb'), 'rb') as f:
+            self.assertEqual(b'1', f.read())
+        self.assertEqual(
+            [repo._get_file_checksum(os.path.join('download',
+                                                  '1_1_amd64.deb'))],
+            os.listdir(os.path.join(common.get_cachedir(), 'archives')))
+
+    def test_fetch_debs_offline(self):
+        self.contents['http://a/1.deb'] = b'1'
+        versions = [self.make_version('1', b'1', ['http://a/1.deb']),
+                    self.make_version('2', b'2', ['http://a/2.deb'])]
+        repo._fetch_debs(versions[:1], 'download')
+        common.set_offline(True)
+
+        with self.assertRaises(common.MissingArtifactsError) as raised:
+            repo._fetch_debs(versions, 'download')
+
+        self.assertEqual(['2_1_amd64.deb'], raised.exception.artifacts)
+        repo._fetch_debs(versions[:1], 'download')
+        self.assertEqual(1, self.mock_urlopen.call_count)
+
+    def test_fetch_debs_error(self):
+        versions = [self.make_version('1', b'1', ['http://a/1.deb'])]
+
+        with self.assertRaises(repo.apt.cache.FetchFailedException):
+            repo._fetch_debs(versions, 'download')
+        self.assertEqual(
+            [], os.listdir(os.path.join(common.get_cachedir(), 'archives')))
+
+    def test_fetch_debs_through_the_apt_proxy(self):
+        self.apt_config['Acquire::http::Proxy'] = 'http://proxy:3128'
+        self.contents['http://a/1.deb'] = b'1'
+
+        repo._fetch_debs(
+            [self.make_version('1', b'1', ['http://a/1.deb'])], 'download')
+
+        self.assertEqual([{'http': 'http://proxy:3128'}], self.get_proxies())
+
+    def test_fetch_debs_through_the_apt_host_proxy(self):
+        self.apt_config['Acquire::http::Proxy'] = 'http://proxy:3128'
+        self.apt_config['Acquire::https::Proxy::a'] = 'DIRECT'
+        self.useFixture(fixtures.EnvironmentVariable(
+            'https_proxy', 'http://proxy:3128'))
+        self.contents['https://a/1.deb'] = b'1'
+
+        repo._fetch_debs(
+            [self.make_version('1', b'1', ['https://a/1.deb'])], 'download')
+
+        # A direct connection ignores the proxy environment variables.
+        self.assertEqual([], self.get_proxies())
+
+    def test_fetch_debs_https_falls_back_to_the_http_proxy(self):
+        self.apt_config['Acquire::http::Proxy'] = 'http://proxy:3128'
+
+        proxy = repo._get_apt_proxy(urllib.parse.urlsplit('https://a/1.deb'))
+
+        self.assertEqual('http://proxy:3128', proxy)
+
+    def test_fetch_debs_without_apt_proxy_uses_the_environment(self):
+        self.assertIsNone(
+            repo._get_apt_proxy(urllib.parse.urlsplit('http://a/1.deb')))
+
+    def test_fetch_debs_with_apt_credentials(self):
+        os.makedirs('auth.conf.d')
+        with open('auth.conf', 'w') as f:
+            f.write('machine b login other password secret\n')
+        with open(os.path.join('auth.conf.d', 'a.conf'), 'w') as f:
+            f.write('machine https://a/private login user password pass\n')
+        self.apt_config['Dir::Etc::netrc'] = 'auth.conf'
+        self.apt_config['Dir::Etc::netrcparts'] = 'auth.conf.d'
+        self.contents['https://a/private/1.deb'] = b'1'
+        self.contents['https://a/public/2.deb'] = b'2'
+
+        repo._fetch_debs(
+            [self.make_version('1', b'1', ['https://a/private/1.deb']),
+             self.make_version('2', b'2', ['https://a/public/2.deb'])],
+            'download')
+
+        headers = {r.full_url: r.get_header('Authorization')
+                   for r in self.get_requests()}
+        self.assertEqual({
+            'https://a/private/1.deb': 'Basic dXNlcjpwYXNz',
+            'https://a/public/2.deb': None,
+        }, headers)
+
+
+class AptCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(repo._apt_caches.clear)
+
+        patcher = unittest.mock.patch('snapcraft.repo._setup_apt_cache')
+        self.mock_setup = patcher.start()
+        self.mock_setup.side_effect = lambda *args: (
+            unittest.mock.Mock(), unittest.mock.Mock(), 'indexdir')
+        self.addCleanup(patcher.stop)
+
+    def test_cache_is_shared_for_the_same_sources(self):
+        ubuntu1 = repo.Ubuntu('part1', sources='deb http://source1 ./')
+        ubuntu2 = repo.Ubuntu('part2', sources='deb http://source1 ./')
+
+        self.assertIs(ubuntu1.apt_cache, ubuntu2.apt_cache)
+        self.assertEqual(1, self.mock_setup.call_count)
+
+    def test_cache_is_not_shared_for_different_sources(self):
+        ubuntu1 = repo.Ubuntu('part1', sources='deb http://source1 ./')
+        ubuntu2 = repo.Ubuntu('part2', sources='deb http://source2 ./')
+
+        self.assertIsNot(ubuntu1.apt_cache, ubuntu2.apt_cache)
+        self.assertEqual(2, self.mock_setup.call_count)
+
+    def test_cache_is_only_set_up_when_used(self):
+        repo.Ubuntu('part1', sources='deb http://source1 ./')
+
+        self.assertFalse(self.mock_setup.called)
+
+
+class LockTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = unittest.mock.patch('snapcraft.repo._fetch_debs')
+        self.mock_fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = unittest.mock.patch.object(repo.Ubuntu, '_get')
+        self.mock_get = patcher.start()
+        self.mock_get.return_value = [{'name': 'foo'}]
+        self.addCleanup(patcher.stop)
+
+        patcher = unittest.mock.patch('snapcraft.repo._get_series')
+        self.mock_series = patcher.start()
+        self.mock_series.return_value = 'xenial'
+        self.addCleanup(patcher.stop)
+
+        self.ubuntu = repo.Ubuntu('part', sources='deb http://source1 ./')
+
+    def test_get_returns_a_lock(self):
+        lock = self.ubuntu.get(['foo', 'bar'])
+
+        self.assertEqual(['bar', 'foo'], lock['stage-packages'])
+        self.assertEqual(common.get_arch(), lock['arch'])
+        self.assertEqual([{'name': 'foo'}], lock['packages'])
+
+    def test_valid_lock_skips_resolution(self):
+        lock = self.ubuntu.get(['foo'])
+        self.mock_get.reset_mock()
+
+        self.assertIs(lock, self.ubuntu.get(['foo'], lock=lock))
+        self.assertFalse(self.mock_get.called)
+        self.mock_fetch.assert_called_with(
+            [{'name': 'foo'}], self.ubuntu.downloaddir)
+        self.assertIsNone(self.ubuntu._apt_cache)
+
+    def test_missing_locked_packages_are_reported(self):
+        self.mock_get.return_value = [
+            {'name': 'foo', 'version': '1.0', 'filename': 'foo_1.0.deb',
+             'sha256': 'foo-sha'},
+            {'name': 'bar', 'version': '2.0', 'filename': 'bar_2.0.deb',
+             'sha256': 'bar-sha'}]
+        lock = self.ubuntu.get(['foo', 'bar'])
+        # Only foo made it into the download cache.
+        pooldir = os.path.join(common.get_cachedir(), 'archives')
+        os.makedirs(pooldir)
+        open(os.path.join(pooldir, 'foo-sha'), 'w').close()
+        self.mock_fetch.side_effect = repo.apt.cache.FetchFailedException()
+
+        with self.assertRaises(repo.LockedPackagesNotFoundError) as raised:
+            self.ubuntu.get(['foo', 'bar'], lock=lock)
+
+        self.assertEqual(
+            'The following locked stage packages could not be fetched:\n'
+            '  - bar 2.0\n'
+            'They may no longer be in the archive, remove the part from '
+            'snapcraft.lock to resolve its stage-packages again.',
+            str(raised.exception))
+
+    def test_lock_for_other_packages_is_ignored(self):
+        lock = self.ubuntu.get(['foo'])
+        self.mock_get.reset_mock()
+
+        new_lock = self.ubuntu.get(['foo', 'bar'], lock=lock)
+
+        self.assertEqual(['bar', 'foo'], new_lock['stage-packages'])
+        self.mock_get.assert_called_once_with(['foo', 'bar'])
+
+    def test_lock_for_other_sources_is_ignored(self):
+        lock = self.ubuntu.get(['foo'])
+        self.mock_get.reset_mock()
+        ubuntu = repo.Ubuntu('part', sources='deb http://source2 ./')
+
+        ubuntu.get(['foo'], lock=lock)
+
+        self.mock_get.assert_called_once_with(['foo'])
+
+    def test_lock_for_other_release_is_ignored(self):
+        lock = self.ubuntu.get(['foo'])
+        self.mock_get.reset_mock()
+        self.mock_series.return_value = 'yakkety'
+
+        new_lock = self.ubuntu.get(['foo'], lock=lock)
+
+        self.assertEqual('yakkety', new_lock['release'])
+        self.mock_get.assert_called_once_with(['foo'])
+
+
+class IndexCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.indexdir = os.path.join(self.path, 'index')
+        os.makedirs(self.indexdir)
+        self.addCleanup(repo._updated_indexes.clear)
+
+    def test_index_without_stamp_is_stale(self):
+        self.assertTrue(repo._index_is_stale(self.indexdir))
+
+    def test_recent_index_is_not_stale(self):
+        open(os.path.join(self.indexdir, repo._INDEX_STAMP), 'w').close()
+
+        self.assertFalse(repo._index_is_stale(self.indexdir))
+
+    def test_old_index_is_stale(self):
+        stamp = os.path.join(self.indexdir, repo._INDEX_STAMP)
+        open(stamp, 'w').close()
+        old = time.time() - repo._DEFAULT_INDEX_MAX_AGE - 60
+        os.utime(stamp, (old, old))
+
+        self.assertTrue(repo._index_is_stale(self.indexdir))
+
+    def test_max_age_from_environment(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SNAPCRAFT_INDEX_MAX_AGE', '0'))
+        stamp = os.path.join(self.indexdir, repo._INDEX_STAMP)
+        open(stamp, 'w').close()
+        os.utime(stamp, (time.time() - 1, time.time() - 1))
+
+        self.assertTrue(repo._index_is_stale(self.indexdir))
+
+    def test_invalid_max_age_from_environment(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SNAPCRAFT_INDEX_MAX_AGE', '1d'))
+        open(os.path.join(self.indexdir, repo._INDEX_STAMP), 'w').close()
+
+        with self.assertRaises(EnvironmentError) as raised:
+            repo._index_is_stale(self.indexdir)
+
+        self.assertEqual(
+            "SNAPCRAFT_INDEX_MAX_AGE must be a number of seconds, not '1d'",
+            str(raised.exception))
+
+    def test_offline_uses_any_index(self):
+        stamp = os.path.join(self.indexdir, repo._INDEX_STAMP)
+        common.set_offline(True)
+        self.assertTrue(repo._index_is_stale(self.indexdir))
+
+        open(stamp, 'w').close()
+        os.utime(stamp, (0, 0))
+        common.set_refresh_indexes(True)
+
+        self.assertFalse(repo._index_is_stale(self.indexdir))
+
+    def test_refresh_indexes_forces_stale(self):
+        open(os.path.join(self.indexdir, repo._INDEX_STAMP), 'w').close()
+        common.set_refresh_indexes(True)
+
+        self.assertTrue(repo._index_is_stale(self.indexdir))
+
+    def test_refresh_only_once_per_run(self):
+        apt_cache = unittest.mock.Mock()
+
+        self.assertTrue(repo._refresh_apt_cache(
+            apt_cache, unittest.mock.Mock(), self.indexdir))
+        self.assertFalse(repo._refresh_apt_cache(
+            apt_cache, unittest.mock.Mock(), self.indexdir))
+
+        self.assertEqual(1, apt_cache.update.call_count)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.indexdir, repo._INDEX_STAMP)))
+
+
+class MirrorTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(repo._failed_mirrors.clear)
+        self.mirror_file = os.path.join(
+            common.get_cachedir(), repo._MIRROR_FILE)
+
+        patcher = unittest.mock.patch(
+            'snapcraft.repo._get_geoip_country_code_prefix')
+        mock_cc = patcher.start()
+        mock_cc.return_value = 'ar'
+        self.addCleanup(patcher.stop)
+
+        patcher = unittest.mock.patch('snapcraft.repo._probe_mirror')
+        self.mock_probe = patcher.start()
+        self.timings = {'ar.archive': 0.5, 'archive': 0.2}
+        self.mock_probe.side_effect = lambda prefix, release: \
+            self.timings[prefix]
+        self.addCleanup(patcher.stop)
+
+    def test_fastest_mirror_is_selected_and_kept(self):
+        self.assertEqual('archive', repo._get_archive_prefix('xenial'))
+        self.assertEqual(2, self.mock_probe.call_count)
+
+        self.timings['ar.archive'] = 0.1
+        self.assertEqual('archive', repo._get_archive_prefix('xenial'))
+        self.assertEqual(2, self.mock_probe.call_count)
+
+    def test_unreachable_mirrors_are_skipped(self):
+        self.timings['archive'] = None
+
+        self.assertEqual('ar.archive', repo._get_archive_prefix('xenial'))
+
+    def test_no_reachable_mirror(self):
+        self.timings = {'ar.archive': None, 'archive': None}
+
+        self.assertEqual('archive', repo._get_archive_prefix('xenial'))
+        self.assertFalse(os.path.exists(self.mirror_file))
+
+    def test_expired_mirror_is_selected_again(self):
+        repo._get_archive_prefix('xenial')
+        past = time.time() - repo._DEFAULT_MIRROR_MAX_AGE - 1
+        os.utime(self.mirror_file, (past, past))
+        self.timings['ar.archive'] = 0.1
+
+        self.assertEqual('ar.archive', repo._get_archive_prefix('xenial'))
+
+    def test_invalid_max_age_from_environment(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SNAPCRAFT_MIRROR_MAX_AGE', 'week'))
+
+        with self.assertRaises(EnvironmentError) as raised:
+            repo._get_archive_prefix('xenial')
+
+        self.assertEqual(
+            "SNAPCRAFT_MIRROR_MAX_AGE must be a number of seconds, not "
+            "'week'", str(raised.exception))
+
+    def test_failed_mirror_is_not_selected_again(self):
+        repo._get_archive_prefix('xenial')
+
+        self.assertTrue(repo._forget_mirror())
+        self.assertEqual('ar.archive', repo._get_archive_prefix('xenial'))
+
+    def test_offline_keeps_the_mirror(self):
+        repo._get_archive_prefix('xenial')
+        os.utime(self.mirror_file, (0, 0))
+        common.set_offline(True)
+
+        self.assertEqual('archive', repo._get_archive_prefix('xenial'))
+        self.assertEqual(2, self.mock_probe.call_count)
+
+    def test_offline_without_a_mirror(self):
+        common.set_offline(True)
+
+        self.assertEqual('archive', repo._get_archive_prefix('xenial'))
+        self.assertFalse(self.mock_probe.called)
+
+    def test_forget_without_a_mirror(self):
+        self.assertFalse(repo._forget_mirror())
+
 
 class BuildPackagesTestCase(tests.TestCase):
 
+    def setUp(self):
+        super().setUp()
+        status = os.path.join(self.path, 'status')
+        with open(status, 'w') as f:
+            f.write('Package: foo\n'
+                    'Status: install ok installed\n'
+                    'Architecture: amd64\n'
+                    'Provides: foo-virtual, foo-abi (= 1)\n'
+                    '\n'
+                    'Package: bar\n'
+                    'Status: deinstall ok config-files\n'
+                    'Architecture: amd64\n')
+        patcher = unittest.mock.patch('snapcraft.repo._DPKG_STATUS', status)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_installed_packages(self):
+        self.assertEqual(
+            {'foo', 'foo:amd64', 'foo-virtual', 'foo-virtual:amd64',
+             'foo-abi', 'foo-abi:amd64'},
+            repo._get_installed_packages())
+
+    def test_is_package_installed(self):
+        self.assertTrue(repo.is_package_installed('foo'))
+        self.assertFalse(repo.is_package_installed('bar'))
+
+    @unittest.mock.patch('apt.Cache')
+    def test_installed_packages_skip_the_apt_cache(self, mock_cache):
+        repo.install_build_packages(['foo', 'foo-virtual', 'foo:amd64'])
+
+        self.assertFalse(mock_cache.called)
+
     def test_invalid_package_requested(self):
         with self.assertRaises(EnvironmentError) as raised:
             repo.install_build_packages(['package-does-not-exist'])
@@ -14,11 +14,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
+import hashlib
+import io
 import os
 import http.server
+import subprocess
+import tarfile
 import threading
 import unittest.mock
 
+import snapcraft.common
 import snapcraft.sources
 
 from snapcraft import tests
@@ -26,45 +32,269 @@ from snapcraft import tests
 
 class FakeTarballHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
 
+    extra_headers = {}
+
     def do_GET(self):
-        data = 'Test fake tarball file'
+        self.server.requests.append(self.headers)
+        if 'If-Modified-Since' in self.headers:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        data = self.server.data
         self.send_response(200)
+        self.send_header('Last-Modified', 'Wed, 01 Jun 2016 00:00:00 GMT')
+        for header, value in self.extra_headers.items():
+            self.send_header(header, value)
         self.send_header('Content-Length', len(data))
-        self.send_header('Content-type', 'text/html')
+        self.send_header('Content-type', 'application/x-gzip')
         self.end_headers()
-        self.wfile.write(data.encode())
+        self.wfile.write(data)
 
     def log_message(self, *args):
         # Overwritten so the test does not write to stderr.
         pass
 
 
+class FakeRangeHTTPRequestHandler(FakeTarballHTTPRequestHandler):
+
+    extra_headers = {'Accept-Ranges': 'bytes', 'ETag': '"1"'}
+
+    def do_GET(self):
+        if 'Range' not in self.headers:
+            return super().do_GET()
+
+        self.server.ranges.append(self.headers['Range'])
+        data = self.server.data
+        start, end = (int(i) for i in
+                      self.headers['Range'][len('bytes='):].split('-'))
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+            start, end, len(data)))
+        self.send_header('Content-Length', end - start + 1)
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+
+def make_tarball(files, fileobj=None, name=None):
+    with tarfile.open(name=name, fileobj=fileobj, mode='w:gz') as tar:
+        for path, data in files.items():
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
 class TestTar(tests.TestCase):
 
-    @unittest.mock.patch('snapcraft.sources.Tar.provision')
-    def test_pull_tarball_must_download_to_sourcedir(self, mock_prov):
+    handler_class = FakeTarballHTTPRequestHandler
+
+    def setUp(self):
+        super().setUp()
         os.environ['no_proxy'] = '127.0.0.1'
-        server = http.server.HTTPServer(
-            ('127.0.0.1', 0), FakeTarballHTTPRequestHandler)
+        server = http.server.HTTPServer(('127.0.0.1', 0), self.handler_class)
+        server.requests = []
+        server.ranges = []
+        data = io.BytesIO()
+        make_tarball({'test-1.0/a': b'a', 'test-1.0/dir/b': b'b'}, data)
+        server.data = data.getvalue()
         server_thread = threading.Thread(target=server.serve_forever)
         self.addCleanup(server_thread.join)
         self.addCleanup(server.server_close)
         self.addCleanup(server.shutdown)
         server_thread.start()
+        self.server = server
 
         plugin_name = 'test_plugin'
-        dest_dir = os.path.join('parts', plugin_name, 'src')
-        os.makedirs(dest_dir)
-        tar_file_name = 'test.tar'
-        source = 'http://{}:{}/{file_name}'.format(
-            *server.server_address, file_name=tar_file_name)
-        tar_source = snapcraft.sources.Tar(source, dest_dir)
+        self.dest_dir = os.path.join('parts', plugin_name, 'src')
+        os.makedirs(self.dest_dir)
+        self.tar_file_name = 'test.tar.gz'
+        self.source = 'http://{}:{}/{file_name}'.format(
+            *server.server_address, file_name=self.tar_file_name)
+        self.checksum = hashlib.sha256(server.data).hexdigest()
+
+    def assert_extracted(self, dst):
+        self.assertEqual(
+            sorted(['a', 'dir', self.tar_file_name]), sorted(os.listdir(dst)))
+        with open(os.path.join(dst, 'dir', 'b')) as f:
+            self.assertEqual('b', f.read())
+
+    @unittest.mock.patch('snapcraft.sources.Tar.provision')
+    def test_pull_tarball_is_extracted_while_downloading(self, mock_prov):
+        tar_source = snapcraft.sources.Tar(self.source, self.dest_dir)
 
         tar_source.pull()
 
-        mock_prov.assert_called_once_with(dest_dir)
-        with open(os.path.join(dest_dir, tar_file_name), 'r') as tar_file:
-            self.assertEqual('Test fake tarball file', tar_file.read())
+        self.assertFalse(mock_prov.called)
+        self.assert_extracted(self.dest_dir)
+        with open(os.path.join(self.dest_dir, self.tar_file_name),
+                  'rb') as tar_file:
+            self.assertEqual(self.server.data, tar_file.read())
+
+    def test_pull_tarball_with_checksum_is_downloaded_once(self):
+        tar_source = snapcraft.sources.Tar(
+            self.source, self.dest_dir, source_checksum=self.checksum)
+
+        tar_source.pull()
+        os.remove(os.path.join(self.dest_dir, self.tar_file_name))
+        tar_source.pull()
+
+        self.assertEqual(1, len(self.server.requests))
+        self.assert_extracted(self.dest_dir)
+
+    def test_pull_cached_tarball_is_not_downloaded_if_unmodified(self):
+        tar_source = snapcraft.sources.Tar(self.source, self.dest_dir)
+
+        tar_source.pull()
+        tar_source.pull()
+
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual('Wed, 01 Jun 2016 00:00:00 GMT',
+                         self.server.requests[1]['If-Modified-Since'])
+        self.assert_extracted(self.dest_dir)
+
+    def test_pull_tarball_checksum_mismatch(self):
+        tar_source = snapcraft.sources.Tar(
+            self.source, self.dest_dir, source_checksum='0' * 64)
+
+        with self.assertRaises(EnvironmentError) as raised:
+            tar_source.pull()
+
+        self.assertIn('checksum mismatch', str(raised.exception))
+        self.assertFalse(os.path.exists(tar_source._get_cached_tarball()))
+        self.assertEqual(
+            [], os.listdir(os.path.dirname(tar_source._get_cached_tarball())))
+        # Nothing from the tarball was left behind either.
+        self.assertEqual([], os.listdir(self.dest_dir))
+        self.assertEqual(['src'], os.listdir(os.path.dirname(self.dest_dir)))
+
+    def test_concurrent_pulls_download_the_tarball_once(self):
+        other_dest_dir = os.path.join('parts', 'other_plugin', 'src')
+        os.makedirs(other_dest_dir)
+        tar_sources = [
+            snapcraft.sources.Tar(self.source, dest_dir,
+                                  source_checksum=self.checksum)
+            for dest_dir in (self.dest_dir, other_dest_dir)]
+
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            list(executor.map(lambda source: source.pull(), tar_sources))
+
+        self.assertEqual(1, len(self.server.requests))
+        self.assert_extracted(self.dest_dir)
+        self.assert_extracted(other_dest_dir)
+
+    def test_prefetch_does_not_touch_sourcedir(self):
+        tar_source = snapcraft.sources.Tar(self.source, self.dest_dir)
+
+        tar_source.prefetch()
+
+        self.assertEqual([], os.listdir(self.dest_dir))
+        self.assertTrue(os.path.exists(tar_source._get_cached_tarball()))
+
+    def test_pull_offline_from_the_cache(self):
+        tar_source = snapcraft.sources.Tar(self.source, self.dest_dir)
+        tar_source.prefetch()
+        snapcraft.common.set_offline(True)
+
+        tar_source.pull()
+
+        self.assertEqual(1, len(self.server.requests))
+        self.assert_extracted(self.dest_dir)
+
+
+class TestTarSegmented(TestTar):
+
+    handler_class = FakeRangeHTTPRequestHandler
+
+    def setUp(self):
+        super().setUp()
+        patcher = unittest.mock.patch(
+            'snapcraft.sources._SEGMENTED_MIN_SIZE', 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.length = len(self.server.data)
+        self.size = -(-self.length // snapcraft.sources._SEGMENTS)
+
+    def get_partialdir(self, tar_source):
+        return tar_source._get_cached_tarball() + '.partial'
+
+    def test_pull_downloads_segments(self):
+        tar_source = snapcraft.sources.Tar(self.source, self.dest_dir)
+
+        tar_source.pull()
+
+        self.assertEqual(
+            ['bytes={}-{}'.format(
+                start, min(start + self.size, self.length) - 1)
+             for start in range(0, self.length, self.size)],
+            sorted(self.server.ranges, key=lambda r: int(r[6:].split('-')[0])))
+        self.assertFalse(os.path.exists(self.get_partialdir(tar_source)))
+
+    def test_pull_resumes_segments(self):
+        tar_source = snapcraft.sources.Tar(self.source, self.dest_dir)
+        partialdir = self.get_partialdir(tar_source)
+        os.makedirs(partialdir)
+        with open(os.path.join(partialdir, 'validator'), 'w') as f:
+            f.write('{} "1"'.format(self.length))
+        with open(os.path.join(partialdir, '0'), 'wb') as f:
+            f.write(self.server.data[:10])
+
+        tar_source.pull()
+
+        self.assertIn('bytes=10-{}'.format(self.size - 1), self.server.ranges)
+        self.assert_extracted(self.dest_dir)
+
+    def test_pull_discards_outdated_segments(self):
+        tar_source = snapcraft.sources.Tar(self.source, self.dest_dir)
+        partialdir = self.get_partialdir(tar_source)
+        os.makedirs(partialdir)
+        with open(os.path.join(partialdir, 'validator'), 'w') as f:
+            f.write('{} "0"'.format(self.length))
+        with open(os.path.join(partialdir, '0'), 'wb') as f:
+            f.write(b'outdated')
+
+        tar_source.pull()
+
+        self.assertIn('bytes=0-{}'.format(self.size - 1), self.server.ranges)
+        self.assert_extracted(self.dest_dir)
+
+
+class TestTarProvision(tests.TestCase):
+
+    def test_provision_replaces_dst(self):
+        make_tarball({'src/a': b'a'}, name='src.tar.gz')
+        os.makedirs('dst')
+        open(os.path.join('dst', 'old'), 'w').close()
+
+        snapcraft.sources.Tar('src.tar.gz', 'dst').provision('dst')
+
+        self.assertEqual(['a'], os.listdir('dst'))
+        self.assertEqual([], [d for d in os.listdir('.')
+                              if d.startswith('.dst-')])
+
+    def test_provision_on_top_of_dst(self):
+        make_tarball({'src/a': b'a'}, name='src.tar.gz')
+        os.makedirs('dst')
+        open(os.path.join('dst', 'old'), 'w').close()
+
+        snapcraft.sources.Tar('src.tar.gz', 'dst').provision(
+            'dst', clean_target=False)
+
+        self.assertEqual(['a', 'old'], sorted(os.listdir('dst')))
+
+    def test_provision_strips_common_directory_only(self):
+        make_tarball({'d/ab': b'', 'd/abc': b''}, name='src.tar.gz')
+
+        snapcraft.sources.Tar('src.tar.gz', 'dst').provision('dst')
+
+        self.assertEqual(['ab', 'abc'], sorted(os.listdir('dst')))
+
+    def test_provision_bans_dangerous_names(self):
+        make_tarball({'../a': b'', './b': b''}, name='src.tar.gz')
+
+        snapcraft.sources.Tar('src.tar.gz', 'dst').provision('dst')
+
+        self.assertEqual(['a', 'b'], sorted(os.listdir('dst')))
+        self.assertFalse(os.path.exists(os.path.join('..', 'a')))
 
 
 class SourceTestCase(tests.TestCase):
@@ -77,6 +307,13 @@ class SourceTestCase(tests.TestCase):
         self.mock_run.return_value = True
         self.addCleanup(patcher.stop)
 
+        # Each revision check sees a different revision, unless set.
+        patcher = unittest.mock.patch('subprocess.check_output')
+        self.mock_output = patcher.start()
+        self.mock_output.side_effect = lambda cmd, **kwargs: '{0} {0}'.format(
+            '_'.join(cmd)).encode()
+        self.addCleanup(patcher.stop)
+
         patcher = unittest.mock.patch('os.rmdir')
         self.mock_rmdir = patcher.start()
         self.addCleanup(patcher.stop)
@@ -89,23 +326,38 @@ class SourceTestCase(tests.TestCase):
 
 class TestBazaar(SourceTestCase):
 
+    def setUp(self):
+        super().setUp()
+        self.repo = os.path.join(
+            snapcraft.common.get_cachedir(), 'mirrors', 'bzr',
+            hashlib.sha256(b'lp:my-source').hexdigest())
+        self.mirror = os.path.join(self.repo, 'branch')
+
     def test_pull(self):
         bzr = snapcraft.sources.Bazaar('lp:my-source', 'source_dir')
 
         bzr.pull()
 
-        self.mock_rmdir.assert_called_once_with('source_dir')
-        self.mock_run.assert_called_once_with(
-            ['bzr', 'branch', 'lp:my-source', 'source_dir'])
+        self.assertFalse(self.mock_rmdir.called)
+        self.mock_run.assert_has_calls([
+            unittest.mock.call(['bzr', 'init-repo', '--no-trees',
+                                unittest.mock.ANY]),
+            unittest.mock.call(['bzr', 'branch', '--no-tree', 'lp:my-source',
+                                unittest.mock.ANY]),
+            unittest.mock.call(['bzr', 'branch', '--stacked',
+                                '--use-existing-dir', self.mirror,
+                                'source_dir']),
+        ])
+        self.assertTrue(os.path.isdir(self.repo))
 
     def test_pull_tag(self):
         bzr = snapcraft.sources.Bazaar(
             'lp:my-source', 'source_dir', source_tag='tag')
         bzr.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['bzr', 'branch', '-r', 'tag:tag', 'lp:my-source',
-             'source_dir'])
+        self.mock_run.assert_called_with(
+            ['bzr', 'branch', '--stacked', '--use-existing-dir', '-r',
+             'tag:tag', self.mirror, 'source_dir'])
 
     def test_pull_existing_with_tag(self):
         self.mock_path_exists.return_value = True
@@ -114,9 +366,31 @@ class TestBazaar(SourceTestCase):
             'lp:my-source', 'source_dir', source_tag='tag')
         bzr.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['bzr', 'pull', '-r', 'tag:tag', 'lp:my-source', '-d',
-             'source_dir'])
+        self.assertEqual([
+            unittest.mock.call(['bzr', 'pull', '--overwrite', '-d',
+                                self.mirror, 'lp:my-source']),
+            unittest.mock.call(['bzr', 'pull', '-r', 'tag:tag', self.mirror,
+                                '-d', 'source_dir']),
+        ], self.mock_run.call_args_list)
+
+    def test_pull_existing_unchanged(self):
+        self.mock_path_exists.return_value = True
+        self.mock_output.side_effect = None
+        self.mock_output.return_value = b'1 revid\n'
+
+        bzr = snapcraft.sources.Bazaar(
+            'lp:my-source', 'source_dir', source_tag='tag')
+        bzr.pull()
+
+        self.mock_output.assert_has_calls([
+            unittest.mock.call(['bzr', 'revision-info', '-d', 'source_dir',
+                                '-r', 'tag:tag'],
+                               stderr=unittest.mock.ANY),
+            unittest.mock.call(['bzr', 'revision-info', '-d', 'lp:my-source',
+                                '-r', 'tag:tag'],
+                               stderr=unittest.mock.ANY),
+        ])
+        self.assertFalse(self.mock_run.called)
 
     def test_init_with_source_branch_raises_exception(self):
         with self.assertRaises(
@@ -130,32 +404,62 @@ class TestBazaar(SourceTestCase):
 
 class TestGit(SourceTestCase):
 
+    def setUp(self):
+        super().setUp()
+        self.mirror = os.path.join(
+            snapcraft.common.get_cachedir(), 'mirrors', 'git',
+            hashlib.sha256(b'git://my-source').hexdigest())
+        self.submodule_jobs = 'submodule.fetchJobs={}'.format(
+            snapcraft.common.get_parallel_build_count())
+
+    def assert_cloned(self, branch_opts=[]):
+        self.mock_run.assert_has_calls([
+            unittest.mock.call(['git', 'clone', '--mirror', 'git://my-source',
+                                unittest.mock.ANY]),
+            unittest.mock.call(['git', '-C', unittest.mock.ANY, 'config',
+                                'gc.auto', '0']),
+            unittest.mock.call(['git', 'clone', '--shared'] + branch_opts +
+                               [self.mirror, 'source_dir']),
+            unittest.mock.call(['git', '-C', 'source_dir', 'remote',
+                                'set-url', 'origin', 'git://my-source']),
+            unittest.mock.call(['git', '-C', 'source_dir', '-c',
+                                self.submodule_jobs, 'submodule', 'update',
+                                '--init', '--recursive']),
+        ])
+        self.assertEqual(5, self.mock_run.call_count)
+
+    def assert_pulled(self, refspec):
+        self.mock_run.assert_has_calls([
+            unittest.mock.call(['git', '-C', self.mirror, 'fetch', '--prune',
+                                'origin']),
+            unittest.mock.call(['git', '-C', 'source_dir', 'pull',
+                                '--recurse-submodules=yes', self.mirror,
+                                refspec]),
+            unittest.mock.call(['git', '-C', 'source_dir', '-c',
+                                self.submodule_jobs, 'submodule', 'update'])
+        ])
+
     def test_pull(self):
         git = snapcraft.sources.Git('git://my-source', 'source_dir')
 
         git.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['git', 'clone', '--depth', '1', '--recursive', 'git://my-source',
-             'source_dir'])
+        self.assert_cloned()
+        self.assertTrue(os.path.isdir(self.mirror))
 
     def test_pull_branch(self):
         git = snapcraft.sources.Git('git://my-source', 'source_dir',
                                     source_branch='my-branch')
         git.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['git', 'clone', '--depth', '1', '--recursive', '--branch',
-             'my-branch', 'git://my-source', 'source_dir'])
+        self.assert_cloned(['--branch', 'my-branch'])
 
     def test_pull_tag(self):
         git = snapcraft.sources.Git('git://my-source', 'source_dir',
                                     source_tag='tag')
         git.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['git', 'clone', '--depth', '1', '--recursive', '--branch', 'tag',
-             'git://my-source', 'source_dir'])
+        self.assert_cloned(['--branch', 'tag'])
 
     def test_pull_existing(self):
         self.mock_path_exists.return_value = True
@@ -163,13 +467,7 @@ class TestGit(SourceTestCase):
         git = snapcraft.sources.Git('git://my-source', 'source_dir')
         git.pull()
 
-        self.mock_run.assert_has_calls([
-            unittest.mock.call(['git', '-C', 'source_dir', 'pull',
-                                '--recurse-submodules=yes', 'git://my-source',
-                                'HEAD']),
-            unittest.mock.call(['git', '-C', 'source_dir', 'submodule',
-                                'update'])
-        ])
+        self.assert_pulled('HEAD')
 
     def test_pull_existing_with_tag(self):
         self.mock_path_exists.return_value = True
@@ -178,13 +476,7 @@ class TestGit(SourceTestCase):
                                     source_tag='tag')
         git.pull()
 
-        self.mock_run.assert_has_calls([
-            unittest.mock.call(['git', '-C', 'source_dir', 'pull',
-                                '--recurse-submodules=yes', 'git://my-source',
-                                'refs/tags/tag']),
-            unittest.mock.call(['git', '-C', 'source_dir', 'submodule',
-                                'update'])
-        ])
+        self.assert_pulled('refs/tags/tag')
 
     def test_pull_existing_with_branch(self):
         self.mock_path_exists.return_value = True
@@ -193,13 +485,65 @@ class TestGit(SourceTestCase):
                                     source_branch='my-branch')
         git.pull()
 
-        self.mock_run.assert_has_calls([
-            unittest.mock.call(['git', '-C', 'source_dir', 'pull',
-                                '--recurse-submodules=yes', 'git://my-source',
-                                'refs/heads/my-branch']),
-            unittest.mock.call(['git', '-C', 'source_dir', 'submodule',
-                                'update'])
+        self.assert_pulled('refs/heads/my-branch')
+
+    def test_pull_existing_unchanged(self):
+        self.mock_path_exists.return_value = True
+        self.mock_output.side_effect = None
+        self.mock_output.return_value = b'1234\trefs/heads/my-branch\n'
+
+        git = snapcraft.sources.Git('git://my-source', 'source_dir',
+                                    source_branch='my-branch')
+        git.pull()
+
+        self.mock_output.assert_has_calls([
+            unittest.mock.call(['git', '-C', 'source_dir', 'rev-parse',
+                                'refs/heads/my-branch'],
+                               stderr=unittest.mock.ANY),
+            unittest.mock.call(['git', 'ls-remote', 'git://my-source',
+                                'refs/heads/my-branch'],
+                               stderr=unittest.mock.ANY),
         ])
+        self.assertFalse(self.mock_run.called)
+
+    def test_pull_existing_when_the_remote_check_fails(self):
+        self.mock_path_exists.return_value = True
+        self.mock_output.side_effect = subprocess.CalledProcessError(
+            128, ['git'])
+
+        git = snapcraft.sources.Git('git://my-source', 'source_dir')
+        git.pull()
+
+        self.assert_pulled('HEAD')
+
+    def test_mirror_is_refreshed_once_per_run(self):
+        self.mock_path_exists.return_value = True
+
+        snapcraft.sources.Git('git://my-source', 'source_dir').pull()
+        snapcraft.sources.Git('git://my-source', 'other_dir').prefetch()
+
+        fetch = unittest.mock.call(
+            ['git', '-C', self.mirror, 'fetch', '--prune', 'origin'])
+        self.assertEqual(1, self.mock_run.call_args_list.count(fetch))
+
+    def test_pull_offline_from_the_mirror(self):
+        snapcraft.common.set_offline(True)
+        self.mock_path_exists.side_effect = lambda path: path == self.mirror
+
+        snapcraft.sources.Git('git://my-source', 'source_dir').pull()
+
+        self.mock_run.assert_any_call(
+            ['git', 'clone', '--shared', self.mirror, 'source_dir'])
+
+    def test_pull_local_repository_is_not_shared(self):
+        git = snapcraft.sources.Git(self.path, 'source_dir')
+
+        git.pull()
+
+        self.mock_run.assert_any_call(
+            ['git', 'clone', self.path, 'source_dir'])
+        self.assertFalse(os.path.isdir(os.path.join(
+            snapcraft.common.get_cachedir(), 'mirrors', 'git')))
 
     def test_init_with_source_branch_and_tag_raises_exception(self):
         with self.assertRaises(
@@ -214,30 +558,48 @@ class TestGit(SourceTestCase):
 
 class TestMercurial(SourceTestCase):
 
+    def setUp(self):
+        super().setUp()
+        self.mirror = os.path.join(
+            snapcraft.common.get_cachedir(), 'mirrors', 'hg',
+            hashlib.sha256(b'hg://my-source').hexdigest())
+
+    def assert_shared(self, rev=[]):
+        self.assertEqual([
+            unittest.mock.call(['hg', 'clone', '-U', '--uncompressed',
+                                'hg://my-source', unittest.mock.ANY]),
+            unittest.mock.call(['hg', '--config', 'extensions.share=',
+                                'share', '-U', self.mirror, 'source_dir']),
+            unittest.mock.call(['hg', '-R', 'source_dir', 'update'] + rev),
+        ], self.mock_run.call_args_list)
+
+    def assert_pulled(self, ref=[], rev=[]):
+        self.assertEqual([
+            unittest.mock.call(['hg', '-R', self.mirror, 'pull']),
+            unittest.mock.call(
+                ['hg', '-R', 'source_dir', 'pull'] + ref + [self.mirror]),
+            unittest.mock.call(['hg', '-R', 'source_dir', 'update'] + rev),
+        ], self.mock_run.call_args_list)
+
     def test_pull(self):
         hg = snapcraft.sources.Mercurial('hg://my-source', 'source_dir')
         hg.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['hg', 'clone', 'hg://my-source', 'source_dir'])
+        self.assert_shared()
 
     def test_pull_branch(self):
         hg = snapcraft.sources.Mercurial('hg://my-source', 'source_dir',
                                          source_branch='my-branch')
         hg.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['hg', 'clone', '-u', 'my-branch', 'hg://my-source',
-             'source_dir'])
+        self.assert_shared(['my-branch'])
 
     def test_pull_tag(self):
         hg = snapcraft.sources.Mercurial('hg://my-source', 'source_dir',
                                          source_tag='tag')
         hg.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['hg', 'clone', '-u', 'tag', 'hg://my-source',
-             'source_dir'])
+        self.assert_shared(['tag'])
 
     def test_pull_existing(self):
         self.mock_path_exists.return_value = True
@@ -245,8 +607,7 @@ class TestMercurial(SourceTestCase):
         hg = snapcraft.sources.Mercurial('hg://my-source', 'source_dir')
         hg.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['hg', 'pull', 'hg://my-source'])
+        self.assert_pulled()
 
     def test_pull_existing_with_tag(self):
         self.mock_path_exists.return_value = True
@@ -255,8 +616,7 @@ class TestMercurial(SourceTestCase):
                                          source_tag='tag')
         hg.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['hg', 'pull', '-r', 'tag', 'hg://my-source'])
+        self.assert_pulled(['-r', 'tag'], ['tag'])
 
     def test_pull_existing_with_branch(self):
         self.mock_path_exists.return_value = True
@@ -265,8 +625,25 @@ class TestMercurial(SourceTestCase):
                                          source_branch='my-branch')
         hg.pull()
 
-        self.mock_run.assert_called_once_with(
-            ['hg', 'pull', '-b', 'my-branch', 'hg://my-source'])
+        self.assert_pulled(['-b', 'my-branch'], ['my-branch'])
+
+    def test_pull_existing_unchanged(self):
+        self.mock_path_exists.return_value = True
+        self.mock_output.side_effect = None
+        self.mock_output.return_value = b'a1b2c3\n'
+
+        hg = snapcraft.sources.Mercurial('hg://my-source', 'source_dir')
+        hg.pull()
+
+        self.mock_output.assert_has_calls([
+            unittest.mock.call(['hg', '-R', 'source_dir', 'identify', '--id',
+                                '-r', '.'],
+                               stderr=unittest.mock.ANY),
+            unittest.mock.call(['hg', 'identify', '--id', '-r', 'default',
+                                'hg://my-source'],
+                               stderr=unittest.mock.ANY),
+        ])
+        self.assertFalse(self.mock_run.called)
 
     def test_init_with_source_branch_and_tag_raises_exception(self):
         with self.assertRaises(
@@ -281,6 +658,45 @@ class TestMercurial(SourceTestCase):
         self.assertEqual(raised.exception.message, expected_message)
 
 
+class TestOffline(SourceTestCase):
+
+    scenarios = [
+        ('bzr', {'source_class': snapcraft.sources.Bazaar,
+                 'source': 'lp:my-source'}),
+        ('git', {'source_class': snapcraft.sources.Git,
+                 'source': 'git://my-source'}),
+        ('hg', {'source_class': snapcraft.sources.Mercurial,
+                'source': 'hg://my-source'}),
+        ('tar', {'source_class': snapcraft.sources.Tar,
+                 'source': 'http://my-source/a.tar.gz'}),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        snapcraft.common.set_offline(True)
+
+    def test_pull_missing(self):
+        source = self.source_class(self.source, 'source_dir')
+
+        with self.assertRaises(snapcraft.common.MissingArtifactsError) as e:
+            source.pull()
+
+        self.assertEqual([self.source], e.exception.artifacts)
+        self.assertFalse(self.mock_run.called)
+
+    @unittest.mock.patch.object(snapcraft.sources.Tar, 'provision')
+    def test_pull_existing(self, mock_provision):
+        self.mock_path_exists.return_value = True
+        source = self.source_class(self.source, 'source_dir')
+
+        with unittest.mock.patch(
+                'snapcraft.sources._get_session') as mock_session:
+            source.pull()
+
+        self.assertFalse(self.mock_run.called)
+        self.assertFalse(mock_session.called)
+
+
 class TestLocal(tests.TestCase):
 
     def test_pull_with_existing_source_dir_creates_symlink(self):
@@ -380,3 +796,29 @@ class TestUri(tests.TestCase):
 
                 mock_pull.assert_called_once_with()
                 mock_pull.reset_mock()
+
+    @unittest.mock.patch('snapcraft.sources.Tar.pull')
+    def test_get_tar_source_with_checksum(self, mock_pull):
+        options = tests.MockOptions(source='https://golang.tar.gz',
+                                    source_checksum='abc')
+
+        with unittest.mock.patch('snapcraft.sources.Tar.__init__',
+                                 return_value=None) as mock_init:
+            snapcraft.sources.get(
+                sourcedir='dummy', builddir='dummy', options=options)
+
+        mock_init.assert_called_once_with(
+            'https://golang.tar.gz', 'dummy', None, None, 'abc')
+
+    def test_get_checksum_for_non_tar_source(self):
+        options = tests.MockOptions(source='lp:snapcraft_test_source',
+                                    source_checksum='abc')
+
+        with self.assertRaises(
+                snapcraft.sources.IncompatibleOptionsError) as raised:
+            snapcraft.sources.get(
+                sourcedir='dummy', builddir='dummy', options=options)
+
+        self.assertEqual(
+            'can\'t specify a source-checksum for a non tar source',
+            raised.exception.message)
@@ -108,6 +108,35 @@ class DownloadTestCase(DownloadBaseTestCase):
             call("Successfully downloaded 'os'")])
         self.assertTrue(os.path.exists('os.snap'))
 
+    def test_download_replaces_the_previous_snap(self):
+        with open('os.snap', 'wb') as f:
+            f.write(b'0000000')
+        os.link('os.snap', 'linked.snap')
+
+        snap_content = b'1234567890'
+        snap_sha512 = ('12b03226a6d8be9c6e8cd5e55dc6c7920caaa39df14aab92d5e'
+                       '3ea9340d1c8a4d3d0b8e4314f1f6ef131ba4bf1ceb9186ab87c'
+                       '801af0d5c95b1befb8cedae2b9')
+        mock_details = self.mock_get.return_value
+        mock_details.ok = True
+        mock_details.content = json.dumps({
+            'download_url': 'http://localhost',
+            'download_sha512': snap_sha512,
+        }).encode('utf-8')
+        mock_snap = Response()
+        mock_snap.status_code = 200
+        mock_snap._content = snap_content
+
+        self.mock_get.side_effect = [mock_details, mock_snap]
+
+        download('os', 'os.snap', None, 'amd64')
+
+        with open('os.snap', 'rb') as f:
+            self.assertEqual(snap_content, f.read())
+        with open('linked.snap', 'rb') as f:
+            self.assertEqual(b'0000000', f.read())
+        self.assertEqual(['linked.snap', 'os.snap'], sorted(os.listdir()))
+
     def test_download_fails_due_to_hash_mismatch(self):
         snap_content = b'1234567890'
         mock_details = self.mock_get.return_value
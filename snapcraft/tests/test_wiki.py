@@ -18,6 +18,8 @@ import unittest.mock
 
 import snapcraft.wiki
 
+from snapcraft import common
+
 from snapcraft.tests import TestCase
 
 
@@ -74,3 +76,33 @@ class TestYaml(TestCase):
             self.w.compose('part-not-in-wiki',
                            {'source': '.', 'another': 'different'})
         self.assertEqual(raised.exception.args, ('part-not-in-wiki',))
+
+
+class TestOffline(TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        patcher = unittest.mock.patch('requests.get')
+        self.mock_requests = patcher.start()
+        self.mock_requests.return_value.text = \
+            '{{{part-in-wiki: {plugin: go}}}}'
+        self.addCleanup(patcher.stop)
+
+    def test_offline_uses_the_last_fetched_copy(self):
+        snapcraft.wiki.Wiki().get_part('part-in-wiki')
+        common.set_offline(True)
+
+        part = snapcraft.wiki.Wiki().get_part('part-in-wiki')
+
+        self.assertEqual({'plugin': 'go'}, part)
+        self.assertEqual(1, self.mock_requests.call_count)
+
+    def test_offline_without_a_copy(self):
+        common.set_offline(True)
+
+        with self.assertRaises(common.MissingArtifactsError) as raised:
+            snapcraft.wiki.Wiki().get_part('part-in-wiki')
+
+        self.assertEqual([snapcraft.wiki.PARTS_URI],
+                         raised.exception.artifacts)
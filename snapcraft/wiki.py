@@ -15,9 +15,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+
 import requests
 import yaml
 
+from snapcraft import common
+
 PARTS_URI = 'https://wiki.ubuntu.com/Snappy/Parts'
 PARTS_URI_PARAMS = {'action': 'raw'}
 
@@ -32,8 +36,7 @@ class Wiki:
 
     def _fetch(self):
         if self.wiki_parts is None:
-            raw_content = requests.get(PARTS_URI, params=PARTS_URI_PARAMS)
-            content = raw_content.text.strip()
+            content = _get_content().strip()
 
             if content.startswith(_WIKI_OPEN):
                 content = content[len(_WIKI_OPEN):].strip()
@@ -69,3 +72,21 @@ class Wiki:
         properties['plugin'] = wiki_properties.get('plugin', None)
 
         return properties
+
+
+def _get_content():
+    # The last fetched copy is kept to be used offline.
+    cache_file = os.path.join(common.get_cachedir(), 'wiki-parts')
+    if common.get_offline():
+        try:
+            with open(cache_file) as f:
+                return f.read()
+        except FileNotFoundError:
+            raise common.MissingArtifactsError([PARTS_URI])
+
+    content = requests.get(PARTS_URI, params=PARTS_URI_PARAMS).text
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file, 'w') as f:
+        f.write(content)
+
+    return content